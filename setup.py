@@ -14,6 +14,8 @@ setup(
     package_dir={'': 'src'},
     download_url='http://pypi.python.org/packages/source/r/recall/recall-%s.tar.gz' % version,
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['recall-replay = recall.replay:main']},
     package_data={'': ['requirements.txt']},
     install_requires=[
         item for item in
@@ -0,0 +1,270 @@
+import collections
+import multiprocessing.pool
+import threading
+import uuid
+
+import recall.models
+import recall.repository
+
+
+class Result(object):
+    """
+    The result of an operation which has already completed. It offers the same
+    interface as the :class:`multiprocessing.pool.AsyncResult` of operations
+    run on worker threads, so callers need not tell the two apart.
+
+    :param value: The value of the operation
+    :type value: :class:`object`
+
+    :param error: The exception raised by the operation, if it failed
+    :type error: :class:`Exception`
+    """
+    def __init__(self, value=None, error=None):
+        assert isinstance(error, (Exception, type(None)))
+        self._value = value
+        self._error = error
+
+    def get(self, timeout=None):
+        """
+        Get the value of the operation, or raise its exception
+
+        :param timeout: Ignored, the operation has completed
+        :type timeout: :class:`float`
+
+        :rtype: :class:`object`
+        """
+        if self._error:
+            raise self._error
+
+        return self._value
+
+    def wait(self, timeout=None):
+        """
+        Wait for the operation, which has already completed
+
+        :param timeout: Ignored, the operation has completed
+        :type timeout: :class:`float`
+        """
+        pass
+
+    def ready(self):
+        """
+        :rtype: :class:`bool`
+        """
+        return True
+
+    def successful(self):
+        """
+        :rtype: :class:`bool`
+        """
+        return self._error is None
+
+
+class Service(object):
+    """
+    An asynchronous counterpart of a synchronous service. Every operation
+    returns at once with a result object offering ``get``, ``wait``,
+    ``ready`` and ``successful``, like
+    :class:`multiprocessing.pool.AsyncResult`.
+
+    Only the repository has a counterpart. The redis, pika and memcache
+    clients all block, so asynchronous stores and routers would each need a
+    thread per call in flight, and the repository would have to be written
+    again around them. Running whole loads and saves on worker threads
+    keeps as many calls in flight with the synchronous services.
+
+    :param threads: The number of worker threads, or 0 to complete every
+                    operation in the calling thread
+    :type threads: :class:`int`
+    """
+    def __init__(self, threads):
+        assert isinstance(threads, int) and threads >= 0
+        self._pool = (multiprocessing.pool.ThreadPool(threads)
+                      if threads else None)
+
+    def close(self):
+        """
+        Wait for pending operations and stop the worker threads
+        """
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+
+    def _submit(self, func, *args):
+        """
+        Run an operation, in a worker thread if there are any
+
+        :param func: The operation
+        :type func: :class:`collections.Callable`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(func, collections.Callable)
+        if self._pool:
+            return self._pool.apply_async(func, args)
+
+        try:
+            return Result(func(*args))
+        except Exception as error:
+            return Result(error=error)
+
+
+class Repository(Service):
+    """
+    The asynchronous counterpart of :class:`recall.repository.Repository`.
+    Loads and saves run on worker threads, so many of them can be in flight
+    at once while the synchronous repository keeps working as before.
+    Concurrent loads of the same aggregate root share a single load.
+
+    The synchronous repository isn't safe to use from several threads at
+    once for the same aggregate root, which it may hold in its identity map.
+    Operations are therefore run one at a time per aggregate root: each
+    holds a lock for every root it loads or saves, taken in GUID order so
+    operations on several roots can't deadlock.
+
+    This is a facade over the blocking stores, not an event loop: no more
+    operations are in flight at once than there are worker threads, and the
+    others queue until a thread is free.
+
+    An aggregate root must not be changed while a save of it is in flight.
+
+    :param repository: The synchronous repository
+    :type repository: :class:`recall.repository.Repository`
+
+    :param threads: The number of worker threads
+    :type threads: :class:`int`
+    """
+    def __init__(self, repository, threads=16):
+        assert isinstance(repository, recall.repository.Repository)
+        super(Repository, self).__init__(threads)
+        self.repository = repository
+        self._loading = {}
+        self._locks = {}
+        self._lock = threading.RLock()
+
+    def load(self, guid):
+        """
+        Get an aggregate root by GUID
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(guid, uuid.UUID)
+
+        def load():
+            try:
+                return self._run([guid], self.repository.load, guid)
+            finally:
+                with self._lock:
+                    self._loading.pop(guid, None)
+
+        with self._lock:
+            result = self._loading.get(guid)
+            if result is None:
+                result = self._submit(load)
+                if not result.ready():
+                    self._loading[guid] = result
+
+            return result
+
+    def load_many(self, guids):
+        """
+        Get many aggregate roots by GUID
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(guids, collections.Iterable)
+        guids = list(guids)
+        return self._submit(self._run, guids, self.repository.load_many, guids)
+
+    def save(self, root):
+        """
+        Save an aggregate root
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        return self._submit(self._run, [root.guid], self.repository.save, root)
+
+    def save_many(self, roots):
+        """
+        Save many aggregate roots as one unit of work
+
+        :param roots: The aggregate roots
+        :type roots: :class:`collections.Iterable`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(roots, collections.Iterable)
+        roots = list(roots)
+        return self._submit(self._run, [root.guid for root in roots],
+                            self.repository.save_many, roots)
+
+    def execute(self, guid, command, attempts=3):
+        """
+        Load an aggregate root, apply a command to it and save it, retrying on
+        concurrent writes. See :meth:`recall.repository.Repository.execute`.
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param command: Applies the command to the aggregate root
+        :type command: :class:`collections.Callable`
+
+        :param attempts: The maximum number of attempts
+        :type attempts: :class:`int`
+
+        :rtype: :class:`multiprocessing.pool.AsyncResult`
+        """
+        assert isinstance(guid, uuid.UUID)
+        return self._submit(self._run, [guid], self.repository.execute,
+                            guid, command, attempts)
+
+    def _run(self, guids, func, *args):
+        """
+        Run an operation of the synchronous repository, holding the locks of
+        the aggregate roots it loads or saves
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
+
+        :param func: The operation
+        :type func: :class:`collections.Callable`
+
+        :rtype: :class:`object`
+        """
+        assert isinstance(guids, list)
+        assert isinstance(func, collections.Callable)
+        guids = sorted(set(guids))
+        with self._lock:
+            locks = []
+            for guid in guids:
+                entry = self._locks.setdefault(guid, [threading.Lock(), 0])
+                entry[1] += 1
+                locks.append(entry[0])
+
+        held = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                held.append(lock)
+
+            return func(*args)
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+            with self._lock:
+                for guid in guids:
+                    entry = self._locks[guid]
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[guid]
@@ -1,10 +1,36 @@
 import recall.models
 
 
+def handles(*event_classes):
+    """
+    Decorate a domain entity's method as the handler of the given domain
+    events, and of events of their subclasses::
+
+        class Company(recall.models.AggregateRoot):
+            @recall.event_handler.handles(CompanyFounded)
+            def _when_founded(self, event):
+                self.guid = event["guid"]
+
+    :param event_classes: The event classes to handle
+    :type event_classes: :class:`tuple`
+
+    :rtype: :class:`types.FunctionType`
+    """
+    for event_cls in event_classes:
+        assert isinstance(event_cls, type(recall.models.Event))
+
+    def decorate(func):
+        func._handles = getattr(func, "_handles", ()) + event_classes
+        return func
+
+    return decorate
+
+
 class DomainEventHandler(object):
     """
     A simple object representing the state change of a domain once an event
-    occurs.
+    occurs. An entity creates one instance of each handler class it uses and
+    reuses it for every event, so handlers shouldn't keep state of their own.
 
     :param entity: The domain entity
     :type entity: :class:`recall.models.Entity`
@@ -1,7 +1,101 @@
 import datetime
+import threading
 import uuid
 
 import recall.locators
+import recall.models
+
+
+class TypeRegistry(object):
+    """
+    Resolve the type names of marshaled events to their classes, and back.
+
+    Classes are named by their fully-qualified class name unless they are
+    registered with a shorter alias, which makes payloads smaller. Readers
+    must register the same aliases; fully-qualified names keep resolving
+    either way. A name which hasn't been registered is imported the first
+    time it is seen, and the class it resolves to is kept, so every later
+    lookup is a single :class:`dict` access.
+    """
+    def __init__(self):
+        self._classes = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def register(self, cls, alias=None):
+        """
+        Register an event class, optionally under an alias
+
+        :param cls: The event class
+        :type cls: :class:`type`
+
+        :param alias: The short name to marshal the class as
+        :type alias: :class:`str`
+        """
+        assert isinstance(cls, type)
+        assert isinstance(alias, (str, type(None)))
+        fqcn = ".".join([cls.__module__, cls.__name__])
+        with self._lock:
+            for name in filter(None, [fqcn, alias]):
+                if self._classes.get(name, cls) is not cls:
+                    raise ValueError("%s is already registered for %s"
+                                     % (name, self._classes[name]))
+
+            self._classes[fqcn] = cls
+            self._names[cls] = fqcn
+            if alias:
+                self._classes[alias] = cls
+                self._names[cls] = alias
+
+    def get_name(self, cls):
+        """
+        Get the name to marshal an event class as
+
+        :param cls: The event class
+        :type cls: :class:`type`
+
+        :rtype: :class:`str`
+        """
+        name = self._names.get(cls)
+        if name is None:
+            name = ".".join([cls.__module__, cls.__name__])
+            with self._lock:
+                self._classes.setdefault(name, cls)
+                name = self._names.setdefault(cls, name)
+
+        return name
+
+    def resolve(self, name):
+        """
+        Get the event class of a marshaled type name, importing it on first
+        use if it wasn't registered. Raises :class:`NameError` for a name
+        which resolves to no class.
+
+        :param name: The alias or fully-qualified class name
+        :type name: :class:`str`
+
+        :rtype: :class:`type`
+        """
+        cls = self._classes.get(name)
+        if cls is None:
+            module_name, _, class_name = name.rpartition(".")
+            if not module_name or not class_name:
+                raise NameError("%s is neither a registered alias nor a "
+                                "fully-qualified class name" % name)
+
+            mdl = __import__(module_name, globals(), locals(), [class_name], 0)
+            cls = getattr(mdl, class_name, None)
+            if not isinstance(cls, type):
+                raise NameError("Could not instantiate %s" % name)
+
+            with self._lock:
+                cls = self._classes.setdefault(name, cls)
+
+        return cls
+
+
+#: The type registry of marshalers which aren't given their own
+DEFAULT_REGISTRY = TypeRegistry()
 
 
 class EventMarshaler(object):
@@ -14,10 +108,63 @@ class EventMarshaler(object):
         """
         raise NotImplementedError()
 
+    def encode(self, event, encoder):
+        """
+        Marshal a domain event and encode it with a function like
+        :func:`json.dumps`. The result is kept on the event, so every store
+        and router encoding it the same way during a save shares the work.
+
+        :param event: The domain event
+        :type event: :class:`recall.models.Event`
+
+        :param encoder: Encodes the marshaled event
+        :type encoder: :class:`collections.Callable`
+
+        :rtype: :class:`str`
+        """
+        cache = _get_cache(event)
+        key = (self._get_cache_key(), encoder)
+        encoded = cache.get(key)
+        if encoded is None:
+            encoded = cache[key] = encoder(self.marshal(event))
+
+        return encoded
+
+    def _get_cache_key(self):
+        """
+        Get the key of the forms this marshaler keeps on events, which is
+        shared by the marshalers producing the same forms
+
+        :rtype: :class:`object`
+        """
+        return self.__class__
+
 
 class DefaultEventMarshaler(EventMarshaler):
-    def __init__(self):
+    """
+    Marshal domain events to :class:`dict` structures of their type name and
+    data, with datetimes and UUIDs tagged
+
+    :param registry: Resolves type names (by default, the shared registry)
+    :type registry: :class:`recall.event_marshaler.TypeRegistry`
+    """
+    #: Field types whose values are marshaled as they are
+    PLAIN_TYPES = frozenset([str, unicode, int, long, float, bool])
+
+    #: Field types whose values are tagged, with the names of their converters
+    TAGGED_TYPES = {
+        uuid.UUID: ("_uuid_to_builtin", "_uuid_from_builtin"),
+        datetime.datetime: ("_datetime_to_builtin", "_datetime_from_builtin"),
+        datetime.date: ("_datetime_to_builtin", "_date_from_builtin")}
+
+    def __init__(self, registry=None):
+        assert isinstance(registry, (TypeRegistry, type(None)))
         self._locator = recall.locators.Locator({})
+        self.registry = DEFAULT_REGISTRY if registry is None else registry
+        self._codecs = {}
+
+    def _get_cache_key(self):
+        return self.__class__, self.registry
 
     def _to_builtin(self, obj):
         """
@@ -31,7 +178,7 @@ class DefaultEventMarshaler(EventMarshaler):
         if isinstance(obj, dict):
             return {k: self._to_builtin(v) for k, v in obj.items()}
         if isinstance(obj, (list, tuple)):
-            return (self._to_builtin(v) for v in obj)
+            return [self._to_builtin(v) for v in obj]
         if isinstance(obj, (datetime.datetime, datetime.date)):
             return {"__datetime__": True, "datetime": obj.isoformat()}
         if isinstance(obj, uuid.UUID):
@@ -48,27 +195,39 @@ class DefaultEventMarshaler(EventMarshaler):
         :rtype: :class:`object`
         """
         if isinstance(obj, dict) and "__datetime__" in obj:
-            return datetime.datetime.strptime(
-                obj["datetime"],
-                "%Y-%m-%dT%H:%M:%S.%f")
+            # Dates are tagged like datetimes, but without the time
+            if len(obj["datetime"]) == 10:
+                return _date_from_builtin(obj)
+
+            return _datetime_from_builtin(obj)
         if isinstance(obj, dict) and "__uuid__" in obj:
             return uuid.UUID("urn:uuid:%s" % obj["uuid"])
         if isinstance(obj, dict):
             return {k: self._from_builtin(v) for k, v in obj.items()}
         if isinstance(obj, (list, tuple)):
-            return (self._from_builtin(v) for v in obj)
+            return [self._from_builtin(v) for v in obj]
         return obj
 
     def marshal(self, event):
         """
-        Marshal a domain event to a structure of built-in types
+        Marshal a domain event to a structure of built-in types. The structure
+        is kept on the event and shared by later calls, so it mustn't be
+        changed.
 
         :param event: The domain event
         :type event: :class:`recall.models.Event`
         """
-        return {
-            "__type__": ".".join([event.__module__, event.__class__.__name__]),
-            "data": self._to_builtin(event._data)}
+        cache = _get_cache(event)
+        key = self._get_cache_key()
+        marshaled = cache.get(key)
+        if marshaled is None:
+            codec = self._get_codec(event.__class__)
+            marshaled = cache[key] = {
+                "__type__": self.registry.get_name(event.__class__),
+                "data": (codec[0](event) if codec
+                         else self._to_builtin(event._data))}
+
+        return marshaled
 
     def unmarshal(self, marshaled):
         """
@@ -77,11 +236,196 @@ class DefaultEventMarshaler(EventMarshaler):
         :param marshaled: A domain event marshaled to builtin types
         :type marshaled: :class:`object`
         """
-        fqcn = marshaled["__type__"]
-        class_name = fqcn.split(".")[-1]
-        module_name = ".".join(fqcn.split(".")[0:-1])
-        mdl = __import__(module_name, globals(), locals(), [class_name], 0)
-        if class_name not in dir(mdl):
-            raise NameError("Could not instantiate %s" % fqcn)
-        cls = getattr(mdl, class_name)
+        cls = self.registry.resolve(marshaled["__type__"])
+        codec = self._get_codec(cls)
+        if codec:
+            return codec[1](marshaled["data"])
+
         return cls(**self._from_builtin(marshaled["data"]))
+
+    def _get_codec(self, cls):
+        """
+        Get the (marshal, unmarshal) functions generated for the data of a
+        declarative event class, or None for other events
+
+        :param cls: The event class
+        :type cls: :class:`type`
+
+        :rtype: :class:`tuple`
+        """
+        try:
+            return self._codecs[cls]
+        except KeyError:
+            codec = self._codecs[cls] = (
+                self._make_codec(cls)
+                if issubclass(cls, recall.models.DeclarativeEvent) else None)
+            return codec
+
+    def _make_codec(self, cls):
+        """
+        Generate the (marshal, unmarshal) functions for the data of a
+        declarative event class. Each field is converted according to its
+        declared type, in straight-line code compiled once for the class;
+        fields without a type are converted like any other value. The data
+        is the same as the generic conversion's, so either can read it.
+
+        :param cls: The event class
+        :type cls: :class:`type`
+
+        :rtype: :class:`tuple`
+        """
+        assert issubclass(cls, recall.models.DeclarativeEvent)
+        marshal = []
+        unmarshal = []
+        for index, field in enumerate(cls._fields):
+            field_type = cls._field_types.get(field)
+            value = "v[%d]" % index
+            data = "d[%r]" % field
+            if field_type in self.PLAIN_TYPES:
+                marshal.append(value)
+                unmarshal.append(data)
+            elif field_type in self.TAGGED_TYPES:
+                to_builtin, from_builtin = self.TAGGED_TYPES[field_type]
+                marshal.append("%s(%s)" % (to_builtin, value))
+                unmarshal.append("%s(%s)" % (from_builtin, data))
+            else:
+                marshal.append("to_builtin(%s)" % value)
+                unmarshal.append("from_builtin(%s)" % data)
+
+        source = (
+            "def marshal(event):\n"
+            "    v = event._values\n"
+            "    return {%s}\n"
+            "def unmarshal(d):\n"
+            "    return cls(%s)\n") % (
+            ", ".join("%r: %s" % (field, expr)
+                      for field, expr in zip(cls._fields, marshal)),
+            ", ".join("%s=%s" % (field, expr)
+                      for field, expr in zip(cls._fields, unmarshal)))
+        namespace = dict(
+            globals(), cls=cls, to_builtin=self._to_builtin,
+            from_builtin=self._from_builtin)
+        exec(source, namespace)
+        return namespace["marshal"], namespace["unmarshal"]
+
+
+class NativeEventMarshaler(DefaultEventMarshaler):
+    """
+    Marshal domain events like :class:`DefaultEventMarshaler`, but leave
+    UUIDs, datetimes and dates as they are, for encodings which support them
+    natively, like :class:`recall.serializer.Binary`
+
+    :param registry: Resolves type names (by default, the shared registry)
+    :type registry: :class:`recall.event_marshaler.TypeRegistry`
+    """
+    PLAIN_TYPES = DefaultEventMarshaler.PLAIN_TYPES | frozenset([
+        uuid.UUID, datetime.datetime, datetime.date])
+    TAGGED_TYPES = {}
+
+    def _to_builtin(self, obj):
+        if isinstance(obj, dict):
+            return {k: self._to_builtin(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self._to_builtin(v) for v in obj]
+        return obj
+
+    def _from_builtin(self, obj):
+        if isinstance(obj, dict):
+            return {k: self._from_builtin(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self._from_builtin(v) for v in obj]
+        return obj
+
+
+def _uuid_to_builtin(value):
+    if value is None:
+        return None
+
+    return {"__uuid__": True, "uuid": str(value)}
+
+
+def _uuid_from_builtin(obj):
+    if obj is None:
+        return None
+
+    return uuid.UUID(obj["uuid"])
+
+
+def _datetime_to_builtin(value):
+    if value is None:
+        return None
+
+    return {"__datetime__": True, "datetime": value.isoformat()}
+
+
+def _datetime_from_builtin(obj):
+    if obj is None:
+        return None
+
+    # Slicing the fixed-width format is many times faster than strptime
+    text = obj["datetime"]
+    if len(text) == 19:
+        return datetime.datetime(
+            int(text[0:4]), int(text[5:7]), int(text[8:10]),
+            int(text[11:13]), int(text[14:16]), int(text[17:19]))
+    if len(text) == 26:
+        return datetime.datetime(
+            int(text[0:4]), int(text[5:7]), int(text[8:10]),
+            int(text[11:13]), int(text[14:16]), int(text[17:19]),
+            int(text[20:26]))
+
+    return datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _date_from_builtin(obj):
+    if obj is None:
+        return None
+
+    text = obj["datetime"]
+    return datetime.date(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+
+
+def _get_cache(event):
+    """
+    Get the marshaled and encoded forms kept on a domain event
+
+    :param event: The domain event
+    :type event: :class:`recall.models.Event`
+
+    :rtype: :class:`dict`
+    """
+    cache = getattr(event, "_encoded", None)
+    if cache is None:
+        cache = event._encoded = {}
+
+    return cache
+
+
+def get_encoded_size(event):
+    """
+    Get the length of an encoded form kept on a domain event, e.g. the record
+    an event store wrote during the save, or None if it has none
+
+    :param event: The domain event
+    :type event: :class:`recall.models.Event`
+
+    :rtype: :class:`int`
+    """
+    for form in (getattr(event, "_encoded", None) or {}).values():
+        if isinstance(form, str):
+            return len(form)
+
+    return None
+
+
+def clear_cache(events):
+    """
+    Drop the marshaled and encoded forms kept on domain events, once they have
+    been saved and routed
+
+    :param events: The domain events
+    :type events: :class:`collections.Iterable`
+    """
+    for event in events:
+        if getattr(event, "_encoded", None) is not None:
+            event._encoded = None
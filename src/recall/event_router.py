@@ -1,3 +1,4 @@
+import collections
 import types
 import pika
 import msgpack
@@ -5,6 +6,7 @@ import msgpack
 import recall.event_marshaler
 import recall.locators
 import recall.models
+import recall.serializer
 
 
 class EventRouter(object):
@@ -24,6 +26,18 @@ class EventRouter(object):
         assert isinstance(event, recall.models.Event)
         raise NotImplementedError
 
+    def route_many(self, events):
+        """
+        Route many events, in order. Routers which can batch should override
+        this; the default simply routes each event in turn.
+
+        :param events: The domain events
+        :type events: :class:`collections.Iterable`
+        """
+        assert isinstance(events, collections.Iterable)
+        for event in events:
+            self.route(event)
+
 
 class StdOut(EventRouter):
     """
@@ -55,8 +69,7 @@ class Callback(EventRouter):
         :type event: :class:`recall.models.Event`
         """
         assert isinstance(event, recall.models.Event)
-        callback = self._handlers.get(event.__class__)
-        if callback:
+        for callback in self._handlers.get(event.__class__) or []:
             callback(event)
 
     def register_event_handler(self, event_cls, callback):
@@ -81,6 +94,15 @@ class AMQP(EventRouter):
     """
     Publish an event via AMQP
 
+    By default, the body of a message is the event marshaled by
+    :class:`recall.event_marshaler.DefaultEventMarshaler`, with tagged UUIDs
+    and datetimes, packed with msgpack, as it always was. The router never
+    picks up the serializer of an event store. Configuring a serializer
+    changes the wire format, and every consumer must be able to read it
+    first: each body then starts with the serializer's marker, and with
+    :class:`recall.serializer.Binary`, UUIDs and datetimes are msgpack
+    extension types and byte strings are packed as msgpack bin.
+
     :param connection: The connection settings
     :type connection: :class:`dict`
 
@@ -89,14 +111,26 @@ class AMQP(EventRouter):
 
     :param exchange: The exchange settings
     :type exchange: :class:`dict`
+
+    :param serializer: Encodes the published events, or its fully-qualified
+                       class name (by default, none: msgpack of the marshaled
+                       event)
+    :type serializer: :class:`recall.serializer.Serializer`
+
+    :param serializer_settings: The settings of a serializer given by name
+    :type serializer_settings: :class:`dict`
     """
 
     DEFAULT_EVENT_MARSHALER = recall.event_marshaler.DefaultEventMarshaler
 
-    def __init__(self, connection=None, channel=None, exchange=None):
+    def __init__(self, connection=None, channel=None, exchange=None,
+                 serializer=None, serializer_settings=None):
         assert isinstance(connection, dict) or isinstance(connection, types.NoneType)
         assert isinstance(channel, dict) or isinstance(channel, types.NoneType)
         assert isinstance(exchange, dict) or isinstance(exchange, types.NoneType)
+        assert isinstance(serializer, (recall.serializer.Serializer,
+                                       str, unicode, types.NoneType))
+        assert isinstance(serializer_settings, (dict, types.NoneType))
         connection = connection or {}
         channel = channel or {}
         self.exchange = exchange or {}
@@ -114,6 +148,9 @@ class AMQP(EventRouter):
         self.channel = self.connection.channel(**channel)
         self.channel.exchange_declare(**self.exchange)
         self.marshaler = self.DEFAULT_EVENT_MARSHALER()
+        self.serializer = (
+            None if serializer is None else recall.serializer.get_serializer(
+                serializer, serializer_settings))
 
     def route(self, event):
         """
@@ -126,4 +163,5 @@ class AMQP(EventRouter):
         self.channel.basic_publish(
             exchange=self.exchange.get("exchange", ""),
             routing_key=event.__class__.__name__,
-            body=msgpack.packb(self.marshaler.marshal(event)))
\ No newline at end of file
+            body=(self.serializer.dumps(event) if self.serializer
+                  else self.marshaler.encode(event, msgpack.packb)))
\ No newline at end of file
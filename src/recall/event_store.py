@@ -1,17 +1,49 @@
+import binascii
+import collections
 import copy
-import json
+import fcntl
+import itertools
+import mmap
+import os
+import sqlite3
+import struct
+import threading
 import uuid
+import zlib
 
 import redis
 
-import recall.event_marshaler
 import recall.models
+import recall.serializer
+
+#: Each entity's events are stored in a stream of their own
+ENTITY_LAYOUT = "entity"
+
+#: An aggregate's events, including those of its children, are stored in one
+#: stream keyed by the aggregate root, each tagged with its entity's GUID
+AGGREGATE_LAYOUT = "aggregate"
+
+
+class ConcurrencyError(Exception):
+    """
+    Raised when events are appended to a stream which is not at the version
+    the domain entity was loaded at, i.e. someone else wrote to it first
+    """
+    pass
 
 
 class EventStore(object):
     """
     The Event Store interface
+
+    With the entity layout, streams are keyed by entity GUID. With the
+    aggregate layout, streams are keyed by aggregate root GUID and the
+    ``get_events_*`` methods return the events of every entity in the
+    aggregate, while the ``get_aggregate_events_*`` methods also tell which
+    entity each event belongs to.
     """
+    layout = ENTITY_LAYOUT
+
     def get_all_events(self, guid):
         """
         Get all events for a domain entity
@@ -40,6 +72,76 @@ class EventStore(object):
         assert isinstance(version, int)
         raise NotImplementedError
 
+    def get_events_from_versions(self, versions):
+        """
+        Get events for many domain entities as of given versions. Stores which
+        can batch their reads should override this; the default simply asks
+        for each entity in turn.
+
+        :param versions: The versions of the domain entities, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: self.get_events_from_version(guid, version)
+                for guid, version in versions.items()}
+
+    def get_aggregate_events_from_version(self, guid, version):
+        """
+        Get the (entity guid, domain event) records of an aggregate-scoped
+        stream as of a given version
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the aggregate
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        raise NotImplementedError
+
+    def get_aggregate_events_from_versions(self, versions):
+        """
+        Get the (entity guid, domain event) records of many aggregate-scoped
+        streams as of given versions. Stores which can batch their reads should
+        override this; the default simply asks for each aggregate in turn.
+
+        :param versions: The versions of the aggregates, keyed by root guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: self.get_aggregate_events_from_version(guid, version)
+                for guid, version in versions.items()}
+
+    def get_stream_guids(self):
+        """
+        Get the guids of all streams in the store, in no particular order
+
+        :rtype: :class:`iterator`
+        """
+        raise NotImplementedError
+
+    def get_versions(self, guids):
+        """
+        Get the current versions of many streams, i.e. how many events they
+        hold, without reading the events. Stores which can tell a stream's
+        length cheaply should override this; the default reads every stream.
+
+        :param guids: The guids of the streams
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        return {guid: len(list(self.get_all_events(guid) or []))
+                for guid in guids}
+
     def save(self, entity):
         """
         Save a domain entity's events
@@ -50,15 +152,207 @@ class EventStore(object):
         assert isinstance(entity, recall.models.Entity)
         raise NotImplementedError
 
+    def save_many(self, entities):
+        """
+        Save many domain entities' events. Stores which can batch their writes
+        should override this; the default simply saves each entity in turn.
+
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
+        """
+        assert isinstance(entities, collections.Iterable)
+        for entity in entities:
+            self.save(entity)
+
+    def _get_streams(self, entities):
+        """
+        Group the staged events of domain entities by the stream they are
+        appended to, along with the version that stream is expected to be at,
+        i.e. the version of the entity, or of the whole aggregate.
+
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
+
+        :rtype: :class:`collections.OrderedDict`
+        """
+        assert isinstance(entities, collections.Iterable)
+        streams = collections.OrderedDict()
+        for entity in entities:
+            assert isinstance(entity, recall.models.Entity)
+            for provider in entity._get_staged_entities():
+                if self.layout == AGGREGATE_LAYOUT:
+                    stream = streams.setdefault(
+                        entity.guid, (entity._aggregate_version, []))
+                else:
+                    stream = streams.setdefault(
+                        provider.guid, (provider._version, []))
+                stream[1].extend((provider.guid, e) for e in provider._events)
+
+        return streams
+
+    def _commit(self, streams):
+        """
+        Queue the writes of a save, and wait until they are written, either
+        by another thread's batch or by this thread's, which then takes all
+        of the writes queued so far. Stores which merge concurrent saves set
+        up ``_queue``, ``_flushing`` and ``_condition``, and implement
+        :meth:`_write`.
+
+        :param streams: The (key, version, records) of the streams
+        :type streams: :class:`list`
+
+        :rtype: :class:`Exception`
+        """
+        assert isinstance(streams, list)
+        request = {"streams": streams, "done": False, "error": None}
+        with self._condition:
+            self._queue.append(request)
+            while self._flushing and not request["done"]:
+                self._condition.wait()
+
+            if request["done"]:
+                return request["error"]
+
+            self._flushing = True
+            requests, self._queue = self._queue, []
+
+        errors = [RuntimeError("The group commit was interrupted")] * len(
+            requests)
+        try:
+            errors = self._write([r["streams"] for r in requests])
+        except Exception as e:
+            errors = [e] * len(requests)
+        finally:
+            with self._condition:
+                for r, error in zip(requests, errors):
+                    r["done"] = True
+                    r["error"] = error
+
+                self._flushing = False
+                self._condition.notify_all()
+
+        return request["error"]
+
+    def _write(self, saves):
+        """
+        Write the appends of many saves at once, and get the error of each
+        save, if any
+
+        :param saves: The (key, version, records) of the streams of each save
+        :type saves: :class:`list`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(saves, list)
+        raise NotImplementedError
+
+    def _set_serializer(self, serializer, settings, readers):
+        """
+        Set up the serializer events are written with, and those records are
+        read back with: the store's, the readers, and the built-in ones, with
+        the longest markers first, as JSON has none
+
+        :param serializer: The serializer, or its fully-qualified class name
+        :type serializer: :class:`recall.serializer.Serializer`
+
+        :param settings: The settings of a serializer given by name
+        :type settings: :class:`dict`
+
+        :param readers: More serializers, or their fully-qualified class names
+        :type readers: :class:`list`
+        """
+        assert isinstance(serializer, (recall.serializer.Serializer,
+                                       str, unicode, type(None)))
+        assert isinstance(settings, (dict, type(None)))
+        assert isinstance(readers, (list, type(None)))
+        self.serializer = (
+            recall.serializer.Json() if serializer is None
+            else recall.serializer.get_serializer(serializer, settings))
+        self._readers = sorted(
+            [self.serializer]
+            + [recall.serializer.get_serializer(reader)
+               for reader in readers or []]
+            + [recall.serializer.Binary(), recall.serializer.Json()],
+            key=lambda serializer: len(serializer.MARKER), reverse=True)
+
+    def _decode_all(self, decode, records):
+        """
+        Decode the stored events of a stream, at once if they were read in a
+        single page, or as they are consumed
+
+        :param decode: Decodes a stored event
+        :type decode: :class:`collections.Callable`
+
+        :param records: The stored events
+        :type records: :class:`collections.Iterable`
+
+        :rtype: :class:`collections.Iterable`
+        """
+        if isinstance(records, list):
+            return [decode(record) for record in records]
+
+        return (decode(record) for record in records)
+
+    def _encode(self, event, guid):
+        """
+        Encode a domain event for storage
+
+        :param event: The domain event
+        :type event: :class:`recall.models.Event`
+
+        :param guid: The guid of the event's domain entity
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`str`
+        """
+        return self.serializer.dumps(
+            event, guid if self.layout == AGGREGATE_LAYOUT else None)
+
+    def _decode(self, record):
+        """
+        Decode a stored domain event
+
+        :param record: The stored domain event
+        :type record: :class:`str`
+
+        :rtype: :class:`recall.models.Event`
+        """
+        return self._decode_record(record)[1]
+
+    def _decode_record(self, record):
+        """
+        Decode a stored domain event along with the guid of its entity
+
+        :param record: The stored domain event
+        :type record: :class:`str`
+
+        :rtype: :class:`tuple`
+        """
+        serializer = next(serializer for serializer in self._readers
+                          if serializer.accepts(record))
+        return serializer.loads(record)
+
 
 class Memory(EventStore):
     """
     An in-memory event store
+
+    :param layout: The stream layout, "entity" or "aggregate"
+    :type layout: :class:`str`
+
+    :param check_versions: Raise a :class:`ConcurrencyError` rather than
+                           append to a stream which has moved on
+    :type check_versions: :class:`bool`
     """
 
-    def __init__(self):
+    def __init__(self, layout=ENTITY_LAYOUT, check_versions=False):
+        assert layout in (ENTITY_LAYOUT, AGGREGATE_LAYOUT)
+        assert isinstance(check_versions, bool)
+        self.layout = layout
+        self.check_versions = check_versions
         self._events = {}
         self._entities = {}
+        self._lock = threading.Lock()
 
     def get_all_events(self, guid):
         """
@@ -88,6 +382,58 @@ class Memory(EventStore):
         assert isinstance(version, int)
         return (self._events.get(guid) or [])[version:]
 
+    def get_events_from_versions(self, versions):
+        """
+        Get events for many domain entities as of given versions
+
+        :param versions: The versions of the domain entities, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: (self._events.get(guid) or [])[version:]
+                for guid, version in versions.items()}
+
+    def get_aggregate_events_from_version(self, guid, version):
+        """
+        Get the (entity guid, domain event) records of an aggregate-scoped
+        stream as of a given version
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the aggregate
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return zip((self._entities.get(guid) or [])[version:],
+                   (self._events.get(guid) or [])[version:])
+
+    def get_stream_guids(self):
+        """
+        Get the guids of all streams in the store, in no particular order
+
+        :rtype: :class:`iterator`
+        """
+        with self._lock:
+            return iter(list(self._events))
+
+    def get_versions(self, guids):
+        """
+        Get the current versions of many streams
+
+        :param guids: The guids of the streams
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        return {guid: len(self._events.get(guid) or []) for guid in guids}
+
     def save(self, entity):
         """
         Save a domain entity's events
@@ -96,31 +442,144 @@ class Memory(EventStore):
         :type entity: :class:`recall.models.Entity`
         """
         assert isinstance(entity, recall.models.Entity)
-        for provider in entity._get_all_entities():
-            self._create_entity(provider)
-            for event in provider._events:
-                self._events[provider.guid].append(copy.copy(event))
+        self.save_many([entity])
 
-    def _create_entity(self, entity):
+    def save_many(self, entities):
         """
-        Creates the array members for the entity if it is not found
+        Save many domain entities' events. When versions are checked, either
+        all of the events are appended or none are.
 
-        :param entity: The domain entity
-        :type entity: :class:`recall.models.Entity`
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
         """
-        assert isinstance(entity, recall.models.Entity)
-        if not self._events.get(entity.guid):
-            self._events[entity.guid] = []
+        assert isinstance(entities, collections.Iterable)
+        with self._lock:
+            streams = self._get_streams(entities)
+            if self.check_versions:
+                for guid, (version, _) in streams.items():
+                    if len(self._events.get(guid) or []) != version:
+                        raise ConcurrencyError(
+                            "Stream %s is not at version %d" % (guid, version))
+
+            for guid, (_, records) in streams.items():
+                self._create_entity(guid)
+                for entity_guid, event in records:
+                    self._events[guid].append(copy.copy(event))
+                    if self.layout == AGGREGATE_LAYOUT:
+                        self._entities[guid].append(entity_guid)
+
+    def _create_entity(self, guid):
+        """
+        Creates the array members for the stream if it is not found
+
+        :param guid: The guid of the stream
+        :type guid: :class:`uuid.UUID`
+        """
+        assert isinstance(guid, uuid.UUID)
+        if not self._events.get(guid):
+            self._events[guid] = []
+            self._entities[guid] = []
 
 
 class Redis(EventStore):
     """
-    An Redis event store
+    An Redis event store, which keeps each stream in a list. With the
+    aggregate layout, each stored event carries the GUID of its entity under
+    the "__entity__" key.
+
+    When versions are checked, appends go through a Lua script which compares
+    the length of every stream with its expected version and only appends if
+    they all match, atomically.
+
+    All of the appends of a save are sent in a single pipeline, which is
+    wrapped in MULTI/EXEC when it's atomic. With group commit, saves made
+    concurrently by several threads are merged: while one thread's pipeline is
+    in flight, the others queue their appends, and the next of them to go
+    sends all of the queued appends in a single pipeline. Each save still
+    gets its own result, including its own :class:`ConcurrencyError`.
+
+    Streams are read a page of ``chunk_size`` events at a time, so neither
+    Redis nor the reader ever holds a whole long stream at once. The pages of
+    a stream are decoded as they are consumed, while the next page is fetched
+    in the background. Batched reads fetch the first page of every stream in
+    a single pipeline, and carry on with the streams which are longer than a
+    page as they are consumed.
+
+    Events are written by the serializer, JSON by default. Records are read
+    back by the serializer whose marker they start with, be it the store's,
+    one of the readers, or one of the built-in ones, so a store can be
+    switched to :class:`recall.serializer.Binary`, or a serializer of your
+    own, with its streams in place. A store which no longer writes with a
+    serializer of your own must keep it among its readers.
+
+    :param layout: The stream layout, "entity" or "aggregate"
+    :type layout: :class:`str`
+
+    :param check_versions: Raise a :class:`ConcurrencyError` rather than
+                           append to a stream which has moved on
+    :type check_versions: :class:`bool`
+
+    :param serializer: Encodes the events written, or its fully-qualified
+                       class name
+    :type serializer: :class:`recall.serializer.Serializer`
+
+    :param serializer_settings: The settings of a serializer given by name
+    :type serializer_settings: :class:`dict`
+
+    :param readers: More serializers to read records with, or their
+                    fully-qualified class names
+    :type readers: :class:`list`
+
+    :param atomic: Wrap the pipeline of appends in MULTI/EXEC
+    :type atomic: :class:`bool`
+
+    :param group_commit: Merge the appends of concurrent saves
+    :type group_commit: :class:`bool`
+
+    :param chunk_size: The number of events read at a time from a stream
+    :type chunk_size: :class:`int`
+    """
+
+    APPEND_SCRIPT = """
+        local unpack = unpack or table.unpack
+        local n = #KEYS
+        for i = 1, n do
+            if redis.call("llen", KEYS[i]) ~= tonumber(ARGV[i]) then
+                return KEYS[i]
+            end
+        end
+        local offset = n * 2
+        for i = 1, n do
+            local last = offset + tonumber(ARGV[n + i])
+            for first = offset + 1, last, 1000 do
+                redis.call("rpush", KEYS[i],
+                           unpack(ARGV, first, math.min(first + 999, last)))
+            end
+            offset = last
+        end
+        return 0
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, layout=ENTITY_LAYOUT, check_versions=False,
+                 serializer=None, serializer_settings=None, readers=None,
+                 atomic=False, group_commit=False, chunk_size=1000,
+                 **kwargs):
+        assert layout in (ENTITY_LAYOUT, AGGREGATE_LAYOUT)
+        assert isinstance(check_versions, bool)
+        assert isinstance(atomic, bool)
+        assert isinstance(group_commit, bool)
+        assert isinstance(chunk_size, int) and chunk_size > 0
+        self.layout = layout
+        self.check_versions = check_versions
+        self.atomic = atomic
+        self.group_commit = group_commit
+        self.chunk_size = chunk_size
+        self._queue = []
+        self._flushing = False
+        self._condition = threading.Condition()
+        self._set_serializer(serializer, serializer_settings, readers)
         self._client = redis.StrictRedis(**kwargs)
-        self._marshaler = recall.event_marshaler.DefaultEventMarshaler()
+        self._append = self._client.register_script(self.APPEND_SCRIPT)
 
     def get_all_events(self, guid):
         """
@@ -148,11 +607,87 @@ class Redis(EventStore):
         """
         assert isinstance(guid, uuid.UUID)
         assert isinstance(version, int)
+        return (self._decode(e)
+                for e in self._read_pages(str(guid), version))
+
+    def get_events_from_versions(self, versions):
+        """
+        Get events for many domain entities as of given versions. The first
+        page of every stream is read in a single pipeline.
+
+        :param versions: The versions of the domain entities, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: self._decode_all(self._decode, records)
+                for guid, records in self._read_many(versions).items()}
+
+    def get_aggregate_events_from_version(self, guid, version):
+        """
+        Get the (entity guid, domain event) records of an aggregate-scoped
+        stream as of a given version
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the aggregate
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return (self._decode_record(e)
+                for e in self._read_pages(str(guid), version))
+
+    def get_aggregate_events_from_versions(self, versions):
+        """
+        Get the (entity guid, domain event) records of many aggregate-scoped
+        streams as of given versions. The first page of every stream is read
+        in a single pipeline.
+
+        :param versions: The versions of the aggregates, keyed by root guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: self._decode_all(self._decode_record, records)
+                for guid, records in self._read_many(versions).items()}
+
+    def get_stream_guids(self):
+        """
+        Get the guids of all streams in the store, in no particular order.
+        The keys are walked with SCAN, so Redis isn't blocked, and keys which
+        aren't guids are skipped.
+
+        :rtype: :class:`iterator`
+        """
+        for key in self._client.scan_iter(count=1000):
+            try:
+                yield uuid.UUID(key)
+            except ValueError:
+                pass
+
+    def get_versions(self, guids):
+        """
+        Get the current versions of many streams. The lengths of all of the
+        lists are asked for in a single pipeline.
+
+        :param guids: The guids of the streams
+        :type guids: :class:`collections.Iterable`
 
-        def fix_up(event):
-            return self._marshaler.unmarshal(json.loads(event))
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        guids = list(guids)
+        pipe = self._client.pipeline(transaction=False)
+        for guid in guids:
+            pipe.llen(str(guid))
 
-        return (fix_up(e) for e in self._client.lrange(str(guid), version, -1))
+        return dict(zip(guids, pipe.execute()))
 
     def save(self, entity):
         """
@@ -162,11 +697,1172 @@ class Redis(EventStore):
         :type entity: :class:`recall.models.Entity`
         """
         assert isinstance(entity, recall.models.Entity)
+        self.save_many([entity])
+
+    def save_many(self, entities):
+        """
+        Save many domain entities' events. All of the writes are sent to Redis
+        in a single pipeline, possibly along with those of concurrent saves.
+
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
+        """
+        assert isinstance(entities, collections.Iterable)
+        streams = [
+            (str(guid), version, [self._encode(e, g) for g, e in records])
+            for guid, (version, records)
+            in self._get_streams(entities).items()]
+        if not streams:
+            return
+
+        error = (self._commit(streams) if self.group_commit
+                 else self._write([streams])[0])
+        if error is not None:
+            raise error
+
+    def _write(self, saves, retry=True):
+        """
+        Write the appends of many saves in a single pipeline, and get the
+        error of each save, if any. The append script is called by its SHA1
+        without checking that Redis has it, which would cost a round trip;
+        the saves Redis doesn't run for want of it are retried once it's
+        loaded.
+
+        :param saves: The (key, version, records) of the streams of each save
+        :type saves: :class:`list`
+
+        :param retry: Load the append script and retry if Redis lacks it
+        :type retry: :class:`bool`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(saves, list)
+        pipe = self._client.pipeline(transaction=self.atomic)
+        for streams in saves:
+            if self.check_versions:
+                pipe.evalsha(
+                    self._append.sha, len(streams),
+                    *([key for key, _, _ in streams]
+                      + [version for _, version, _ in streams]
+                      + [len(marshaled) for _, _, marshaled in streams]
+                      + list(itertools.chain.from_iterable(
+                          marshaled for _, _, marshaled in streams))))
+            else:
+                for key, _, marshaled in streams:
+                    pipe.rpush(key, *marshaled)
+
+        results = iter(pipe.execute(raise_on_error=False))
+        errors = []
+        for streams in saves:
+            replies = list(itertools.islice(
+                results, 1 if self.check_versions else len(streams)))
+            error = next((reply for reply in replies
+                          if isinstance(reply, Exception)), None)
+            if error is None and self.check_versions and replies[0] != 0:
+                error = ConcurrencyError(
+                    "Stream %s has moved on" % replies[0])
+
+            errors.append(error)
 
-        def fix_up(event):
-            return json.dumps(self._marshaler.marshal(event))
+        missing = [index for index, error in enumerate(errors)
+                   if isinstance(error, redis.exceptions.NoScriptError)]
+        if missing and retry:
+            self._append.sha = self._client.script_load(self.APPEND_SCRIPT)
+            for index, error in zip(missing, self._write(
+                    [saves[index] for index in missing], False)):
+                errors[index] = error
 
-        for provider in entity._get_all_entities():
-            marshaled = tuple(fix_up(e) for e in provider._events)
-            if marshaled:
-                self._client.rpush(str(provider.guid), *marshaled)
+        return errors
+
+    def _read_many(self, versions):
+        """
+        Read the stored events of many streams, as of given versions. The
+        first page of every stream is read in a single pipeline; streams which
+        are longer are read on, page by page, as they are consumed.
+
+        :param versions: The versions of the streams, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        guids = list(versions)
+        pipe = self._client.pipeline(transaction=False)
+        for guid in guids:
+            pipe.lrange(str(guid), versions[guid],
+                        versions[guid] + self.chunk_size - 1)
+
+        return {guid: (page if len(page) < self.chunk_size
+                       else self._read_pages(str(guid), versions[guid], page))
+                for guid, page in zip(guids, pipe.execute())}
+
+    def _read_pages(self, key, start, page=None):
+        """
+        Read the stored events of a stream from a given index on, a page at a
+        time. The next page is fetched in the background while the current
+        one is consumed, so at most two pages are held at once.
+
+        :param key: The key of the stream
+        :type key: :class:`str`
+
+        :param start: The index of the first event
+        :type start: :class:`int`
+
+        :param page: The first page, if it was already read
+        :type page: :class:`list`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(key, str)
+        assert isinstance(start, int)
+        assert isinstance(page, (list, type(None)))
+        if page is None:
+            page = self._client.lrange(key, start, start + self.chunk_size - 1)
+
+        while page:
+            start += len(page)
+            following = None
+            if len(page) == self.chunk_size:
+                following = _Prefetch(self._client.lrange, key, start,
+                                      start + self.chunk_size - 1)
+
+            for record in page:
+                yield record
+
+            page = following.get() if following else []
+
+
+class Segments(EventStore):
+    """
+    A durable event store on the local disk, which appends every event to a
+    segment file, and keeps the position of each stream's events in an
+    in-memory index. It needs no outside service, and holds no events in
+    memory beyond those the operating system caches.
+
+    A segment file is a run of records, each made of a header and the event,
+    as written by the serializer. The header holds the CRC32 of the rest of
+    the record, the length of the event, the guid and the index of the event
+    in its stream, and a flag marking the last record of a save. Once a
+    segment is larger than ``segment_size``, the next save rolls over to a
+    new segment, and the sealed one is written an index file of the position
+    of each of its records, so opening a store only reads the index files of
+    sealed segments.
+
+    Opening a store scans its last segment, and cuts it after the last record
+    of the last save which was written whole, so a crash never leaves a save
+    half-written.
+
+    Segments are read through memory maps, without a read call per event,
+    which makes replaying a stream sequentially as fast as the disk and the
+    serializer go. Records aren't checked against their CRC32 when read, only
+    when a segment is scanned.
+
+    Saves made concurrently by several threads are merged: while one thread
+    writes, the others queue their records, and the next of them to go writes
+    all of the queued records at once. With ``sync``, the segment is fsynced
+    once per write, before the saves return, so a batch of saves costs a
+    single fsync. Without it, saves survive the process crashing, but not the
+    machine.
+
+    A directory can only be written by one store at a time, which locks it.
+    Read-only stores, e.g. those of replay workers, may open it alongside,
+    and see the saves written before they were opened.
+
+    :param path: The directory of the segment files
+    :type path: :class:`str`
+
+    :param layout: The stream layout, "entity" or "aggregate"
+    :type layout: :class:`str`
+
+    :param check_versions: Raise a :class:`ConcurrencyError` rather than
+                           append to a stream which has moved on
+    :type check_versions: :class:`bool`
+
+    :param serializer: Encodes the events written, or its fully-qualified
+                       class name
+    :type serializer: :class:`recall.serializer.Serializer`
+
+    :param serializer_settings: The settings of a serializer given by name
+    :type serializer_settings: :class:`dict`
+
+    :param readers: More serializers to read records with, or their
+                    fully-qualified class names
+    :type readers: :class:`list`
+
+    :param segment_size: The size in bytes past which segments roll over
+    :type segment_size: :class:`int`
+
+    :param sync: Fsync every write before the saves return
+    :type sync: :class:`bool`
+
+    :param read_only: Open the directory for reading only
+    :type read_only: :class:`bool`
+    """
+
+    #: The header of a record: the CRC32 of the rest of the record, the
+    #: length of the event, the guid of the stream, the index of the event in
+    #: the stream, and flags
+    HEADER = struct.Struct(">II16sIB")
+
+    #: An entry of the index file of a sealed segment: the guid of the stream
+    #: and the offset of the record
+    ENTRY = struct.Struct(">16sI")
+
+    #: Flags the last record of a save
+    COMMIT = 1
+
+    def __init__(self, path, layout=ENTITY_LAYOUT, check_versions=False,
+                 serializer=None, serializer_settings=None, readers=None,
+                 segment_size=256 * 1024 * 1024, sync=True, read_only=False):
+        assert isinstance(path, (str, unicode))
+        assert layout in (ENTITY_LAYOUT, AGGREGATE_LAYOUT)
+        assert isinstance(check_versions, bool)
+        assert isinstance(segment_size, int) and 0 < segment_size < 2 ** 32
+        assert isinstance(sync, bool)
+        assert isinstance(read_only, bool)
+        self.path = path
+        self.layout = layout
+        self.check_versions = check_versions
+        self.segment_size = segment_size
+        self.sync = sync
+        self.read_only = read_only
+        self._set_serializer(serializer, serializer_settings, readers)
+        self._queue = []
+        self._flushing = False
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._index = {}
+        self._maps = {}
+        self._segment = 0
+        self._entries = []
+        self._size = 0
+        self._fd = None
+        self._lock_file = None
+        self._open()
+
+    def get_all_events(self, guid):
+        """
+        Get all events for a domain entity
+
+        :param guid: The guid of the domain entity
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        return self.get_events_from_version(guid, 0)
+
+    def get_events_from_version(self, guid, version):
+        """
+        Get events for a domain entity as of a given version
+
+        :param guid: The guid of the domain entity
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the domain entity
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return (self._decode(record) for record in self._read(guid, version))
+
+    def get_aggregate_events_from_version(self, guid, version):
+        """
+        Get the (entity guid, domain event) records of an aggregate-scoped
+        stream as of a given version
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the aggregate
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return (self._decode_record(record)
+                for record in self._read(guid, version))
+
+    def get_stream_guids(self):
+        """
+        Get the guids of all streams in the store, in no particular order
+
+        :rtype: :class:`iterator`
+        """
+        with self._lock:
+            return iter([uuid.UUID(bytes=key) for key in self._index])
+
+    def get_versions(self, guids):
+        """
+        Get the current versions of many streams, from the index
+
+        :param guids: The guids of the streams
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        with self._lock:
+            return {guid: len(self._index.get(_get_key(guid)) or [])
+                    for guid in guids}
+
+    def save(self, entity):
+        """
+        Save a domain entity's events
+
+        :param entity: The domain entity
+        :type entity: :class:`recall.models.Entity`
+        """
+        assert isinstance(entity, recall.models.Entity)
+        self.save_many([entity])
+
+    def save_many(self, entities):
+        """
+        Save many domain entities' events. Either all of the events are
+        appended or none are, even if the process crashes, and they are all
+        written at once, possibly along with those of concurrent saves.
+
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
+        """
+        assert isinstance(entities, collections.Iterable)
+        if self.read_only:
+            raise IOError("%s is open for reading only" % self.path)
+
+        streams = [
+            (_get_key(guid), version, [self._encode(e, g) for g, e in records])
+            for guid, (version, records)
+            in self._get_streams(entities).items()]
+        if not streams:
+            return
+
+        error = self._commit(streams)
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Close the segment files, and unlock the directory
+        """
+        with self._lock:
+            for mapping in self._maps.values():
+                mapping.close()
+
+            self._maps.clear()
+            if self._fd is not None:
+                os.close(self._fd)
+
+            if self._lock_file is not None:
+                self._lock_file.close()
+
+            self._fd = self._lock_file = None
+
+    def _open(self):
+        """
+        Lock the directory, unless it's opened for reading only, load the
+        index of every sealed segment, and recover the last one
+        """
+        if not self.read_only:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+            self._lock_file = open(os.path.join(self.path, "LOCK"), "a")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                self._lock_file.close()
+                raise IOError("%s is locked by another store" % self.path)
+
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.path)
+                          if name.endswith(".log"))
+        for segment in segments[:-1]:
+            self._load(segment)
+
+        if segments:
+            self._segment = segments[-1]
+            self._entries, self._size = self._scan(self._segment, False)
+            self._add_entries(self._segment, self._entries)
+
+        if not self.read_only:
+            self._fd = self._open_segment(self._segment)
+            os.ftruncate(self._fd, self._size)
+
+    def _load(self, segment):
+        """
+        Add the records of a sealed segment to the index, from its index
+        file, which is written afresh if it's missing
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+        """
+        assert isinstance(segment, int)
+        path = self._get_path(segment, ".idx")
+        if os.path.exists(path):
+            with open(path, "rb") as index:
+                data = index.read()
+
+            entries = [self.ENTRY.unpack_from(data, offset) for offset
+                       in range(0, len(data), self.ENTRY.size)]
+        else:
+            entries, _ = self._scan(segment, True)
+            if not self.read_only:
+                self._write_index(segment, entries)
+
+        self._add_entries(segment, entries)
+
+    def _scan(self, segment, sealed):
+        """
+        Read the (key, offset) entries of a segment's records, up to the last
+        record of the last save written whole, and the size of the segment
+        up to there. A sealed segment must hold whole saves only.
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :param sealed: Whether the segment is sealed
+        :type sealed: :class:`bool`
+
+        :rtype: :class:`tuple`
+        """
+        assert isinstance(segment, int)
+        assert isinstance(sealed, bool)
+        entries = []
+        pending = []
+        versions = {}
+        size = offset = 0
+        path = self._get_path(segment, ".log")
+        length = os.path.getsize(path)
+        if not length:
+            return entries, size
+
+        with open(path, "rb") as handle:
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        while offset + self.HEADER.size <= length:
+            crc, record_length, key, version, flags = self.HEADER.unpack_from(
+                data, offset)
+            end = offset + self.HEADER.size + record_length
+            if end > length or crc != zlib.crc32(
+                    data[offset + 4:end]) & 0xffffffff:
+                break
+
+            if version != versions.get(key, len(self._index.get(key) or [])):
+                break
+
+            versions[key] = version + 1
+            pending.append((key, offset))
+            offset = end
+            if flags & self.COMMIT:
+                entries.extend(pending)
+                pending = []
+                size = offset
+
+        data.close()
+        if sealed and size != length:
+            raise IOError("Segment %s is corrupt at offset %d" % (path, size))
+
+        return entries, size
+
+    def _write(self, saves):
+        """
+        Append the records of many saves to the last segment in one write,
+        rolling over to a new segment between saves if need be, and get the
+        error of each save, if any
+
+        :param saves: The (key, version, records) of the streams of each save
+        :type saves: :class:`list`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(saves, list)
+        errors = []
+        chunks = []
+        entries = []
+        written = 0
+        start = self._size
+        versions = {}
+        try:
+            for streams in saves:
+                if self.check_versions:
+                    key = next((key for key, version, _ in streams
+                                if self._get_version(key, versions)
+                                != version), None)
+                    if key is not None:
+                        errors.append(ConcurrencyError(
+                            "Stream %s has moved on" % uuid.UUID(bytes=key)))
+                        continue
+
+                if self._size > self.segment_size:
+                    self._flush(chunks, entries, start)
+                    written = len(errors)
+                    start = self._size
+                    self._roll()
+                    start = 0
+
+                records = [(key, record) for key, _, marshaled in streams
+                           for record in marshaled]
+                for index, (key, record) in enumerate(records):
+                    version = self._get_version(key, versions)
+                    versions[key] = version + 1
+                    header = self.HEADER.pack(
+                        0, len(record), key, version,
+                        self.COMMIT if index == len(records) - 1 else 0)
+                    crc = zlib.crc32(record, zlib.crc32(header[4:]))
+                    chunks.append(struct.pack(">I", crc & 0xffffffff))
+                    chunks.append(header[4:])
+                    chunks.append(record)
+                    entries.append((key, self._size))
+                    self._size += self.HEADER.size + len(record)
+
+                errors.append(None)
+
+            self._flush(chunks, entries, start)
+        except Exception as e:
+            self._size = start
+            return errors[:written] + [e] * (len(saves) - written)
+
+        return errors
+
+    def _flush(self, chunks, entries, start):
+        """
+        Write records to the last segment, fsync it if need be, and add them
+        to the index. The records are written straight to the file
+        descriptor, without a buffer which could hold some of them back. If
+        the write fails, the segment is cut back to where it was, so the
+        records which were written don't hide later ones.
+
+        :param chunks: The records, as chunks of bytes
+        :type chunks: :class:`list`
+
+        :param entries: The (key, offset) entries of the records
+        :type entries: :class:`list`
+
+        :param start: The size of the segment before the write
+        :type start: :class:`int`
+        """
+        assert isinstance(chunks, list)
+        assert isinstance(entries, list)
+        assert isinstance(start, int)
+        if not chunks:
+            return
+
+        data = "".join(chunks)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(self._fd, data[written:])
+
+            if self.sync:
+                os.fsync(self._fd)
+        except Exception:
+            os.ftruncate(self._fd, start)
+            raise
+
+        self._entries.extend(entries)
+        self._add_entries(self._segment, entries)
+        del chunks[:]
+        del entries[:]
+
+    def _roll(self):
+        """
+        Seal the last segment, write its index file, and start a new one. The
+        store only moves on to the new segment once it's open, so if any step
+        fails, the last segment stays open and the next save rolls over again.
+        """
+        os.fsync(self._fd)
+        self._write_index(self._segment, self._entries)
+        fd = self._open_segment(self._segment + 1)
+        sealed, self._fd = self._fd, fd
+        self._segment += 1
+        self._entries = []
+        self._size = 0
+        os.close(sealed)
+
+    def _open_segment(self, segment):
+        """
+        Open a segment file for appending, creating it if need be
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :rtype: :class:`int`
+        """
+        assert isinstance(segment, int)
+        return os.open(self._get_path(segment, ".log"),
+                       os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _write_index(self, segment, entries):
+        """
+        Write the index file of a sealed segment, atomically
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :param entries: The (key, offset) entries of its records
+        :type entries: :class:`list`
+        """
+        assert isinstance(segment, int)
+        assert isinstance(entries, list)
+        path = self._get_path(segment, ".idx")
+        with open(path + ".tmp", "wb") as index:
+            index.write("".join(self.ENTRY.pack(key, offset)
+                                for key, offset in entries))
+            index.flush()
+            os.fsync(index.fileno())
+
+        os.rename(path + ".tmp", path)
+
+    def _add_entries(self, segment, entries):
+        """
+        Add the positions of a segment's records to the index. A position is
+        the number of the segment, shifted left by 32 bits, plus the offset of
+        the record.
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :param entries: The (key, offset) entries of the records
+        :type entries: :class:`list`
+        """
+        assert isinstance(segment, int)
+        assert isinstance(entries, list)
+        base = segment << 32
+        with self._lock:
+            for key, offset in entries:
+                positions = self._index.get(key)
+                if positions is None:
+                    positions = self._index[key] = []
+
+                positions.append(base + offset)
+
+    def _get_version(self, key, versions):
+        """
+        Get the version of a stream, counting the records of a write which
+        aren't in the index yet
+
+        :param key: The key of the stream
+        :type key: :class:`str`
+
+        :param versions: The versions of the streams the write appends to
+        :type versions: :class:`dict`
+
+        :rtype: :class:`int`
+        """
+        version = versions.get(key)
+        if version is None:
+            with self._lock:
+                version = len(self._index.get(key) or [])
+
+        return version
+
+    def _read(self, guid, version):
+        """
+        Read the stored events of a stream from a given version on. The
+        positions are taken from the index at once, and the records read as
+        they are consumed.
+
+        :param guid: The guid of the stream
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the stream
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        with self._lock:
+            positions = (self._index.get(_get_key(guid)) or [])[version:]
+
+        return (self._read_record(position) for position in positions)
+
+    def _read_record(self, position):
+        """
+        Read a stored event from the memory map of its segment
+
+        :param position: The position of the record
+        :type position: :class:`int`
+
+        :rtype: :class:`str`
+        """
+        segment, offset = position >> 32, position & 0xffffffff
+        start = offset + self.HEADER.size
+        mapping = self._get_map(segment, start)
+        end = start + struct.unpack_from(">I", mapping, offset + 4)[0]
+        if end > len(mapping):
+            mapping = self._get_map(segment, end)
+
+        return mapping[start:end]
+
+    def _get_map(self, segment, size):
+        """
+        Get the memory map of a segment, mapping it afresh if the last
+        segment has grown past the map
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :param size: The size the map must have
+        :type size: :class:`int`
+
+        :rtype: :class:`mmap.mmap`
+        """
+        mapping = self._maps.get(segment)
+        if mapping is None or len(mapping) < size:
+            with self._lock:
+                mapping = self._maps.get(segment)
+                if mapping is None or len(mapping) < size:
+                    with open(self._get_path(segment, ".log"), "rb") as f:
+                        mapping = self._maps[segment] = mmap.mmap(
+                            f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return mapping
+
+    def _get_path(self, segment, extension):
+        """
+        Get the path of a segment's file
+
+        :param segment: The number of the segment
+        :type segment: :class:`int`
+
+        :param extension: ".log" for the records, ".idx" for the index
+        :type extension: :class:`str`
+
+        :rtype: :class:`str`
+        """
+        return os.path.join(self.path, "%010d%s" % (segment, extension))
+
+
+class Sqlite(EventStore):
+    """
+    An embedded, transactional event store on SQLite, which keeps every
+    event in a row of one table, keyed by the guid of its stream and its
+    version in the stream. Reading a stream from a version is a range scan of
+    the (stream, version) index. Every event also gets a global sequence
+    number, in the order they were stored, which
+    :meth:`get_events_after` scans the whole store by.
+
+    The database is in WAL mode, so readers don't block the writer, nor the
+    writer readers. Each save appends all of its events in a single
+    transaction, with one batched insert. The version of a stream is checked
+    in that transaction, and the (stream, version) key is unique, so two
+    stores appending to the same stream, even from different processes,
+    can't both win: the loser gets a :class:`ConcurrencyError`.
+
+    Each thread, and each process, uses a connection of its own, so the
+    database must be a file, not ":memory:". :meth:`close` closes them all;
+    threads which use the store again then connect again.
+
+    :param path: The path of the database file
+    :type path: :class:`str`
+
+    :param layout: The stream layout, "entity" or "aggregate"
+    :type layout: :class:`str`
+
+    :param check_versions: Raise a :class:`ConcurrencyError` rather than
+                           append to a stream which has moved on
+    :type check_versions: :class:`bool`
+
+    :param serializer: Encodes the events written, or its fully-qualified
+                       class name
+    :type serializer: :class:`recall.serializer.Serializer`
+
+    :param serializer_settings: The settings of a serializer given by name
+    :type serializer_settings: :class:`dict`
+
+    :param readers: More serializers to read records with, or their
+                    fully-qualified class names
+    :type readers: :class:`list`
+
+    :param synchronous: The SQLite synchronous setting; "NORMAL" only syncs
+                        the WAL at checkpoints, so the last saves may be lost
+                        to a power failure, and "FULL" syncs every save
+    :type synchronous: :class:`str`
+
+    :param timeout: The seconds to wait for another connection's write
+    :type timeout: :class:`float`
+
+    :param chunk_size: The number of events read at a time by full scans
+    :type chunk_size: :class:`int`
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+            stream BLOB NOT NULL,
+            version INTEGER NOT NULL,
+            event BLOB NOT NULL,
+            UNIQUE (stream, version))
+    """
+
+    #: The most variables SQLite takes in a statement, by default
+    MAX_VARIABLES = 999
+
+    def __init__(self, path, layout=ENTITY_LAYOUT, check_versions=False,
+                 serializer=None, serializer_settings=None, readers=None,
+                 synchronous="NORMAL", timeout=5.0, chunk_size=1000):
+        assert isinstance(path, (str, unicode)) and path != ":memory:"
+        assert layout in (ENTITY_LAYOUT, AGGREGATE_LAYOUT)
+        assert isinstance(check_versions, bool)
+        assert synchronous in ("OFF", "NORMAL", "FULL")
+        assert isinstance(timeout, (int, float))
+        assert isinstance(chunk_size, int) and chunk_size > 0
+        self.path = path
+        self.layout = layout
+        self.check_versions = check_versions
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._set_serializer(serializer, serializer_settings, readers)
+        self._local = threading.local()
+        self._connections = []
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._get_connection().execute(self.SCHEMA)
+
+    def get_all_events(self, guid):
+        """
+        Get all events for a domain entity
+
+        :param guid: The guid of the domain entity
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        return self.get_events_from_version(guid, 0)
+
+    def get_events_from_version(self, guid, version):
+        """
+        Get events for a domain entity as of a given version
+
+        :param guid: The guid of the domain entity
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the domain entity
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return [self._decode(record) for record in self._read(guid, version)]
+
+    def get_events_from_versions(self, versions):
+        """
+        Get events for many domain entities as of given versions, with a
+        query per batch of streams
+
+        :param versions: The versions of the domain entities, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: [self._decode(record) for record in records]
+                for guid, records in self._read_many(versions).items()}
+
+    def get_aggregate_events_from_version(self, guid, version):
+        """
+        Get the (entity guid, domain event) records of an aggregate-scoped
+        stream as of a given version
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the aggregate
+        :type version: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return [self._decode_record(record)
+                for record in self._read(guid, version)]
+
+    def get_aggregate_events_from_versions(self, versions):
+        """
+        Get the (entity guid, domain event) records of many aggregate-scoped
+        streams as of given versions, with a query per batch of streams
+
+        :param versions: The versions of the aggregates, keyed by root guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        return {guid: [self._decode_record(record) for record in records]
+                for guid, records in self._read_many(versions).items()}
+
+    def get_events_after(self, sequence=0):
+        """
+        Get the (sequence, stream guid, domain event) of every event stored
+        after a given sequence number, in the order they were stored. The
+        events are read ``chunk_size`` at a time, each chunk in a query of
+        its own, so a scan of the whole store doesn't hold a read transaction
+        open.
+
+        :param sequence: The sequence number of the last event already seen
+        :type sequence: :class:`int`
+
+        :rtype: :class:`iterator`
+        """
+        assert isinstance(sequence, int)
+        while True:
+            rows = self._get_connection().execute(
+                "SELECT sequence, stream, event FROM events "
+                "WHERE sequence > ? ORDER BY sequence LIMIT ?",
+                (sequence, self.chunk_size)).fetchall()
+            for sequence, stream, record in rows:
+                yield (sequence, uuid.UUID(bytes=str(stream)),
+                       self._decode(str(record)))
+
+            if len(rows) < self.chunk_size:
+                return
+
+    def get_stream_guids(self):
+        """
+        Get the guids of all streams in the store, in no particular order
+
+        :rtype: :class:`iterator`
+        """
+        rows = self._get_connection().execute(
+            "SELECT DISTINCT stream FROM events").fetchall()
+        return (uuid.UUID(bytes=str(stream)) for stream, in rows)
+
+    def get_versions(self, guids):
+        """
+        Get the current versions of many streams, from the (stream, version)
+        index, with a query per batch of streams
+
+        :param guids: The guids of the streams
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        guids = list(guids)
+        versions = dict.fromkeys(guids, 0)
+        keys = dict((_get_key(guid), guid) for guid in guids)
+        for batch in self._get_batches(list(keys)):
+            for stream, version in self._get_connection().execute(
+                    "SELECT stream, MAX(version) + 1 FROM events "
+                    "WHERE stream IN (%s) GROUP BY stream"
+                    % ", ".join("?" * len(batch)),
+                    [sqlite3.Binary(key) for key in batch]):
+                versions[keys[str(stream)]] = version
+
+        return versions
+
+    def save(self, entity):
+        """
+        Save a domain entity's events
+
+        :param entity: The domain entity
+        :type entity: :class:`recall.models.Entity`
+        """
+        assert isinstance(entity, recall.models.Entity)
+        self.save_many([entity])
+
+    def save_many(self, entities):
+        """
+        Save many domain entities' events in a single transaction, with one
+        batched insert. Either all of the events are appended or none are.
+
+        :param entities: The domain entities
+        :type entities: :class:`collections.Iterable`
+        """
+        assert isinstance(entities, collections.Iterable)
+        streams = [
+            (sqlite3.Binary(_get_key(guid)), version,
+             [self._encode(e, g) for g, e in records])
+            for guid, (version, records)
+            in self._get_streams(entities).items()]
+        if not streams:
+            return
+
+        connection = self._get_connection()
+        # Take the write lock up front, so the versions read stay current
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = []
+            for key, version, marshaled in streams:
+                current, = connection.execute(
+                    "SELECT COALESCE(MAX(version) + 1, 0) FROM events "
+                    "WHERE stream = ?", (key,)).fetchone()
+                if self.check_versions and current != version:
+                    raise ConcurrencyError(
+                        "Stream %s is not at version %d"
+                        % (uuid.UUID(bytes=str(key)), version))
+
+                rows.extend((key, current + index, sqlite3.Binary(record))
+                            for index, record in enumerate(marshaled))
+
+            connection.executemany(
+                "INSERT INTO events (stream, version, event) "
+                "VALUES (?, ?, ?)", rows)
+            connection.execute("COMMIT")
+        except sqlite3.IntegrityError as e:
+            connection.execute("ROLLBACK")
+            raise ConcurrencyError("A stream has moved on: %s" % e)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """
+        Close the connections of every thread of this process. They must not
+        be in use.
+        """
+        pid = os.getpid()
+        with self._lock:
+            for owner, connection in self._connections:
+                # Those inherited from the parent of a forked process are its
+                if owner == pid:
+                    connection.close()
+
+            self._connections = []
+            self._generation += 1
+
+    def _get_connection(self):
+        """
+        Get the connection of the calling thread, connecting if it has none,
+        if it was inherited from the parent of a forked process, or if it was
+        closed
+
+        :rtype: :class:`sqlite3.Connection`
+        """
+        key = (os.getpid(), self._generation)
+        if getattr(self._local, "key", None) != key:
+            # Connections are only used by their own thread, but are closed
+            # by the one calling close()
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None,
+                check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=%s" % self.synchronous)
+            with self._lock:
+                self._connections.append((key[0], connection))
+                key = (key[0], self._generation)
+
+            self._local.connection = connection
+            self._local.key = key
+
+        return self._local.connection
+
+    def _read(self, guid, version):
+        """
+        Read the stored events of a stream from a given version on
+
+        :param guid: The guid of the stream
+        :type guid: :class:`uuid.UUID`
+
+        :param version: The version of the stream
+        :type version: :class:`int`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(version, int)
+        return [str(record) for record, in self._get_connection().execute(
+            "SELECT event FROM events WHERE stream = ? AND version >= ? "
+            "ORDER BY version", (sqlite3.Binary(_get_key(guid)), version))]
+
+    def _read_many(self, versions):
+        """
+        Read the stored events of many streams, as of given versions, with a
+        query per batch of streams; each stream is bounded by its version in
+        the query, so the (stream, version) index skips the events before it
+
+        :param versions: The versions of the streams, keyed by guid
+        :type versions: :class:`dict`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(versions, dict)
+        records = {guid: [] for guid in versions}
+        keys = dict((_get_key(guid), guid) for guid in versions)
+        for batch in self._get_batches(list(keys), 2):
+            parameters = []
+            for key in batch:
+                parameters += [sqlite3.Binary(key), versions[keys[key]]]
+
+            for stream, record in self._get_connection().execute(
+                    "SELECT stream, event FROM events WHERE %s "
+                    "ORDER BY stream, version"
+                    % " OR ".join(["(stream = ? AND version >= ?)"]
+                                  * len(batch)), parameters):
+                records[keys[str(stream)]].append(str(record))
+
+        return records
+
+    def _get_batches(self, keys, variables=1):
+        """
+        Split stream keys into batches small enough for a query
+
+        :param keys: The keys of the streams
+        :type keys: :class:`list`
+
+        :param variables: The number of query variables per stream
+        :type variables: :class:`int`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(keys, list)
+        assert isinstance(variables, int)
+        size = self.MAX_VARIABLES // variables
+        return [keys[i:i + size] for i in range(0, len(keys), size)]
+
+
+class _Prefetch(threading.Thread):
+    """
+    Call a function on a thread of its own, so its result can be fetched
+    while the caller is busy with something else
+
+    :param func: The function
+    :type func: :class:`collections.Callable`
+    """
+    def __init__(self, func, *args):
+        assert isinstance(func, collections.Callable)
+        super(_Prefetch, self).__init__()
+        self.daemon = True
+        self._func = func
+        self._args = args
+        self._result = None
+        self._error = None
+        self.start()
+
+    def run(self):
+        try:
+            self._result = self._func(*self._args)
+        except Exception as e:
+            self._error = e
+
+    def get(self):
+        """
+        Wait for the result of the function, or raise its exception
+
+        :rtype: :class:`object`
+        """
+        self.join()
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+
+def _get_key(guid):
+    """
+    Get the 16 bytes of a guid, which key the streams of the
+    :class:`Segments` and :class:`Sqlite` stores
+
+    :param guid: The guid
+    :type guid: :class:`uuid.UUID`
+
+    :rtype: :class:`str`
+    """
+    # Much faster than UUID.bytes, which builds the bytes one at a time
+    return binascii.unhexlify(guid.hex)
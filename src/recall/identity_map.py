@@ -0,0 +1,314 @@
+import collections
+import pickle
+import threading
+
+import recall.models
+
+
+class IdentityMap(object):
+    """
+    The Identity Map interface
+
+    An identity map keeps loaded aggregate roots in memory so that loading the
+    same root twice returns the same object without going back to the snapshot
+    or event stores. Every identity map counts its hits, misses and evictions.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, guid):
+        """
+        Get an aggregate root by GUID
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`recall.models.AggregateRoot`
+        """
+        root = self._get(guid)
+        if root is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return root
+
+    def stats(self):
+        """
+        Get the counters of the identity map
+
+        :rtype: :class:`dict`
+        """
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions}
+
+    def __contains__(self, guid):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __setitem__(self, guid, root):
+        """
+        Add an aggregate root to the identity map
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        raise NotImplementedError
+
+    def __delitem__(self, guid):
+        """
+        Remove an aggregate root from the identity map
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+        """
+        raise NotImplementedError
+
+    def _get(self, guid):
+        """
+        Get an aggregate root by GUID without touching the counters
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`recall.models.AggregateRoot`
+        """
+        raise NotImplementedError
+
+
+class Unbounded(IdentityMap):
+    """
+    An identity map which never forgets an aggregate root. This is the
+    behaviour of a plain :class:`dict` and the default for a repository.
+    """
+    def __init__(self):
+        super(Unbounded, self).__init__()
+        self._roots = {}
+
+    def __contains__(self, guid):
+        return guid in self._roots
+
+    def __len__(self):
+        return len(self._roots)
+
+    def __setitem__(self, guid, root):
+        assert isinstance(root, recall.models.AggregateRoot)
+        self._roots[guid] = root
+
+    def __delitem__(self, guid):
+        del self._roots[guid]
+
+    def _get(self, guid):
+        return self._roots.get(guid)
+
+
+class Bounded(IdentityMap):
+    """
+    An identity map which evicts aggregate roots once it holds more than
+    ``max_entries`` roots or more than ``max_bytes`` estimated bytes. Which
+    root is evicted is up to the subclass.
+
+    The byte size of a root is estimated once, when it is added, by the
+    ``sizer`` callable. The default sizer pickles the whole aggregate, so
+    only set ``max_bytes`` if that cost is acceptable on a cache miss.
+
+    Bounded identity maps may be shared between threads.
+
+    :param max_entries: The maximum number of aggregate roots
+    :type max_entries: :class:`int`
+
+    :param max_bytes: The maximum estimated size of all aggregate roots
+    :type max_bytes: :class:`int`
+
+    :param sizer: Estimates the byte size of an aggregate root
+    :type sizer: :class:`collections.Callable`
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizer=None):
+        assert isinstance(max_entries, (int, type(None)))
+        assert isinstance(max_bytes, (int, type(None)))
+        assert isinstance(sizer, (collections.Callable, type(None)))
+        super(Bounded, self).__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizer = sizer or self._estimate_size
+        self.bytes = 0
+        self._roots = {}
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def stats(self):
+        """
+        Get the counters of the identity map
+
+        :rtype: :class:`dict`
+        """
+        return dict(super(Bounded, self).stats(), bytes=self.bytes)
+
+    def __contains__(self, guid):
+        return guid in self._roots
+
+    def __len__(self):
+        return len(self._roots)
+
+    def __setitem__(self, guid, root):
+        assert isinstance(root, recall.models.AggregateRoot)
+        size = self.sizer(root) if self.max_bytes is not None else 0
+        with self._lock:
+            if guid in self._roots:
+                del self[guid]
+
+            while self._roots and self._is_full(size):
+                del self[self._victim()]
+                self.evictions += 1
+
+            self._roots[guid] = root
+            self._sizes[guid] = size
+            self.bytes += size
+            self._insert(guid)
+
+    def __delitem__(self, guid):
+        with self._lock:
+            del self._roots[guid]
+            self.bytes -= self._sizes.pop(guid)
+            self._remove(guid)
+
+    def _get(self, guid):
+        with self._lock:
+            root = self._roots.get(guid)
+            if root is not None:
+                self._touch(guid)
+
+            return root
+
+    def _is_full(self, size):
+        """
+        Whether a root of the given size only fits after an eviction
+
+        :param size: The estimated size of the new root
+        :type size: :class:`int`
+
+        :rtype: :class:`bool`
+        """
+        return (
+            (self.max_entries is not None
+             and len(self._roots) >= self.max_entries)
+            or (self.max_bytes is not None
+                and self.bytes + size > self.max_bytes))
+
+    def _estimate_size(self, root):
+        """
+        Estimate the byte size of an aggregate root
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :rtype: :class:`int`
+        """
+        return len(pickle.dumps(root, pickle.HIGHEST_PROTOCOL))
+
+    def _insert(self, guid):
+        """
+        Track a newly added aggregate root
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+        """
+        raise NotImplementedError
+
+    def _remove(self, guid):
+        """
+        Stop tracking a removed aggregate root
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+        """
+        raise NotImplementedError
+
+    def _touch(self, guid):
+        """
+        Track a hit on an aggregate root
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+        """
+        raise NotImplementedError
+
+    def _victim(self):
+        """
+        Choose the aggregate root to evict
+
+        :rtype: :class:`uuid.UUID`
+        """
+        raise NotImplementedError
+
+
+class LRU(Bounded):
+    """
+    A bounded identity map which evicts the least recently used aggregate root
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizer=None):
+        super(LRU, self).__init__(max_entries, max_bytes, sizer)
+        self._order = collections.OrderedDict()
+
+    def _insert(self, guid):
+        self._order[guid] = None
+
+    def _remove(self, guid):
+        del self._order[guid]
+
+    def _touch(self, guid):
+        del self._order[guid]
+        self._order[guid] = None
+
+    def _victim(self):
+        return next(iter(self._order))
+
+
+class LFU(Bounded):
+    """
+    A bounded identity map which evicts the least frequently used aggregate
+    root. Ties go to the least recently used of them.
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizer=None):
+        super(LFU, self).__init__(max_entries, max_bytes, sizer)
+        self._counts = {}
+        self._buckets = collections.defaultdict(collections.OrderedDict)
+        self._min_count = 0
+
+    def _insert(self, guid):
+        self._counts[guid] = 1
+        self._buckets[1][guid] = None
+        self._min_count = 1
+
+    def _remove(self, guid):
+        count = self._counts.pop(guid)
+        bucket = self._buckets[count]
+        del bucket[guid]
+        if not bucket:
+            del self._buckets[count]
+
+    def _touch(self, guid):
+        count = self._counts[guid]
+        self._remove(guid)
+        if self._min_count == count and count not in self._buckets:
+            self._min_count = count + 1
+
+        self._counts[guid] = count + 1
+        self._buckets[count + 1][guid] = None
+
+    def _victim(self):
+        if self._min_count not in self._buckets:
+            self._min_count = min(self._buckets)
+
+        return next(iter(self._buckets[self._min_count]))
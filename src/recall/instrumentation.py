@@ -0,0 +1,204 @@
+import bisect
+import collections
+import threading
+import time
+
+#: Histogram bounds for durations, from 0.1ms to about 52s
+SECONDS = [0.0001 * 2 ** i for i in range(20)]
+
+#: Histogram bounds for counts, from 1 to about 1M
+COUNTS = [2 ** i for i in range(21)]
+
+#: Where a loaded aggregate root came from
+IDENTITY_MAP = "identity_map"
+SNAPSHOT = "snapshot"
+EVENTS = "events"
+
+
+class Operation(object):
+    """
+    The record of one load or save of a batch of aggregate roots
+
+    ``sources`` counts the roots by where they came from: the identity map,
+    a snapshot, or replaying their events from the start. ``events`` is the
+    number of events replayed, or saved, and ``calls`` the (name, seconds) of
+    every store and router call, in order.
+
+    :param kind: "load" or "save"
+    :type kind: :class:`str`
+    """
+    def __init__(self, kind):
+        assert isinstance(kind, str)
+        self.kind = kind
+        self.roots = 0
+        self.events = 0
+        self.sources = collections.defaultdict(int)
+        self.calls = []
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    def finish(self):
+        """
+        Stop the clock on the operation
+        """
+        self.elapsed = time.time() - self.started
+
+
+class Instrumentation(object):
+    """
+    The Instrumentation interface
+
+    A repository with instrumentation hands it an
+    :class:`recall.instrumentation.Operation` for every load and save. A
+    repository without it, the default, doesn't time anything.
+    """
+    def record(self, operation):
+        """
+        Record a load or save
+
+        :param operation: The operation
+        :type operation: :class:`recall.instrumentation.Operation`
+        """
+        assert isinstance(operation, Operation)
+        raise NotImplementedError
+
+
+class Callback(Instrumentation):
+    """
+    Pass every operation to a callable
+
+    :param callback: Called with each operation
+    :type callback: :class:`collections.Callable`
+    """
+    def __init__(self, callback):
+        assert isinstance(callback, collections.Callable)
+        self.callback = callback
+
+    def record(self, operation):
+        assert isinstance(operation, Operation)
+        self.callback(operation)
+
+
+class Histogram(object):
+    """
+    A histogram with fixed bucket bounds. A value falls in the first bucket
+    whose bound it doesn't exceed, or in a last, unbounded bucket.
+
+    :param bounds: The ascending upper bounds of the buckets
+    :type bounds: :class:`list`
+    """
+    def __init__(self, bounds):
+        assert isinstance(bounds, list) and bounds == sorted(bounds)
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """
+        Add a value to the histogram
+
+        :param value: The value
+        :type value: :class:`float`
+        """
+        assert isinstance(value, (int, float))
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile as the bound of the bucket it falls in
+
+        :param percent: The percentile, from 0 to 100
+        :type percent: :class:`float`
+
+        :rtype: :class:`float`
+        """
+        assert isinstance(percent, (int, float)) and 0 <= percent <= 100
+        rank = percent * self.count / 100.0
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+
+        return self.max
+
+    def export(self):
+        """
+        Export the histogram as plain data
+
+        :rtype: :class:`dict`
+        """
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "bounds": list(self.bounds),
+            "counts": list(self.counts)}
+
+
+class Stats(Instrumentation):
+    """
+    Aggregate operations into histograms of their duration, of the events
+    they replayed or saved, and of each kind of call, along with counts of
+    where loaded aggregate roots came from. Histograms are named after the
+    kind of operation, e.g. "load.elapsed", "load.events" or
+    "save.event_router.route_many".
+
+    Stats may be shared between threads.
+    """
+    def __init__(self):
+        self.sources = collections.defaultdict(int)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation):
+        assert isinstance(operation, Operation)
+        with self._lock:
+            self._add(operation.kind + ".elapsed", SECONDS, operation.elapsed)
+            self._add(operation.kind + ".events", COUNTS, operation.events)
+            for name, seconds in operation.calls:
+                self._add(operation.kind + "." + name, SECONDS, seconds)
+
+            for source, count in operation.sources.items():
+                self.sources[source] += count
+
+    def export(self):
+        """
+        Export the counts and histograms as plain data
+
+        :rtype: :class:`dict`
+        """
+        with self._lock:
+            return {
+                "sources": dict(self.sources),
+                "histograms": {name: histogram.export() for name, histogram
+                               in self.histograms.items()}}
+
+    def _add(self, name, bounds, value):
+        """
+        Add a value to a histogram, creating it if need be
+
+        :param name: The name of the histogram
+        :type name: :class:`str`
+
+        :param bounds: The bounds of the histogram, if it's created
+        :type bounds: :class:`list`
+
+        :param value: The value
+        :type value: :class:`float`
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+
+        histogram.add(value)
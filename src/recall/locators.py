@@ -1,8 +1,12 @@
 import recall.event_router
 import recall.event_store
+import recall.identity_map
+import recall.instrumentation
 import recall.models
 import recall.repository
+import recall.snapshot_policy
 import recall.snapshot_store
+import recall.snapshotter
 
 
 class ServiceNotFoundError(Exception):
@@ -20,6 +24,9 @@ class RepositoryLocator(object):
     DEFAULT_EVENT_ROUTER = recall.event_router.StdOut
     DEFAULT_SNAPSHOT_STORE = recall.snapshot_store.Memory
     DEFAULT_SNAPSHOT_FREQUENCY = 10
+    DEFAULT_IDENTITY_MAP = recall.identity_map.Unbounded
+    DEFAULT_SNAPSHOT_POLICY = recall.snapshot_policy.EventCount
+    DEFAULT_SNAPSHOTTER = recall.snapshotter.Inline
 
     def __init__(self, settings):
         assert isinstance(settings, dict)
@@ -28,6 +35,10 @@ class RepositoryLocator(object):
         self.locator_event_router = Locator(settings)
         self.locator_event_store = Locator(settings)
         self.locator_snapshot_store = Locator(settings)
+        self.locator_identity_map = Locator(settings)
+        self.locator_snapshot_policy = Locator(settings)
+        self.locator_snapshotter = Locator(settings)
+        self.locator_instrumentation = Locator(settings)
 
     def _get_event_router(self, settings):
         """
@@ -84,11 +95,82 @@ class RepositoryLocator(object):
         return (settings.get("snapshot_frequency")
                 or self.DEFAULT_SNAPSHOT_FREQUENCY)
 
+    def _get_identity_map(self, settings):
+        """
+        Create an identity map, or use default. Unlike the stores, an identity
+        map is never shared between repositories. Its settings are taken from
+        "identity_map_settings", falling back to the settings of its class.
+
+        :param settings: The configuration settings
+        :type settings: :class:`dict`
+
+        :rtype: :class:`recall.identity_map.IdentityMap`
+        """
+        assert isinstance(settings, dict)
+        cls = settings.get("identity_map")
+        return (self.locator_identity_map.create(
+                    cls, settings.get("identity_map_settings"))
+                if cls else self.DEFAULT_IDENTITY_MAP())
+
+    def _get_snapshot_policy(self, settings):
+        """
+        Create a snapshot policy, or use default. Like an identity map, a
+        snapshot policy is never shared between repositories. Its settings are
+        taken from "snapshot_policy_settings", falling back to the settings of
+        its class. By default, a snapshot is taken every "snapshot_frequency"
+        events.
+
+        :param settings: The configuration settings
+        :type settings: :class:`dict`
+
+        :rtype: :class:`recall.snapshot_policy.SnapshotPolicy`
+        """
+        assert isinstance(settings, dict)
+        cls = settings.get("snapshot_policy")
+        return (self.locator_snapshot_policy.create(
+                    cls, settings.get("snapshot_policy_settings"))
+                if cls else self.DEFAULT_SNAPSHOT_POLICY(
+                    self._get_snapshot_frequency(settings)))
+
+    def _get_snapshotter(self, settings):
+        """
+        Locate a snapshotter, or use default. Like the stores, a snapshotter
+        is shared between repositories, so they share its worker threads.
+
+        :param settings: The configuration settings
+        :type settings: :class:`dict`
+
+        :rtype: :class:`recall.snapshotter.Snapshotter`
+        """
+        assert isinstance(settings, dict)
+        cls = settings.get("snapshotter")
+        return (self.locator_snapshotter.locate(cls)
+                if cls else self.DEFAULT_SNAPSHOTTER())
+
+    def _get_instrumentation(self, settings):
+        """
+        Create instrumentation, or none by default. Like an identity map, it
+        is never shared between repositories, so each aggregate root gets its
+        own figures. Its settings are taken from "instrumentation_settings",
+        falling back to the settings of its class.
+
+        :param settings: The configuration settings
+        :type settings: :class:`dict`
+
+        :rtype: :class:`recall.instrumentation.Instrumentation`
+        """
+        assert isinstance(settings, dict)
+        cls = settings.get("instrumentation")
+        return (self.locator_instrumentation.create(
+                    cls, settings.get("instrumentation_settings"))
+                if cls else None)
+
     def locate(self, ar_cls):
         """
         Load a repository for given aggregate root by its fully-qualified class
         name (fqcn). Each AR's repository can be configured with it's own event
-        store, snapshot store, event router, and frequency.
+        store, snapshot store, event router, frequency or snapshot policy,
+        snapshotter, identity map, and instrumentation.
 
         :param ar_cls: The Aggregate Root class
         :type ar_cls: :class:`type`
@@ -103,7 +185,11 @@ class RepositoryLocator(object):
                 ar_cls, self._get_event_store(settings),
                 self._get_snapshot_store(settings),
                 self._get_event_router(settings),
-                self._get_snapshot_frequency(settings))
+                self._get_snapshot_frequency(settings),
+                identity_map=self._get_identity_map(settings),
+                snapshot_policy=self._get_snapshot_policy(settings),
+                snapshotter=self._get_snapshotter(settings),
+                instrumentation=self._get_instrumentation(settings))
 
         return self.identity_map[fqcn]
 
@@ -131,13 +217,29 @@ class Locator(object):
         """
         assert isinstance(fqcn, (str, unicode))
         if not self.identity_map.get(fqcn):
-            class_name = fqcn.split(".")[-1]
-            module_name = ".".join(fqcn.split(".")[0:-1])
-            mdl = __import__(module_name, globals(), locals(), [class_name], 0)
-            if class_name not in dir(mdl):
-                raise ServiceNotFoundError("Could not locate %s" % fqcn)
-            cls = getattr(mdl, class_name)
-            settings = self.settings.get(fqcn)
-            self.identity_map[fqcn] = cls(**settings) if settings else cls()
-
-        return self.identity_map[fqcn]
\ No newline at end of file
+            self.identity_map[fqcn] = self.create(fqcn)
+
+        return self.identity_map[fqcn]
+
+    def create(self, fqcn, settings=None):
+        """
+        Create a new, unshared service by its fully-qualified class name (fqcn)
+
+        :param fqcn: The fully-qualified class name of the service
+        :type fqcn: :class:`str`
+
+        :param settings: The service settings, instead of the configured ones
+        :type settings: :class:`dict`
+
+        :rtype: :class:`object`
+        """
+        assert isinstance(fqcn, (str, unicode))
+        assert isinstance(settings, (dict, type(None)))
+        class_name = fqcn.split(".")[-1]
+        module_name = ".".join(fqcn.split(".")[0:-1])
+        mdl = __import__(module_name, globals(), locals(), [class_name], 0)
+        if class_name not in dir(mdl):
+            raise ServiceNotFoundError("Could not locate %s" % fqcn)
+        cls = getattr(mdl, class_name)
+        settings = settings or self.settings.get(fqcn)
+        return cls(**settings) if settings else cls()
\ No newline at end of file
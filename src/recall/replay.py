@@ -0,0 +1,269 @@
+import itertools
+import json
+import multiprocessing
+import optparse
+import os
+import uuid
+
+import yaml
+
+# The locators come first: importing the services first runs into the
+# import cycle between them and the locators
+import recall.locators
+import recall.event_router
+import recall.event_store
+
+#: The event store and event router of a replay worker
+_services = None
+
+#: The number of events of a stream routed at a time
+ROUTE_CHUNK_SIZE = 1000
+
+
+class Replayer(object):
+    """
+    Replay every event of an event store through an event router, e.g. to
+    rebuild read models.
+
+    The guids of all streams are listed once, sorted, and split into batches
+    of consecutive guids, which are replayed by a pool of processes. Each
+    stream is replayed whole, in order, by a single worker.
+
+    The event store must use the aggregate layout, where each stream holds
+    the events of a whole aggregate, so each aggregate is replayed in order
+    by a single worker. With the entity layout, the streams of an aggregate's
+    children have guids unrelated to the root's, and nothing in the store
+    tells which aggregate they belong to, so they would be replayed by other
+    workers, out of order with the root's.
+
+    After every batch, in order, the last guid replayed is written to the
+    checkpoint file, if there is one, and a later run resumes after it. Batches
+    replayed after the checkpoint when a run stops are replayed again, so the
+    router's handlers should be idempotent. Streams created after a run was
+    started are not replayed.
+
+    The event store and event router are either instances, which workers
+    inherit when they are forked, or fully-qualified class names, which every
+    worker locates afresh with the given settings. Use class names for
+    services holding a connection which mustn't be shared, like
+    :class:`recall.event_router.AMQP`.
+
+    :param event_store: The event store, or its fully-qualified class name
+    :type event_store: :class:`recall.event_store.EventStore`
+
+    :param event_router: The event router, or its fully-qualified class name
+    :type event_router: :class:`recall.event_router.EventRouter`
+
+    :param settings: The configuration settings of located services
+    :type settings: :class:`dict`
+
+    :param processes: The number of worker processes, or 0 to replay in the
+                      calling process
+    :type processes: :class:`int`
+
+    :param batch_size: The number of streams in a batch
+    :type batch_size: :class:`int`
+
+    :param checkpoint: The path of the checkpoint file
+    :type checkpoint: :class:`str`
+    """
+    def __init__(self, event_store, event_router, settings=None, processes=0,
+                 batch_size=100, checkpoint=None):
+        assert isinstance(event_store, (recall.event_store.EventStore,
+                                        str, unicode))
+        assert isinstance(event_router, (recall.event_router.EventRouter,
+                                         str, unicode))
+        assert isinstance(settings, (dict, type(None)))
+        assert isinstance(processes, int) and processes >= 0
+        assert isinstance(batch_size, int) and batch_size > 0
+        assert isinstance(checkpoint, (str, unicode, type(None)))
+        self.event_store = event_store
+        self.event_router = event_router
+        self.settings = settings or {}
+        self.processes = processes
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+
+    def run(self):
+        """
+        Replay all streams after the checkpoint, and get the totals of
+        streams and events replayed, including those of earlier runs
+
+        :rtype: :class:`dict`
+        """
+        event_store, _ = _locate(self.event_store, None, self.settings)
+        if event_store.layout != recall.event_store.AGGREGATE_LAYOUT:
+            raise ValueError("Only stores with the aggregate layout can be "
+                             "replayed, by aggregate")
+
+        totals = self._read_checkpoint()
+        guids = sorted(str(guid) for guid in event_store.get_stream_guids())
+        if totals["guid"]:
+            guids = [guid for guid in guids if guid > totals["guid"]]
+
+        batches = [guids[i:i + self.batch_size]
+                   for i in range(0, len(guids), self.batch_size)]
+        args = (self.event_store, self.event_router, self.settings)
+        pool = None
+        if self.processes:
+            pool = multiprocessing.Pool(self.processes, _initialize, args)
+            results = pool.imap(_replay_batch, batches)
+        else:
+            _initialize(*args)
+            results = (_replay_batch(batch) for batch in batches)
+
+        try:
+            for batch, (streams, events) in zip(batches, results):
+                totals["guid"] = batch[-1]
+                totals["streams"] += streams
+                totals["events"] += events
+                self._write_checkpoint(totals)
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        return totals
+
+    def _read_checkpoint(self):
+        """
+        Read the checkpoint file, if there is one
+
+        :rtype: :class:`dict`
+        """
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint:
+                return json.load(checkpoint)
+
+        return {"guid": None, "streams": 0, "events": 0}
+
+    def _write_checkpoint(self, totals):
+        """
+        Replace the checkpoint file, if there is one
+
+        :param totals: The last guid replayed, and the totals so far
+        :type totals: :class:`dict`
+        """
+        assert isinstance(totals, dict)
+        if not self.checkpoint:
+            return
+
+        path = self.checkpoint + ".tmp"
+        with open(path, "w") as checkpoint:
+            json.dump(totals, checkpoint)
+
+        os.rename(path, self.checkpoint)
+
+
+def _locate(event_store, event_router, settings):
+    """
+    Locate the services given by their fully-qualified class names
+
+    :param event_store: The event store, or its fully-qualified class name
+    :type event_store: :class:`recall.event_store.EventStore`
+
+    :param event_router: The event router, or its fully-qualified class name
+    :type event_router: :class:`recall.event_router.EventRouter`
+
+    :param settings: The configuration settings
+    :type settings: :class:`dict`
+
+    :rtype: :class:`tuple`
+    """
+    locator = recall.locators.Locator(settings)
+    if isinstance(event_store, (str, unicode)):
+        event_store = locator.locate(event_store)
+
+    if isinstance(event_router, (str, unicode)):
+        event_router = locator.locate(event_router)
+
+    return event_store, event_router
+
+
+def _initialize(event_store, event_router, settings):
+    """
+    Set up the services of a replay worker
+
+    :param event_store: The event store, or its fully-qualified class name
+    :type event_store: :class:`recall.event_store.EventStore`
+
+    :param event_router: The event router, or its fully-qualified class name
+    :type event_router: :class:`recall.event_router.EventRouter`
+
+    :param settings: The configuration settings
+    :type settings: :class:`dict`
+    """
+    global _services
+    _services = _locate(event_store, event_router, settings)
+
+
+def _replay_batch(guids):
+    """
+    Replay a batch of streams with the worker's services, reading them all
+    at once. The events of each stream are routed in chunks as they are
+    read, so stores which read long streams page by page never hold them
+    whole.
+
+    :param guids: The guids of the streams, as strings
+    :type guids: :class:`list`
+
+    :rtype: :class:`tuple`
+    """
+    assert isinstance(guids, list)
+    event_store, event_router = _services
+    guids = [uuid.UUID(guid) for guid in guids]
+    streams = event_store.get_events_from_versions(
+        {guid: 0 for guid in guids})
+    events = 0
+    for guid in guids:
+        stream = iter(streams.get(guid) or [])
+        for chunk in iter(lambda: list(itertools.islice(
+                stream, ROUTE_CHUNK_SIZE)), []):
+            event_router.route_many(chunk)
+            events += len(chunk)
+
+    return len(guids), events
+
+
+def main(argv=None):
+    """
+    Replay the events of an aggregate root's event store, as configured in a
+    YAML file like the ones read by :class:`recall.locators.RepositoryLocator`
+
+    :param argv: The command line arguments
+    :type argv: :class:`list`
+    """
+    parser = optparse.OptionParser(
+        usage="%prog [options] CONFIG AGGREGATE_ROOT_FQCN")
+    parser.add_option("-r", "--router", dest="router",
+                      help="Event router to replay through, instead of the "
+                           "aggregate root's own")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                      default=multiprocessing.cpu_count(),
+                      help="Number of worker processes")
+    parser.add_option("-b", "--batch-size", dest="batch_size", type="int",
+                      default=100, help="Number of streams per batch")
+    parser.add_option("-k", "--checkpoint", dest="checkpoint",
+                      help="Checkpoint file to resume from and update")
+    values, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error("expected a config file and an aggregate root")
+
+    with open(args[0]) as config:
+        settings = yaml.safe_load(config) or {}
+
+    section = settings.get(args[1]) or {}
+    if not section.get("event_store"):
+        parser.error("%s has no event_store configured" % args[1])
+
+    try:
+        totals = Replayer(
+            section["event_store"],
+            values.router or section.get("event_router")
+            or "recall.event_router.StdOut",
+            settings, values.processes, values.batch_size,
+            values.checkpoint).run()
+    except ValueError as e:
+        parser.error(str(e))
+
+    print("Replayed %(events)s events from %(streams)s streams" % totals)
@@ -1,10 +1,16 @@
 import collections
+import time
 import uuid
 
 import recall.event_store
 import recall.event_router
+import recall.identity_map
+import recall.instrumentation
 import recall.models
+import recall.snapshot_policy
 import recall.snapshot_store
+import recall.snapshotter
+import recall.unit_of_work
 
 
 class Repository(object):
@@ -33,20 +39,51 @@ class Repository(object):
 
     :param snapshot_frequency: The snapshot frequency
     :type snapshot_frequency: :class:`int`
+
+    :param identity_map: The identity map (unbounded by default)
+    :type identity_map: :class:`recall.identity_map.IdentityMap`
+
+    :param snapshot_policy: The snapshot policy (by default, a snapshot every
+                            ``snapshot_frequency`` events)
+    :type snapshot_policy: :class:`recall.snapshot_policy.SnapshotPolicy`
+
+    :param snapshotter: Writes the snapshots which are due (by default, in the
+                        saving thread)
+    :type snapshotter: :class:`recall.snapshotter.Snapshotter`
+
+    :param instrumentation: Records every load and save (by default, none are
+                            recorded)
+    :type instrumentation: :class:`recall.instrumentation.Instrumentation`
     """
     def __init__(self, root_cls, event_store, snapshot_store, event_router,
-                 snapshot_frequency):
+                 snapshot_frequency, identity_map=None, snapshot_policy=None,
+                 snapshotter=None, instrumentation=None):
         assert isinstance(root_cls, type)
         assert isinstance(event_store, recall.event_store.EventStore)
         assert isinstance(snapshot_store, recall.snapshot_store.SnapshotStore)
         assert isinstance(event_router, recall.event_router.EventRouter)
         assert isinstance(snapshot_frequency, int)
-        self.identity_map = {}
+        assert isinstance(identity_map, (recall.identity_map.IdentityMap,
+                                         type(None)))
+        assert isinstance(snapshot_policy, (
+            recall.snapshot_policy.SnapshotPolicy, type(None)))
+        assert isinstance(snapshotter, (recall.snapshotter.Snapshotter,
+                                        type(None)))
+        assert isinstance(instrumentation, (
+            recall.instrumentation.Instrumentation, type(None)))
+        self.identity_map = (recall.identity_map.Unbounded()
+                             if identity_map is None else identity_map)
         self.root_cls = root_cls
         self.event_store = event_store
         self.snapshot_store = snapshot_store
         self.event_router = event_router
         self.snapshot_frequency = snapshot_frequency
+        self.snapshot_policy = (
+            recall.snapshot_policy.EventCount(snapshot_frequency)
+            if snapshot_policy is None else snapshot_policy)
+        self.snapshotter = (recall.snapshotter.Inline()
+                            if snapshotter is None else snapshotter)
+        self.instrumentation = instrumentation
 
     def load(self, guid):
         """
@@ -58,9 +95,63 @@ class Repository(object):
         :rtype: :class:`recall.models.AggregateRoot`
         """
         assert isinstance(guid, uuid.UUID)
-        root = self._load_entity(guid)
-        self._update_children(root)
-        return root
+        return self.load_many([guid])[0]
+
+    def load_many(self, guids):
+        """
+        Get many aggregate roots by GUID. The identity map, snapshot store and
+        event store are each consulted once for the whole batch, rather than
+        once per aggregate root.
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(guids, collections.Iterable)
+        return self._load(list(guids), self.identity_map)
+
+    def execute(self, guid, command, attempts=3):
+        """
+        Load an aggregate root, apply a command to it and save it. If someone
+        else saved the aggregate root in the meantime, which the event store
+        reports with a :class:`recall.event_store.ConcurrencyError`, the stale
+        root is dropped from the identity map, reloaded and the command applied
+        again, up to the given number of attempts.
+
+        The command is a callable taking the aggregate root, and may be called
+        more than once; it should only act on the root.
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param command: Applies the command to the aggregate root
+        :type command: :class:`collections.Callable`
+
+        :param attempts: The maximum number of attempts
+        :type attempts: :class:`int`
+
+        :rtype: :class:`recall.models.AggregateRoot`
+        """
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(command, collections.Callable)
+        assert isinstance(attempts, int) and attempts > 0
+        for attempt in range(attempts):
+            root = self.load(guid)
+            try:
+                command(root)
+                self.save(root)
+                return root
+            except recall.event_store.ConcurrencyError:
+                if attempt == attempts - 1:
+                    raise
+            finally:
+                if root._has_events():
+                    # Another thread may evict the root first
+                    try:
+                        del self.identity_map[guid]
+                    except KeyError:
+                        pass
 
     def save(self, root):
         """
@@ -70,118 +161,370 @@ class Repository(object):
         :type root: :class:`recall.models.AggregateRoot`
         """
         assert isinstance(root, recall.models.AggregateRoot)
-        if not root.get_all_events():
-            return
+        self.save_many([root])
+
+    def save_many(self, roots):
+        """
+        Save many aggregate roots as one unit of work, so that their events are
+        stored, routed and snapshotted in batches
+
+        :param roots: The aggregate roots
+        :type roots: :class:`collections.Iterable`
+        """
+        assert isinstance(roots, collections.Iterable)
+        uow = recall.unit_of_work.UnitOfWork()
+        for root in roots:
+            uow.register(self, root)
 
-        self.event_store.save(root)
-        self._route_all_events(root)
-        self._clean_entity(root)
-        if root._version % self.snapshot_frequency == 0:
-            self.snapshot_store.save(root)
+        uow.commit()
 
     def _clean_entity(self, root):
         """
-        Clears staged events and increments versions on all entities in the
-        aggregate.
+        Clears staged events and increments versions on the entities of the
+        aggregate which have staged events.
 
         :param root: The aggregate root
         :type root: :class:`recall.models.AggregateRoot`
         """
         assert isinstance(root, recall.models.AggregateRoot)
-        for entity in root._get_all_entities():
+        staged = root._get_staged_entities()
+        self.snapshot_policy.record_save(root, [
+            event for entity in staged for event in entity._events])
+        for entity in staged:
+            root._aggregate_version += len(entity._events)
             entity._increment_version(len(entity._events))
             entity._clear_events()
 
-    def _route_all_events(self, root):
+        root._clear_staged_entities()
+
+    def _needs_snapshot(self, root):
         """
-        Routes all staged events for all entities in the aggregate.
+        Whether a freshly saved aggregate root is due for a snapshot
 
         :param root: The aggregate root
         :type root: :class:`recall.models.AggregateRoot`
+
+        :rtype: :class:`bool`
         """
         assert isinstance(root, recall.models.AggregateRoot)
-        for event in root.get_all_events():
-            self.event_router.route(event)
+        return self.snapshot_policy.should_snapshot(root)
 
-    def _load_entity(self, guid):
+    def _load(self, guids, identity_map, record=True):
         """
-        Get an aggregate root by GUID
+        Get many aggregate roots by GUID through an identity map
 
-        :param guid: The guid of the aggregate root
-        :type guid: :class:`uuid.UUID`
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
 
-        :rtype: :class:`recall.models.AggregateRoot`
+        :param identity_map: The identity map
+        :type identity_map: :class:`recall.identity_map.IdentityMap`
+
+        :param record: Tell the snapshot policy and the instrumentation about
+                       the load
+        :type record: :class:`bool`
+
+        :rtype: :class:`list`
         """
-        assert isinstance(guid, uuid.UUID)
-        entity = (
-            self._load_from_identity_map(guid)
-            or self._load_from_snapshot(guid)
-            or self._load_from_event_store(guid)
-        )
+        assert isinstance(guids, list)
+        assert isinstance(identity_map, recall.identity_map.IdentityMap)
+        assert isinstance(record, bool)
+        operation = (None if self.instrumentation is None or not record
+                     else recall.instrumentation.Operation("load"))
+        replay = {}
+        if self.event_store.layout == recall.event_store.AGGREGATE_LAYOUT:
+            roots = self._load_aggregates(
+                guids, identity_map, replay, operation)
+        else:
+            roots = self._load_entities(guids, identity_map, replay, operation)
+
+        if record:
+            for root, events, elapsed in replay.values():
+                self.snapshot_policy.record_load(root, events, elapsed)
+
+        if operation is not None:
+            operation.roots = len(roots)
+            operation.events = sum(events for _, events, _ in replay.values())
+            operation.calls.append(
+                ("replay", sum(elapsed for _, _, elapsed in replay.values())))
+            operation.finish()
+            self.instrumentation.record(operation)
+
+        return [roots[guid] for guid in guids]
+
+    def _load_detached(self, guids):
+        """
+        Get private copies of many aggregate roots by GUID from the snapshot
+        and event stores, bypassing the identity map. The loads aren't told
+        to the snapshot policy or the instrumentation, which only count loads
+        made by users of the repository.
 
-        if entity:
-            self.identity_map[entity.guid] = entity
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
 
-        return entity
+        :rtype: :class:`list`
+        """
+        assert isinstance(guids, list)
+        return self._load(guids, recall.identity_map.Unbounded(), False)
 
-    def _load_from_identity_map(self, guid):
+    def _load_entities(self, guids, identity_map, replay, operation=None):
         """
-        Attempt to get an aggregate root by GUID from the identity map
+        Get many aggregate roots by GUID, and catch up the roots found in the
+        identity map and all children
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
+
+        :param identity_map: The identity map
+        :type identity_map: :class:`recall.identity_map.IdentityMap`
+
+        :param replay: The replayed events and time, keyed by root
+        :type replay: :class:`dict`
+
+        :param operation: The load being recorded, if any
+        :type operation: :class:`recall.instrumentation.Operation`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, list)
+        assert isinstance(identity_map, recall.identity_map.IdentityMap)
+        assert isinstance(replay, dict)
+        roots = {}
+        for guid in guids:
+            assert isinstance(guid, uuid.UUID)
+            root = self._load_from_identity_map(identity_map, guid)
+            if root:
+                roots[guid] = root
+
+        if operation is not None:
+            operation.sources[recall.instrumentation.IDENTITY_MAP] += len(
+                roots)
+
+        misses = self._load_from_snapshots(
+            list(set(guids) - set(roots)), operation)
+        if misses:
+            events = self._call(
+                operation, "event_store.get_events_from_versions",
+                self.event_store.get_events_from_versions,
+                {guid: root._version for guid, root in misses.items()})
+            for guid, root in misses.items():
+                self._replay(replay, root, root, events.get(guid) or [])
+                identity_map[root.guid] = root
+
+        cached = {id(root): root for root in roots.values()}
+        roots.update(misses)
+        self._update_children(roots.values(), replay, operation, cached)
+        return roots
+
+    def _load_from_identity_map(self, identity_map, guid):
+        """
+        Attempt to get an aggregate root by GUID from an identity map
+
+        :param identity_map: The identity map
+        :type identity_map: :class:`recall.identity_map.IdentityMap`
 
         :param guid: The guid of the aggregate root
         :type guid: :class:`uuid.UUID`
 
         :rtype: :class:`recall.models.AggregateRoot`
         """
+        assert isinstance(identity_map, recall.identity_map.IdentityMap)
         assert isinstance(guid, uuid.UUID)
-        return self.identity_map.get(guid)
+        return identity_map.get(guid)
 
-    def _load_from_snapshot(self, guid):
+    def _load_from_snapshots(self, guids, operation=None):
         """
-        Attempt to get an aggregate root by GUID from a snapshot
+        Get many aggregate roots by GUID from their snapshots, or as new roots
+        if they have none
 
-        :param guid: The guid of the aggregate root
-        :type guid: :class:`uuid.UUID`
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
 
-        :rtype: :class:`recall.models.AggregateRoot`
+        :param operation: The load being recorded, if any
+        :type operation: :class:`recall.instrumentation.Operation`
+
+        :rtype: :class:`dict`
         """
-        assert isinstance(guid, uuid.UUID)
-        entity = self.snapshot_store.load(guid)
+        assert isinstance(guids, list)
+        if not guids:
+            return {}
 
-        if entity:
-            events = self.event_store.get_events_from_version(guid, entity._version)
-            self._push_events(entity, events)
+        snapshots = self._call(operation, "snapshot_store.load_many",
+                               self.snapshot_store.load_many, guids)
+        if operation is not None:
+            operation.sources[recall.instrumentation.SNAPSHOT] += len(
+                snapshots)
+            operation.sources[recall.instrumentation.EVENTS] += (
+                len(guids) - len(snapshots))
 
-        return entity
+        return {guid: snapshots.get(guid) or self.root_cls() for guid in guids}
 
-    def _load_from_event_store(self, guid):
+    def _load_aggregates(self, guids, identity_map, replay, operation=None):
         """
-        Attempt to get an aggregate root by GUID from the event stream
+        Get many aggregate roots by GUID from aggregate-scoped streams. Every
+        root, including those found in the identity map, is caught up with a
+        single read of its stream, which also catches up all of its children.
 
-        :param guid: The guid of the aggregate root
-        :type guid: :class:`uuid.UUID`
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`list`
 
-        :rtype: :class:`recall.models.AggregateRoot`
+        :param identity_map: The identity map
+        :type identity_map: :class:`recall.identity_map.IdentityMap`
+
+        :param replay: The replayed events and time, keyed by root
+        :type replay: :class:`dict`
+
+        :param operation: The load being recorded, if any
+        :type operation: :class:`recall.instrumentation.Operation`
+
+        :rtype: :class:`dict`
         """
-        assert isinstance(guid, uuid.UUID)
-        ar = self.root_cls()
-        events = self.event_store.get_all_events(guid)
-        self._push_events(ar, events)
-        return ar
+        assert isinstance(guids, list)
+        assert isinstance(identity_map, recall.identity_map.IdentityMap)
+        assert isinstance(replay, dict)
+        roots = {}
+        for guid in guids:
+            assert isinstance(guid, uuid.UUID)
+            root = self._load_from_identity_map(identity_map, guid)
+            if root:
+                roots[guid] = root
+
+        if operation is not None:
+            operation.sources[recall.instrumentation.IDENTITY_MAP] += len(
+                roots)
+
+        misses = self._load_from_snapshots(
+            list(set(guids) - set(roots)), operation)
+        roots.update(misses)
+        records = self._call(
+            operation, "event_store.get_aggregate_events_from_versions",
+            self.event_store.get_aggregate_events_from_versions,
+            {guid: root._aggregate_version for guid, root in roots.items()})
+        for guid, root in roots.items():
+            start = time.time()
+            events = self._push_aggregate_events(
+                root, guid, records.get(guid) or [])
+            replay[id(root)] = (root, events, time.time() - start)
+
+        for root in misses.values():
+            identity_map[root.guid] = root
+
+        return roots
+
+    def _update_children(self, roots, replay, operation=None, cached=None):
+        """
+        Updates all children of the aggregate roots to their current version.
+        The (guid, version) pairs of every known child are collected from the
+        roots' indexes of their entities and their events fetched with one
+        batched read. Children created by those events are caught up by a
+        further read, and so on, so an aggregate costs as many reads as it has
+        newly created levels of children, rather than one read per child.
+
+        Roots from the identity map, which other processes may have saved
+        since, are caught up along with their children. Their streams are
+        first probed for their versions, which is much cheaper than reading
+        them, and only the tails of the streams which moved on are read.
+        Children created while catching up are read without a probe.
+
+        :param roots: The aggregate roots
+        :type roots: :class:`collections.Iterable`
+
+        :param replay: The replayed events and time, keyed by root
+        :type replay: :class:`dict`
+
+        :param operation: The load being recorded, if any
+        :type operation: :class:`recall.instrumentation.Operation`
+
+        :param cached: The aggregate roots from the identity map, keyed by id
+        :type cached: :class:`dict`
+        """
+        assert isinstance(roots, collections.Iterable)
+        assert isinstance(replay, dict)
+        assert isinstance(cached, (dict, type(None)))
+        roots = list(roots)
+        cached = cached or {}
+        seen = set(cached)
+        entities = [(root, root) for root in cached.values()]
+        while True:
+            for root in roots:
+                for child in root._get_indexed_entities():
+                    if id(child) not in seen:
+                        seen.add(id(child))
+                        entities.append((root, child))
+
+            if not entities:
+                return
+
+            probed = [e for root, e in entities if id(root) in cached]
+            if probed:
+                versions = self._call(
+                    operation, "event_store.get_versions",
+                    self.event_store.get_versions,
+                    [entity.guid for entity in probed])
+                entities = [
+                    (root, entity) for root, entity in entities
+                    if id(root) not in cached
+                    or versions.get(entity.guid, 0) > entity._version]
+
+            # Children found from now on were created by replayed events
+            cached = {}
+
+            if entities:
+                events = self._call(
+                    operation, "event_store.get_events_from_versions",
+                    self.event_store.get_events_from_versions,
+                    {entity.guid: entity._version for _, entity in entities})
+                for root, entity in entities:
+                    self._replay(
+                        replay, root, entity, events.get(entity.guid) or [])
+
+            entities = []
+
+    def _call(self, operation, name, func, *args):
+        """
+        Call a store, timing the call if the operation is being recorded
+
+        :param operation: The operation being recorded, if any
+        :type operation: :class:`recall.instrumentation.Operation`
+
+        :param name: The name of the call, e.g. "snapshot_store.load_many"
+        :type name: :class:`str`
 
-    def _update_children(self, entity):
+        :param func: The store method
+        :type func: :class:`collections.Callable`
+
+        :rtype: :class:`object`
         """
-        Updates all children on a domain entity to their current version.
+        if operation is None:
+            return func(*args)
+
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            operation.calls.append((name, time.time() - start))
+
+    def _replay(self, replay, root, entity, events):
+        """
+        Updates a single domain entity to its current version, adding the
+        events and time it took to those replayed for its aggregate root.
+
+        :param replay: The replayed events and time, keyed by root
+        :type replay: :class:`dict`
+
+        :param root: The aggregate root of the domain entity
+        :type root: :class:`recall.models.AggregateRoot`
 
         :param entity: The domain entity
         :type entity: :class:`recall.models.Entity`
+
+        :param events: The domain events
+        :type events: :class:`collections.Iterable`
         """
-        assert isinstance(entity, recall.models.Entity)
-        for child in entity._get_child_entities():
-            self._push_events(child, self.event_store.get_events_from_version(
-                child.guid,
-                child._version))
-            self._update_children(child)
+        assert isinstance(replay, dict)
+        start = time.time()
+        count = self._push_events(entity, events)
+        _, total, elapsed = replay.get(id(root), (root, 0, 0.0))
+        replay[id(root)] = (root, total + count, elapsed + time.time() - start)
 
     def _push_events(self, entity, events):
         """
@@ -192,9 +535,50 @@ class Repository(object):
 
         :param events: The domain events
         :type events: :class:`collections.Iterable`
+
+        :rtype: :class:`int`
         """
         assert isinstance(entity, recall.models.Entity)
         assert isinstance(events, collections.Iterable)
+        count = 0
         for event in events:
             entity._handle_domain_event(event)
             entity._increment_version()
+            count += 1
+
+        return count
+
+    def _push_aggregate_events(self, root, guid, records):
+        """
+        Updates a whole aggregate to its current version from the records of
+        its aggregate-scoped stream, in one pass. Each event is applied to the
+        entity whose GUID it is tagged with, found in the root's index of its
+        entities, which picks up children as the handlers attach them. Events
+        for entities which are no longer part of the aggregate are skipped.
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :param guid: The guid of the aggregate root
+        :type guid: :class:`uuid.UUID`
+
+        :param records: The (entity guid, domain event) records
+        :type records: :class:`collections.Iterable`
+
+        :rtype: :class:`int`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        assert isinstance(guid, uuid.UUID)
+        assert isinstance(records, collections.Iterable)
+        count = 0
+        for entity_guid, event in records:
+            entity = root if entity_guid == guid else root._get_entity(
+                entity_guid)
+            if entity:
+                entity._handle_domain_event(event)
+                entity._increment_version()
+
+            root._aggregate_version += 1
+            count += 1
+
+        return count
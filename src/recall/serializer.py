@@ -0,0 +1,237 @@
+import binascii
+import datetime
+import json
+import struct
+import uuid
+
+import msgpack
+
+import recall.event_marshaler
+import recall.locators
+import recall.models
+
+#: The msgpack extension type codes of the binary format
+UUID_EXT = 1
+DATETIME_EXT = 2
+DATE_EXT = 3
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class Serializer(object):
+    """
+    The Serializer interface
+
+    A serializer encodes a domain event, along with the guid of its entity in
+    aggregate-scoped streams, as a record of bytes, and decodes it again.
+    Every record starts with the serializer's marker, so records of several
+    formats can share a stream: a store reads each record with the serializer
+    whose marker it starts with. Only :class:`Json` has an empty marker.
+
+    Stores and routers are given a serializer by its fully-qualified class
+    name in their settings, e.g.::
+
+        recall.event_store.Redis:
+          host: localhost
+          serializer: recall.serializer.Binary
+    """
+    #: The bytes every record of the format starts with
+    MARKER = ""
+
+    def accepts(self, record):
+        """
+        Whether a record is in this serializer's format
+
+        :param record: The record
+        :type record: :class:`str`
+
+        :rtype: :class:`bool`
+        """
+        return record.startswith(self.MARKER)
+
+    def dumps(self, event, guid=None):
+        """
+        Encode a domain event
+
+        :param event: The domain event
+        :type event: :class:`recall.models.Event`
+
+        :param guid: The guid of the event's domain entity, to be stored with
+                     the event
+        :type guid: :class:`uuid.UUID`
+
+        :rtype: :class:`str`
+        """
+        assert isinstance(event, recall.models.Event)
+        assert isinstance(guid, (uuid.UUID, type(None)))
+        raise NotImplementedError
+
+    def loads(self, record):
+        """
+        Decode a domain event, along with the guid of its entity, if it was
+        stored with one
+
+        :param record: The record
+        :type record: :class:`str`
+
+        :rtype: :class:`tuple`
+        """
+        raise NotImplementedError
+
+
+class Json(Serializer):
+    """
+    Encode domain events as JSON, with UUIDs and datetimes tagged. Records
+    have no marker, as this was the only format until there were others.
+
+    :param marshaler: The event marshaler
+    :type marshaler: :class:`recall.event_marshaler.DefaultEventMarshaler`
+    """
+    def __init__(self, marshaler=None):
+        assert isinstance(marshaler, (recall.event_marshaler.EventMarshaler,
+                                      type(None)))
+        self.marshaler = (recall.event_marshaler.DefaultEventMarshaler()
+                          if marshaler is None else marshaler)
+
+    def dumps(self, event, guid=None):
+        assert isinstance(event, recall.models.Event)
+        assert isinstance(guid, (uuid.UUID, type(None)))
+        if guid is None:
+            return self.marshaler.encode(event, json.dumps)
+
+        return json.dumps(dict(self.marshaler.marshal(event),
+                               __entity__=str(guid)))
+
+    def loads(self, record):
+        marshaled = json.loads(record)
+        guid = marshaled.get("__entity__")
+        return (uuid.UUID(guid) if guid else None,
+                self.marshaler.unmarshal(marshaled))
+
+
+class Binary(Serializer):
+    """
+    Encode domain events as msgpack, with UUIDs as their 16 bytes, datetimes
+    as microseconds since the epoch and dates as their ordinal, in extension
+    types. Datetimes must be naive. A record takes a fraction of the bytes of
+    its JSON counterpart, and decodes without parsing strings.
+
+    Records start with a NUL byte, which no JSON record does, and the
+    version of the format.
+
+    On Python 2, byte strings are packed as msgpack bin and unicode strings
+    as msgpack str, so each reads back as the type it was written with. A
+    consumer which only knows the older msgpack format, which packs both as
+    raw, must be updated before it is sent records of this one, e.g. by
+    configuring the serializer of an AMQP router.
+
+    :param marshaler: The event marshaler
+    :type marshaler: :class:`recall.event_marshaler.NativeEventMarshaler`
+    """
+    MARKER = "\x00\x01"
+
+    def __init__(self, marshaler=None):
+        assert isinstance(marshaler, (recall.event_marshaler.EventMarshaler,
+                                      type(None)))
+        self.marshaler = (recall.event_marshaler.NativeEventMarshaler()
+                          if marshaler is None else marshaler)
+
+    def dumps(self, event, guid=None):
+        assert isinstance(event, recall.models.Event)
+        assert isinstance(guid, (uuid.UUID, type(None)))
+        if guid is None:
+            return self.marshaler.encode(event, _pack)
+
+        return _pack(dict(self.marshaler.marshal(event), __entity__=guid))
+
+    def loads(self, record):
+        marshaled = msgpack.unpackb(record[len(self.MARKER):],
+                                    ext_hook=_ext_hook, raw=False)
+        return (marshaled.pop("__entity__", None),
+                self.marshaler.unmarshal(marshaled))
+
+
+def get_serializer(serializer, settings=None):
+    """
+    Get a serializer given as an instance, or by its fully-qualified class
+    name and the settings to create it with
+
+    :param serializer: The serializer, or its fully-qualified class name
+    :type serializer: :class:`recall.serializer.Serializer`
+
+    :param settings: The settings of a serializer given by name
+    :type settings: :class:`dict`
+
+    :rtype: :class:`recall.serializer.Serializer`
+    """
+    assert isinstance(serializer, (Serializer, str, unicode))
+    assert isinstance(settings, (dict, type(None)))
+    if isinstance(serializer, Serializer):
+        return serializer
+
+    serializer = recall.locators.Locator({}).create(
+        serializer, settings or {})
+    if not isinstance(serializer, Serializer):
+        raise TypeError("%s isn't a recall.serializer.Serializer"
+                        % serializer.__class__.__name__)
+
+    return serializer
+
+
+def _pack(marshaled):
+    """
+    Encode a marshaled domain event in the binary format
+
+    :param marshaled: The marshaled domain event
+    :type marshaled: :class:`dict`
+
+    :rtype: :class:`str`
+    """
+    return Binary.MARKER + msgpack.packb(
+        marshaled, default=_default, use_bin_type=True)
+
+
+def _default(obj):
+    """
+    Encode the values msgpack has no type for as extension types
+
+    :param obj: The value
+    :type obj: :class:`object`
+
+    :rtype: :class:`msgpack.ExtType`
+    """
+    if isinstance(obj, uuid.UUID):
+        # Much faster than UUID.bytes, which builds the bytes one at a time
+        return msgpack.ExtType(UUID_EXT, binascii.unhexlify(obj.hex))
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo is not None:
+            raise TypeError("Can't encode aware datetime %r" % obj)
+        delta = obj - _EPOCH
+        return msgpack.ExtType(DATETIME_EXT, struct.pack(
+            ">q", (delta.days * 86400 + delta.seconds) * 1000000
+            + delta.microseconds))
+    if isinstance(obj, datetime.date):
+        return msgpack.ExtType(DATE_EXT, struct.pack(">i", obj.toordinal()))
+    raise TypeError("Can't encode %r" % obj)
+
+
+def _ext_hook(code, data):
+    """
+    Decode the extension types of the binary format
+
+    :param code: The extension type code
+    :type code: :class:`int`
+
+    :param data: The encoded value
+    :type data: :class:`str`
+
+    :rtype: :class:`object`
+    """
+    if code == UUID_EXT:
+        return uuid.UUID(binascii.hexlify(data))
+    if code == DATETIME_EXT:
+        return _EPOCH + datetime.timedelta(
+            microseconds=struct.unpack(">q", data)[0])
+    if code == DATE_EXT:
+        return datetime.date.fromordinal(struct.unpack(">i", data)[0])
+    return msgpack.ExtType(code, data)
@@ -0,0 +1,216 @@
+import pickle
+import weakref
+
+import recall.event_marshaler
+import recall.models
+
+
+class SnapshotPolicy(object):
+    """
+    The Snapshot Policy interface
+
+    A snapshot policy decides when a saved aggregate root is due for a
+    snapshot. The repository tells it how many events it replayed to load a
+    root and how long that took, which events it saved, and when it took a
+    snapshot. The policy keeps whatever it needs for as long as the root
+    object lives.
+    """
+    def __init__(self):
+        self._state = weakref.WeakKeyDictionary()
+
+    def record_load(self, root, events, elapsed):
+        """
+        Record the replay of events onto an aggregate root during a load
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :param events: The number of events replayed
+        :type events: :class:`int`
+
+        :param elapsed: The seconds spent applying them
+        :type elapsed: :class:`float`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        assert isinstance(events, int)
+        assert isinstance(elapsed, float)
+
+    def record_save(self, root, events):
+        """
+        Record the events saved for an aggregate root
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :param events: The events saved, for all entities of the aggregate
+        :type events: :class:`list`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        assert isinstance(events, list)
+
+    def record_snapshot(self, root):
+        """
+        Record that a snapshot of an aggregate root was taken
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        self._state.pop(root, None)
+
+    def should_snapshot(self, root):
+        """
+        Whether a freshly saved aggregate root is due for a snapshot
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :rtype: :class:`bool`
+        """
+        assert isinstance(root, recall.models.AggregateRoot)
+        raise NotImplementedError
+
+    def _get_state(self, root):
+        """
+        Get the state the policy keeps for an aggregate root
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+
+        :rtype: :class:`list`
+        """
+        state = self._state.get(root)
+        if state is None:
+            state = self._state[root] = [0]
+
+        return state
+
+
+class EventCount(SnapshotPolicy):
+    """
+    Snapshot once the events replayed and saved since the last snapshot, for
+    all entities of the aggregate, reach the frequency. Unlike checking the
+    root's version against a multiple of the frequency, a save of several
+    events can't skip past it.
+
+    :param frequency: The number of events between snapshots
+    :type frequency: :class:`int`
+    """
+    def __init__(self, frequency=10):
+        assert isinstance(frequency, int) and frequency > 0
+        super(EventCount, self).__init__()
+        self.frequency = frequency
+
+    def record_load(self, root, events, elapsed):
+        self._get_state(root)[0] += events
+
+    def record_save(self, root, events):
+        self._get_state(root)[0] += len(events)
+
+    def should_snapshot(self, root):
+        return self._get_state(root)[0] >= self.frequency
+
+
+class ReplayTime(SnapshotPolicy):
+    """
+    Snapshot once replaying the events since the last snapshot is estimated
+    to take longer than a threshold. The time spent applying events is
+    measured on every load; the time saved events would take is estimated
+    from the average time per event measured so far, or from ``event_time``
+    until a load has been measured, so that roots which are only ever created
+    and saved by a process are snapshotted too.
+
+    :param threshold: The replay time between snapshots, in seconds
+    :type threshold: :class:`float`
+
+    :param event_time: The estimated replay time of an event, in seconds
+    :type event_time: :class:`float`
+    """
+    def __init__(self, threshold=0.05, event_time=0.00005):
+        assert isinstance(threshold, (int, float)) and threshold > 0
+        assert isinstance(event_time, (int, float)) and event_time > 0
+        super(ReplayTime, self).__init__()
+        self.threshold = threshold
+        self.event_time = event_time
+        self._seconds = 0.0
+        self._events = 0
+
+    def record_load(self, root, events, elapsed):
+        self._seconds += elapsed
+        self._events += events
+        self._get_state(root)[0] += elapsed
+
+    def record_save(self, root, events):
+        event_time = (self._seconds / self._events if self._events
+                      else self.event_time)
+        self._get_state(root)[0] += len(events) * event_time
+
+    def should_snapshot(self, root):
+        return self._get_state(root)[0] >= self.threshold
+
+
+class ByteSize(SnapshotPolicy):
+    """
+    Snapshot once the events since the last snapshot add up to more than a
+    threshold of bytes, i.e. once the aggregate's history has grown by that
+    much. Saved events are measured by the length of the record the event
+    store encoded them as, which the marshalers keep on them until the save is
+    done. Stores which keep events as they are, like
+    :class:`recall.event_store.Memory`, leave nothing to measure, so one in
+    ``SAMPLE`` of those events is measured by the length of its pickle. Other
+    events, and replayed ones, are estimated from the average size measured
+    so far.
+
+    :param threshold: The bytes of events between snapshots
+    :type threshold: :class:`int`
+    """
+    #: Measure one in this many saved events which weren't encoded
+    SAMPLE = 16
+
+    def __init__(self, threshold=65536):
+        assert isinstance(threshold, int) and threshold > 0
+        super(ByteSize, self).__init__()
+        self.threshold = threshold
+        self._bytes = 0
+        self._events = 0
+        self._unencoded = 0
+
+    def record_load(self, root, events, elapsed):
+        if self._events:
+            self._get_state(root)[0] += events * self._bytes // self._events
+
+    def record_save(self, root, events):
+        size = 0
+        for event in events:
+            measured = self._measure(event)
+            if measured is None:
+                size += self._bytes // self._events
+            else:
+                self._bytes += measured
+                self._events += 1
+                size += measured
+
+        self._get_state(root)[0] += size
+
+    def should_snapshot(self, root):
+        return self._get_state(root)[0] >= self.threshold
+
+    def _measure(self, event):
+        """
+        Measure a saved event by its encoded record, or by its pickle if it
+        has none and is sampled, or else return None
+
+        :param event: The domain event
+        :type event: :class:`recall.models.Event`
+
+        :rtype: :class:`int`
+        """
+        size = recall.event_marshaler.get_encoded_size(event)
+        if size is None:
+            self._unencoded += 1
+            if self._events and self._unencoded % self.SAMPLE:
+                return None
+
+            size = len(pickle.dumps(event, pickle.HIGHEST_PROTOCOL))
+
+        return size
@@ -1,3 +1,4 @@
+import collections
 import pickle
 import uuid
 
@@ -29,6 +30,21 @@ class SnapshotStore(object):
         assert isinstance(guid, uuid.UUID)
         raise NotImplementedError
 
+    def load_many(self, guids):
+        """
+        Load many aggregate roots from their snapshots. Roots without a
+        snapshot are left out of the result. Stores which can batch their reads
+        should override this; the default simply loads each root in turn.
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        snapshots = ((guid, self.load(guid)) for guid in guids)
+        return {guid: root for guid, root in snapshots if root}
+
     def save(self, root):
         """
         Take a snapshot of an aggregate root
@@ -39,6 +55,19 @@ class SnapshotStore(object):
         assert isinstance(root, recall.models.AggregateRoot)
         raise NotImplementedError
 
+    def save_many(self, roots):
+        """
+        Take snapshots of many aggregate roots. Stores which can batch their
+        writes should override this; the default simply saves each root in
+        turn.
+
+        :param roots: The aggregate roots
+        :type roots: :class:`collections.Iterable`
+        """
+        assert isinstance(roots, collections.Iterable)
+        for root in roots:
+            self.save(root)
+
 
 class Memory(SnapshotStore):
     """
@@ -61,6 +90,20 @@ class Memory(SnapshotStore):
         snapshot = self._snapshots.get(guid)
         return pickle.loads(snapshot) if snapshot else None
 
+    def load_many(self, guids):
+        """
+        Load many aggregate roots from their snapshots
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        snapshots = ((guid, self._snapshots.get(guid)) for guid in guids)
+        return {guid: pickle.loads(snapshot)
+                for guid, snapshot in snapshots if snapshot}
+
     def save(self, root):
         """
         Take a snapshot of an aggregate root
@@ -91,6 +134,22 @@ class Memcached(SnapshotStore):
         assert isinstance(guid, uuid.UUID)
         return self._cache.get(str(guid))
 
+    def load_many(self, guids):
+        """
+        Load many aggregate roots from their snapshots with a single
+        ``get_multi`` call
+
+        :param guids: The guids of the aggregate roots
+        :type guids: :class:`collections.Iterable`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(guids, collections.Iterable)
+        keys = {str(guid): guid for guid in guids}
+        return {keys[key]: root
+                for key, root in self._cache.get_multi(list(keys)).items()
+                if root}
+
     def save(self, root):
         """
         Take a snapshot of an aggregate root
@@ -99,4 +158,16 @@ class Memcached(SnapshotStore):
         :type root: :class:`recall.models.AggregateRoot`
         """
         assert isinstance(root, recall.models.AggregateRoot)
-        self._cache.set(str(root.guid), root)
\ No newline at end of file
+        self._cache.set(str(root.guid), root)
+
+    def save_many(self, roots):
+        """
+        Take snapshots of many aggregate roots with a single ``set_multi`` call
+
+        :param roots: The aggregate roots
+        :type roots: :class:`collections.Iterable`
+        """
+        assert isinstance(roots, collections.Iterable)
+        mapping = {str(root.guid): root for root in roots}
+        if mapping:
+            self._cache.set_multi(mapping)
\ No newline at end of file
@@ -0,0 +1,196 @@
+import collections
+import threading
+import time
+import weakref
+
+import recall.models
+import recall.repository
+
+
+class Snapshotter(object):
+    """
+    The Snapshotter interface
+
+    A snapshotter writes the snapshots of aggregate roots which a unit of work
+    found due, once their events have been saved. Once a snapshot is written,
+    and only then, the snapshotter records it with the repository's snapshot
+    policy, so a root whose snapshot wasn't written stays due.
+    """
+    def snapshot(self, entries):
+        """
+        Take snapshots of aggregate roots
+
+        :param entries: The (repository, root) pairs
+        :type entries: :class:`list`
+        """
+        assert isinstance(entries, list)
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Get the counters of the snapshotter
+
+        :rtype: :class:`dict`
+        """
+        return {}
+
+
+class Inline(Snapshotter):
+    """
+    Take snapshots in the saving thread, with one call per snapshot store.
+    This is the default for a repository.
+    """
+    def snapshot(self, entries):
+        assert isinstance(entries, list)
+        groups = collections.OrderedDict()
+        for repository, root in entries:
+            store = repository.snapshot_store
+            groups.setdefault(id(store), (store, []))[1].append(root)
+
+        for store, roots in groups.values():
+            store.save_many(roots)
+
+        for repository, root in entries:
+            repository.snapshot_policy.record_snapshot(root)
+
+
+class Background(Snapshotter):
+    """
+    Take snapshots on worker threads, so a save doesn't wait for the
+    aggregate to be serialized and written.
+
+    The live aggregate root may be changed again as soon as the save returns,
+    so a worker never serializes it. Instead it loads a private copy from the
+    snapshot and event stores, bypassing the identity map, which is consistent
+    as of the events saved so far, and snapshots that copy.
+
+    Requests wait in a bounded queue. A request for an aggregate root which is
+    already queued is merged with it, since the worker will load the latest
+    events anyway. When the queue is full, the request is dropped: the events
+    are safe, and the root will be due again on its next save, as it is when
+    writing its snapshot fails. The snapshot policy only records snapshots
+    which were written.
+
+    :param threads: The number of worker threads
+    :type threads: :class:`int`
+
+    :param max_queue: The maximum number of queued aggregate roots
+    :type max_queue: :class:`int`
+    """
+    def __init__(self, threads=1, max_queue=1000):
+        assert isinstance(threads, int) and threads > 0
+        assert isinstance(max_queue, int) and max_queue > 0
+        self.max_queue = max_queue
+        self.written = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._pending = collections.OrderedDict()
+        self._busy = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in range(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def snapshot(self, entries):
+        assert isinstance(entries, list)
+        now = time.time()
+        with self._condition:
+            for repository, root in entries:
+                assert isinstance(repository, recall.repository.Repository)
+                assert isinstance(root, recall.models.AggregateRoot)
+                key = (id(repository), root.guid)
+                if key in self._pending:
+                    self.merged += 1
+                    _, guid, _, queued = self._pending[key]
+                    self._pending[key] = (
+                        repository, guid, weakref.ref(root), queued)
+                elif len(self._pending) >= self.max_queue:
+                    self.dropped += 1
+                else:
+                    self._pending[key] = (
+                        repository, root.guid, weakref.ref(root), now)
+
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        Get the counters of the snapshotter. "depth" is the number of queued
+        aggregate roots, "lag" the seconds the last snapshot written spent
+        queued, and "oldest" the seconds the oldest queued one has waited.
+
+        :rtype: :class:`dict`
+        """
+        with self._condition:
+            oldest = (time.time() - next(iter(self._pending.values()))[3]
+                      if self._pending else 0.0)
+            return {
+                "depth": len(self._pending),
+                "busy": self._busy,
+                "written": self.written,
+                "merged": self.merged,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "lag": self.lag,
+                "max_lag": self.max_lag,
+                "oldest": oldest}
+
+    def flush(self):
+        """
+        Wait until every queued snapshot has been written
+        """
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def close(self):
+        """
+        Write the queued snapshots and stop the worker threads
+        """
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        """
+        Write queued snapshots until the snapshotter is closed
+        """
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+
+                if not self._pending:
+                    return
+
+                _, (repository, guid, live, queued) = self._pending.popitem(
+                    last=False)
+                self._busy += 1
+
+            try:
+                root = repository._load_detached([guid])[0]
+                repository.snapshot_store.save(root)
+                root = live()
+                if root is not None:
+                    repository.snapshot_policy.record_snapshot(root)
+            except Exception:
+                with self._condition:
+                    self.failed += 1
+            else:
+                with self._condition:
+                    self.written += 1
+                    self.lag = time.time() - queued
+                    self.max_lag = max(self.max_lag, self.lag)
+            finally:
+                with self._condition:
+                    self._busy -= 1
+                    self._condition.notify_all()
@@ -0,0 +1,214 @@
+import collections
+import itertools
+import time
+
+import recall.event_marshaler
+import recall.instrumentation
+import recall.models
+import recall.repository
+
+
+class UnitOfWork(object):
+    """
+    A unit of work collects aggregate roots with staged events, possibly from
+    several repositories, and commits them together. Rather than saving one
+    aggregate root at a time, all of their events are written with one call
+    per event store, routed with one call per event router for each store,
+    and the eligible roots handed to their snapshotters, which by default
+    snapshot them with one call per snapshot store. Repositories located with
+    the same settings share their stores, so most commits only make a handful
+    of calls.
+
+    Stores and routers marshaling events the same way share the work, as
+    marshalers keep the marshaled and encoded forms of each event until the
+    commit has routed it.
+
+    It can be used as a context manager, which commits when the block
+    succeeds::
+
+        with recall.unit_of_work.UnitOfWork() as uow:
+            uow.register(accounts, account)
+            uow.register(campaigns, campaign)
+    """
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register(self, repository, root):
+        """
+        Register an aggregate root to be saved by its repository on commit
+
+        :param repository: The repository of the aggregate root
+        :type repository: :class:`recall.repository.Repository`
+
+        :param root: The aggregate root
+        :type root: :class:`recall.models.AggregateRoot`
+        """
+        assert isinstance(repository, recall.repository.Repository)
+        assert isinstance(root, recall.models.AggregateRoot)
+        self._entries[id(root)] = (repository, root)
+
+    def clear(self):
+        """
+        Forget all registered aggregate roots without saving them
+        """
+        self._entries.clear()
+
+    def commit(self):
+        """
+        Save all registered aggregate roots: store their events, route them,
+        and snapshot the roots which are due.
+
+        The roots sharing an event store are routed and cleaned as soon as
+        their events are stored. If a store fails, the roots it and the stores
+        after it were to save stay registered, with their events staged, and
+        the error is raised; committing again only saves those. The roots
+        already saved have no staged events left, and their snapshots are left
+        for their next save.
+        """
+        entries = [(repository, root)
+                   for repository, root in self._entries.values()
+                   if root._has_events()]
+        self.clear()
+        if not entries:
+            return
+
+        operations = self._start(entries)
+        groups = list(self._group(entries, "event_store"))
+        for i, (store, group) in enumerate(groups):
+            try:
+                self._call(operations, group, "event_store.save_many",
+                           store.save_many, [root for _, root in group])
+            except Exception:
+                for _, unsaved in groups[i:]:
+                    for repository, root in unsaved:
+                        self.register(repository, root)
+
+                raise
+
+            self._route(operations, group)
+
+        for snapshotter, group in self._group(entries, "snapshotter"):
+            due = [(repository, root) for repository, root in group
+                   if repository._needs_snapshot(root)]
+            if due:
+                self._call(operations, due, "snapshotter.snapshot",
+                           snapshotter.snapshot, due)
+
+        for repository, operation in operations.values():
+            operation.finish()
+            repository.instrumentation.record(operation)
+
+    def _route(self, operations, entries):
+        """
+        Route the events of aggregate roots whose events were just stored, and
+        clear their staged events. They are cleared even if a router fails, as
+        the events mustn't be stored again.
+
+        :param operations: The saves being recorded, keyed by repository
+        :type operations: :class:`dict`
+
+        :param entries: The (repository, root) pairs
+        :type entries: :class:`list`
+        """
+        assert isinstance(entries, list)
+        events = {id(root): list(root.get_all_events())
+                  for _, root in entries}
+        for repository, root in entries:
+            repository._clean_entity(root)
+
+        try:
+            for router, group in self._group(entries, "event_router"):
+                self._call(operations, group, "event_router.route_many",
+                           router.route_many, itertools.chain.from_iterable(
+                               events[id(root)] for _, root in group))
+        finally:
+            for routed in events.values():
+                recall.event_marshaler.clear_cache(routed)
+
+    def _start(self, entries):
+        """
+        Start recording the save for every instrumented repository
+
+        :param entries: The (repository, root) pairs
+        :type entries: :class:`list`
+
+        :rtype: :class:`dict`
+        """
+        assert isinstance(entries, list)
+        operations = {}
+        for repository, root in entries:
+            if repository.instrumentation is None:
+                continue
+
+            _, operation = operations.setdefault(id(repository), (
+                repository, recall.instrumentation.Operation("save")))
+            operation.roots += 1
+            operation.events += sum(
+                len(entity._events) for entity in root._get_staged_entities())
+
+        return operations
+
+    def _call(self, operations, entries, name, func, *args):
+        """
+        Call a store, router or snapshotter on behalf of a group of
+        (repository, root) pairs, timing the call for every instrumented
+        repository among them
+
+        :param operations: The saves being recorded, keyed by repository
+        :type operations: :class:`dict`
+
+        :param entries: The (repository, root) pairs
+        :type entries: :class:`list`
+
+        :param name: The name of the call, e.g. "event_store.save_many"
+        :type name: :class:`str`
+
+        :param func: The store, router or snapshotter method
+        :type func: :class:`collections.Callable`
+        """
+        if not operations:
+            func(*args)
+            return
+
+        start = time.time()
+        try:
+            func(*args)
+        finally:
+            elapsed = time.time() - start
+            for key in set(id(repository) for repository, _ in entries):
+                if key in operations:
+                    operations[key][1].calls.append((name, elapsed))
+
+    def _group(self, entries, service):
+        """
+        Group (repository, root) pairs by one of the repositories' services
+
+        :param entries: The (repository, root) pairs
+        :type entries: :class:`list`
+
+        :param service: The name of the service, e.g. "event_store"
+        :type service: :class:`str`
+
+        :rtype: :class:`list`
+        """
+        assert isinstance(entries, list)
+        assert isinstance(service, str)
+        groups = collections.OrderedDict()
+        for repository, root in entries:
+            instance = getattr(repository, service)
+            groups.setdefault(id(instance), (instance, []))[1].append(
+                (repository, root))
+
+        return groups.values()
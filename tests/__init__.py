@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/src')
+
+# The locators come first: importing the services first runs into the
+# import cycle between them and the locators
+import recall.locators
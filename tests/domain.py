@@ -0,0 +1,97 @@
+import recall.event_handler
+import recall.event_router
+import recall.models
+
+
+class CompanyFounded(recall.models.Event):
+    def __init__(self, guid, name):
+        self._data = {"guid": guid, "name": name}
+
+
+class WhenCompanyFounded(recall.event_handler.DomainEventHandler):
+    def __call__(self, event):
+        self.entity.guid = event['guid']
+        self.entity.name = event['name']
+
+
+class EmployeeHired(recall.models.Event):
+    def __init__(self, guid, employee_guid, name):
+        self._data = {"guid": guid, "employee_guid": employee_guid,
+                      "name": name}
+
+
+class WhenEmployeeHired(recall.event_handler.DomainEventHandler):
+    def __call__(self, event):
+        self.entity.employees.add(
+            Employee(event['employee_guid'], event['name']))
+
+
+class EmployeePromoted(recall.models.Event):
+    def __init__(self, guid, title):
+        self._data = {"guid": guid, "title": title}
+
+
+class WhenEmployeePromoted(recall.event_handler.DomainEventHandler):
+    def __call__(self, event):
+        self.entity.title = event['title']
+
+
+class Company(recall.models.AggregateRoot):
+    def __init__(self):
+        super(Company, self).__init__()
+        self.name = None
+        self.employees = recall.models.EntityList()
+        self._register_event_handler(CompanyFounded, WhenCompanyFounded)
+        self._register_event_handler(EmployeeHired, WhenEmployeeHired)
+
+    def found(self, name):
+        self._apply_event(CompanyFounded(self._create_guid(), name))
+
+    def hire(self, name):
+        guid = self._create_guid()
+        self._apply_event(EmployeeHired(self.guid, guid, name))
+        return self.employees[guid]
+
+
+class Employee(recall.models.Entity):
+    def __init__(self, guid, name):
+        super(Employee, self).__init__()
+        self.guid = guid
+        self.name = name
+        self.title = None
+        self._register_event_handler(EmployeePromoted, WhenEmployeePromoted)
+
+    def promote(self, title):
+        self._apply_event(EmployeePromoted(self.guid, title))
+
+
+class Recorder(recall.event_router.EventRouter):
+    """
+    Keep the routed events, in order
+    """
+    def __init__(self):
+        self.events = []
+
+    def route(self, event):
+        self.events.append(event)
+
+
+def found(name, employees=()):
+    """
+    Found a company, and hire its employees
+    """
+    company = Company()
+    company.found(name)
+    for employee in employees:
+        company.hire(employee)
+
+    return company
+
+
+def describe(company):
+    """
+    Describe a company and its employees, to compare two copies of it
+    """
+    return (company.guid, company.name, company._version, sorted(
+        (e.guid, e.name, e.title, e._version)
+        for e in company.employees.values()))
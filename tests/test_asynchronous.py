@@ -0,0 +1,111 @@
+import time
+import unittest
+import uuid
+
+import recall.asynchronous
+import recall.event_store
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+
+class SlowStore(recall.event_store.Memory):
+    """
+    Take a while to read, so concurrent loads overlap
+    """
+    def get_versions(self, guids):
+        time.sleep(0.001)
+        return super(SlowStore, self).get_versions(guids)
+
+    def get_events_from_versions(self, versions):
+        time.sleep(0.001)
+        return super(SlowStore, self).get_events_from_versions(versions)
+
+
+class RepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = SlowStore(check_versions=True)
+        self.repository = self.get_repository()
+        self.service = recall.asynchronous.Repository(self.repository, 8)
+
+    def tearDown(self):
+        self.service.close()
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000)
+
+    def load(self, guid):
+        return self.get_repository()._load_detached([guid])[0]
+
+    def test_without_threads(self):
+        service = recall.asynchronous.Repository(self.repository, 0)
+        company = domain.found("Planet Express")
+        result = service.save(company)
+        self.assertTrue(result.ready() and result.successful())
+        self.assertEqual(domain.describe(company),
+                         domain.describe(service.load(company.guid).get()))
+        result = service.execute(uuid.uuid4(), lambda company: 1 / 0)
+        self.assertFalse(result.successful())
+        self.assertRaises(ZeroDivisionError, result.get)
+
+    def test_commands_on_a_root_run_one_at_a_time(self):
+        company = domain.found("Planet Express")
+        self.repository.save(company)
+
+        def hire(company):
+            count = len(company.employees)
+            time.sleep(0.001)
+            company.hire("e%d" % count)
+
+        results = [self.service.execute(company.guid, hire)
+                   for _ in range(20)]
+        for result in results:
+            result.get()
+
+        company = self.load(company.guid)
+        self.assertEqual(
+            sorted("e%d" % i for i in range(20)),
+            sorted(employee.name for employee in company.employees.values()))
+        self.assertEqual(21, company._version)
+
+    def test_loads_catch_a_cached_root_up_once(self):
+        companies = [domain.found("c%d" % i) for i in range(5)]
+        self.repository.save_many(companies)
+        guids = [company.guid for company in companies]
+        for round in range(5):
+            self.service.load_many(guids).get()
+            other = self.get_repository()
+            loaded = other.load_many(guids)
+            for company in loaded:
+                company.hire("e%d" % round)
+
+            other.save_many(loaded)
+            results = [self.service.load(guid) for guid in guids]
+            results += [self.service.load_many(guids) for _ in range(3)]
+            for result in results:
+                result.get()
+
+            for guid in guids:
+                cached = self.repository.load(guid)
+                self.assertEqual(round + 2, cached._version)
+                self.assertEqual(round + 1, len(cached.employees))
+
+    def test_saves_and_loads_of_many_roots(self):
+        companies = [domain.found("c%d" % i) for i in range(10)]
+        results = [self.service.save_many(companies[i::2]) for i in range(2)]
+        results += [self.service.save(company) for company in companies]
+        for result in results:
+            result.get()
+
+        guids = [company.guid for company in companies]
+        self.assertEqual(
+            [domain.describe(company) for company in companies],
+            [domain.describe(company)
+             for company in self.service.load_many(guids).get()])
+
+
+if __name__ == "__main__":
+    unittest.main()
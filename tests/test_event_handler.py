@@ -0,0 +1,128 @@
+import unittest
+import uuid
+
+import recall.event_handler
+import recall.models
+
+#: The guid of every ship the events are about
+GUID = uuid.uuid4()
+
+
+class ShipLaunched(recall.models.Event):
+    pass
+
+
+class ShipRenamed(recall.models.Event):
+    pass
+
+
+class ShipRepainted(ShipRenamed):
+    pass
+
+
+class ShipCrashed(recall.models.Event):
+    pass
+
+
+class WhenShipCrashed(recall.event_handler.DomainEventHandler):
+    def __call__(self, event):
+        self.entity.handled.append(("crashed", self))
+
+
+class WhenShipRepainted(recall.event_handler.DomainEventHandler):
+    def __call__(self, event):
+        self.entity.handled.append(("repainted", self))
+
+
+class Ship(recall.models.AggregateRoot):
+    def __init__(self):
+        super(Ship, self).__init__()
+        self.handled = []
+
+    @recall.event_handler.handles(ShipLaunched)
+    def _when_launched(self, event):
+        self.handled.append("launched")
+
+    @recall.event_handler.handles(ShipRenamed, ShipCrashed)
+    def _when_renamed(self, event):
+        self.handled.append("renamed")
+
+
+class Starship(Ship):
+    @recall.event_handler.handles(ShipLaunched)
+    def _when_launched(self, event):
+        self.handled.append("warped")
+
+    @recall.event_handler.handles(ShipRepainted)
+    def _when_repainted(self, event):
+        self.handled.append("repainted")
+
+
+class HandlesTest(unittest.TestCase):
+    def handle(self, ship, *events):
+        for event in events:
+            ship._handle_domain_event(event)
+
+        return ship.handled
+
+    def test_dispatch(self):
+        self.assertEqual(["launched", "renamed", "renamed"], self.handle(
+            Ship(), ShipLaunched(GUID), ShipRenamed(GUID),
+            ShipRepainted(GUID)))
+
+    def test_inheritance(self):
+        self.assertEqual(
+            ["warped", "renamed", "repainted", "renamed"],
+            self.handle(Starship(), ShipLaunched(GUID), ShipRenamed(GUID),
+                        ShipRepainted(GUID), ShipCrashed(GUID)))
+
+        # The base class keeps its own handlers
+        self.assertEqual(["launched", "renamed"], self.handle(
+            Ship(), ShipLaunched(GUID), ShipRepainted(GUID)))
+
+    def test_index_built_once_per_class(self):
+        self.handle(Starship(), ShipLaunched(GUID))
+        index = Starship.__dict__["_event_handler_index"]
+        self.handle(Starship(), ShipRenamed(GUID))
+        self.assertIs(index, Starship.__dict__["_event_handler_index"])
+        self.assertIsNot(index, recall.models._collect_event_handlers(Ship))
+        self.assertIs(Starship._when_launched.im_func, index[ShipLaunched])
+
+    def test_registered_handlers_take_precedence(self):
+        ship = Ship()
+        ship._register_event_handler(ShipRepainted, WhenShipRepainted)
+        ship._register_event_handler(ShipCrashed, WhenShipCrashed)
+        handled = self.handle(ship, ShipRepainted(GUID), ShipRepainted(GUID),
+                              ShipRenamed(GUID), ShipCrashed(GUID))
+        self.assertEqual(["repainted", "repainted", "renamed", "crashed"],
+                         [h if isinstance(h, str) else h[0] for h in handled])
+
+        # Each handler class is bound to the entity once
+        self.assertIs(handled[0][1], handled[1][1])
+
+
+class EventHandlersTest(unittest.TestCase):
+    def test_handler_classes(self):
+        class Wreck(recall.models.AggregateRoot):
+            event_handlers = {ShipCrashed: WhenShipCrashed}
+
+            def __init__(self):
+                super(Wreck, self).__init__()
+                self.handled = []
+
+        wreck = Wreck()
+        wreck._handle_domain_event(ShipCrashed(GUID))
+        wreck._handle_domain_event(ShipCrashed(GUID))
+        self.assertEqual(["crashed", "crashed"],
+                         [name for name, _ in wreck.handled])
+        self.assertIs(wreck.handled[0][1], wreck.handled[1][1])
+        self.assertIs(wreck, wreck.handled[0][1].entity)
+
+    def test_unhandled_events(self):
+        wreck = Ship()
+        wreck._handle_domain_event(recall.models.Event(GUID))
+        self.assertEqual([], wreck.handled)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import datetime
+import json
+import unittest
+import uuid
+
+import recall.event_marshaler
+import recall.models
+
+from tests import domain
+
+
+class Shipped(recall.models.Event):
+    def __init__(self, guid, at, on, noted):
+        self._data = {"guid": guid, "at": at, "on": on, "noted": noted}
+
+
+class DeclaredShipped(recall.models.DeclarativeEvent):
+    fields = ("guid", "at", "on", "noted")
+    field_types = {"guid": uuid.UUID, "at": datetime.datetime,
+                   "on": datetime.date}
+
+
+class TypeRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = recall.event_marshaler.TypeRegistry()
+
+    def test_alias(self):
+        self.registry.register(domain.CompanyFounded, "Founded")
+        self.assertEqual(
+            "Founded", self.registry.get_name(domain.CompanyFounded))
+        self.assertIs(domain.CompanyFounded, self.registry.resolve("Founded"))
+        self.assertIs(domain.CompanyFounded, self.registry.resolve(
+            "tests.domain.CompanyFounded"))
+
+    def test_resolve_imports_unregistered_classes(self):
+        self.assertIs(domain.EmployeeHired, self.registry.resolve(
+            "tests.domain.EmployeeHired"))
+
+    def test_resolve_unknown_alias(self):
+        self.assertRaisesRegexp(NameError, "Hired", self.registry.resolve,
+                                "Hired")
+        self.assertRaisesRegexp(NameError, "Missing", self.registry.resolve,
+                                "tests.domain.Missing")
+
+    def test_marshal_round_trip(self):
+        marshaler = recall.event_marshaler.DefaultEventMarshaler(
+            self.registry)
+        company = domain.found("Planet Express")
+        event = list(company.get_all_events())[0]
+        copy = marshaler.unmarshal(marshaler.marshal(event))
+        self.assertIsInstance(copy, domain.CompanyFounded)
+        self.assertEqual(dict(event.items()), dict(copy.items()))
+
+
+class DefaultEventMarshalerTest(unittest.TestCase):
+    def test_generated_and_generic_conversions_agree(self):
+        marshaler = recall.event_marshaler.DefaultEventMarshaler()
+        guid = uuid.uuid4()
+        for at in (datetime.datetime(3000, 1, 1, 12, 30, 15),
+                   datetime.datetime(3000, 1, 1, 12, 30, 15, 250)):
+            data = {"guid": guid, "at": at, "on": at.date(), "noted": at}
+            marshaled = []
+            for event in (Shipped(**data), DeclaredShipped(**data)):
+                encoded = json.loads(marshaler.encode(event, json.dumps))
+                copy = marshaler.unmarshal(encoded)
+                self.assertIs(event.__class__, copy.__class__)
+                self.assertEqual(data, dict(copy.items()))
+                self.assertIsInstance(copy["on"], datetime.date)
+                marshaled.append(encoded["data"])
+
+            self.assertEqual(*marshaled)
+
+            # Either conversion reads the other's data
+            copy = marshaler.unmarshal(
+                {"__type__": "tests.test_event_marshaler.Shipped",
+                 "data": marshaled[1]})
+            self.assertEqual(data, dict(copy.items()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import unittest
+
+import msgpack
+import redis
+
+import recall.event_marshaler
+import recall.event_router
+import recall.event_store
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class FakeConnection(object):
+    """
+    Stand in for a blocking AMQP connection, keeping what is published
+    """
+    def __init__(self, params):
+        self.published = []
+
+    def channel(self, **kwargs):
+        return self
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body):
+        self.published.append((routing_key, body))
+
+
+class AMQPTest(unittest.TestCase):
+    def setUp(self):
+        connection = recall.event_router.pika.BlockingConnection
+        recall.event_router.pika.BlockingConnection = FakeConnection
+        self.addCleanup(setattr, recall.event_router.pika,
+                        "BlockingConnection", connection)
+
+    def test_route(self):
+        router = recall.event_router.AMQP(exchange={"exchange": "domain"})
+        company = domain.found("Planet Express", ["Fry"])
+        router.route_many(company.get_all_events())
+        self.assertEqual(
+            ["CompanyFounded", "EmployeeHired"],
+            [key for key, _ in router.connection.published])
+        marshaled = msgpack.unpackb(router.connection.published[1][1])
+        self.assertEqual("Fry", marshaled["data"]["name"])
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_events_marshaled_once_per_save(self):
+        marshaled = []
+        get_codec = recall.event_marshaler.DefaultEventMarshaler._get_codec
+
+        def count(marshaler, cls):
+            marshaled.append(cls)
+            return get_codec(marshaler, cls)
+
+        recall.event_marshaler.DefaultEventMarshaler._get_codec = count
+        self.addCleanup(
+            setattr, recall.event_marshaler.DefaultEventMarshaler,
+            "_get_codec", get_codec)
+        store = recall.event_store.Redis(
+            connection_pool=redis.ConnectionPool(
+                connection_class=fakeredis.FakeConnection,
+                server=fakeredis.FakeServer()))
+        router = recall.event_router.AMQP()
+        repository = recall.repository.Repository(
+            domain.Company, store, recall.snapshot_store.Memory(), router,
+            1000)
+        company = domain.found("Planet Express", ["Fry", "Leela"])
+        company.employees.values()[0].promote("Captain")
+        events = list(company.get_all_events())
+        repository.save(company)
+        self.assertEqual([type(event) for event in events], marshaled)
+
+        # The store and the router sent the same marshaled events
+        records = [json.loads(record) for guid in [company.guid] + [
+            employee.guid for employee in company.employees.values()]
+            for record in store._client.lrange(str(guid), 0, -1)]
+        self.assertEqual(
+            sorted(records),
+            sorted(msgpack.unpackb(body)
+                   for _, body in router.connection.published))
+
+        # The forms kept on the events are dropped once they are routed
+        self.assertEqual([None] * len(events),
+                         [event._encoded for event in events])
+
+
+if __name__ == "__main__":
+    unittest.main()
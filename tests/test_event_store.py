@@ -0,0 +1,467 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import redis
+
+import recall.event_store
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class EventStoreTest(object):
+    """
+    The tests every durable event store passes, mixed into a
+    :class:`unittest.TestCase` which implements ``open``
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+
+        shutil.rmtree(self.directory)
+
+    def open(self, **kwargs):
+        raise NotImplementedError
+
+    def get_repository(self, store):
+        return recall.repository.Repository(
+            domain.Company, store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000)
+
+    def test_save_and_load(self):
+        for layout in (recall.event_store.ENTITY_LAYOUT,
+                       recall.event_store.AGGREGATE_LAYOUT):
+            store = self.open(layout=layout, name=layout)
+            company = domain.found("Planet Express", ["Fry", "Leela"])
+            company.employees.values()[0].promote("Captain")
+            self.get_repository(store).save(company)
+            copy = self.get_repository(store).load(company.guid)
+            self.assertEqual(domain.describe(company), domain.describe(copy))
+            self.assertIn(company.guid, list(store.get_stream_guids()))
+
+    def test_versions(self):
+        store = self.open()
+        company = domain.found("Planet Express", ["Fry"])
+        self.get_repository(store).save(company)
+        self.assertEqual({company.guid: 2}, store.get_versions([company.guid]))
+        self.assertEqual(1, len(list(
+            store.get_events_from_version(company.guid, 1))))
+
+    def test_concurrency_error(self):
+        store = self.open(check_versions=True)
+        repository = self.get_repository(store)
+        company = domain.found("Planet Express")
+        repository.save(company)
+        first = self.get_repository(store).load(company.guid)
+        second = self.get_repository(store).load(company.guid)
+        first.hire("Fry")
+        second.hire("Bender")
+        self.get_repository(store).save(first)
+        self.assertRaises(recall.event_store.ConcurrencyError,
+                          self.get_repository(store).save, second)
+        copy = self.get_repository(store).load(company.guid)
+        self.assertEqual(["Fry"], [e.name for e in copy.employees.values()])
+
+    def test_save_many_is_atomic(self):
+        store = self.open(check_versions=True)
+        repository = self.get_repository(store)
+        stale = domain.found("Planet Express")
+        repository.save(stale)
+        self.get_repository(store).execute(
+            stale.guid, lambda company: company.hire("Fry"))
+        stale.hire("Bender")
+        fresh = domain.found("Mom's Friendly Robots")
+        self.assertRaises(recall.event_store.ConcurrencyError,
+                          self.get_repository(store).save_many,
+                          [fresh, stale])
+        self.assertEqual({fresh.guid: 0, stale.guid: 2},
+                         store.get_versions([fresh.guid, stale.guid]))
+
+
+class SegmentsTest(EventStoreTest, unittest.TestCase):
+    def open(self, name="store", **kwargs):
+        store = recall.event_store.Segments(
+            os.path.join(self.directory, name), **kwargs)
+        self.stores.append(store)
+        return store
+
+    def reopen(self, store, **kwargs):
+        store.close()
+        return self.open(os.path.basename(store.path), **kwargs)
+
+    def get_segments(self, store, extension=".log"):
+        return sorted(name for name in os.listdir(store.path)
+                      if name.endswith(extension))
+
+    def save_companies(self, store, count):
+        companies = [domain.found("c%d" % i, ["Fry"]) for i in range(count)]
+        for company in companies:
+            self.get_repository(store).save(company)
+
+        return companies
+
+    def assert_loads(self, store, companies):
+        repository = self.get_repository(store)
+        for company in companies:
+            self.assertEqual(domain.describe(company),
+                             domain.describe(repository.load(company.guid)))
+
+    def test_torn_tail(self):
+        store = self.open()
+        companies = self.save_companies(store, 3)
+        path = os.path.join(store.path, self.get_segments(store)[-1])
+        size = os.path.getsize(path)
+        # A save cut short: a whole record not flagged as the last of its
+        # save, then half a record
+        with open(path, "rb") as segment:
+            data = segment.read()
+
+        header = recall.event_store.Segments.HEADER
+        with open(path, "ab") as segment:
+            segment.write(data[:header.size + 4] + "\x00" * 8)
+
+        store = self.reopen(store)
+        self.assertEqual(size, os.path.getsize(path))
+        self.assert_loads(store, companies)
+        companies += self.save_companies(store, 1)
+        self.assert_loads(self.reopen(store), companies)
+
+    def test_rollover(self):
+        store = self.open(segment_size=1000)
+        companies = self.save_companies(store, 20)
+        segments = self.get_segments(store)
+        self.assertTrue(len(segments) > 2)
+        self.assertEqual(segments[:-1], [
+            name[:-4] + ".log" for name in self.get_segments(store, ".idx")])
+        store = self.reopen(store, segment_size=1000)
+        self.assert_loads(store, companies)
+
+        # A missing index file is rebuilt from its segment
+        index = self.get_segments(store, ".idx")[0]
+        os.remove(os.path.join(store.path, index))
+        store = self.reopen(store, segment_size=1000)
+        self.assertEqual(len(segments) - 1,
+                         len(self.get_segments(store, ".idx")))
+        self.assert_loads(store, companies)
+
+    def test_lock_and_read_only(self):
+        store = self.open()
+        companies = self.save_companies(store, 2)
+        self.assertRaises(IOError, recall.event_store.Segments, store.path)
+        reader = recall.event_store.Segments(store.path, read_only=True)
+        self.stores.append(reader)
+        self.assert_loads(reader, companies)
+        self.assertRaises(IOError, self.get_repository(reader).save,
+                          domain.found("Mom's Friendly Robots"))
+
+    def test_failed_write(self):
+        store = self.open()
+        companies = self.save_companies(store, 1)
+        write = os.write
+
+        def fail(fd, data):
+            write(fd, data[:len(data) // 2])
+            raise OSError("disk full")
+
+        recall.event_store.os.write = fail
+        try:
+            self.assertRaises(OSError, self.save_companies, store, 1)
+        finally:
+            recall.event_store.os.write = write
+
+        companies += self.save_companies(store, 1)
+        self.assert_loads(store, companies)
+        self.assert_loads(self.reopen(store), companies)
+
+    def test_failed_rollover(self):
+        store = self.open(segment_size=100)
+        companies = self.save_companies(store, 1)
+
+        def fail(segment, entries):
+            raise OSError("disk full")
+
+        store._write_index = fail
+        self.assertRaises(OSError, self.save_companies, store, 1)
+        del store._write_index
+        companies += self.save_companies(store, 2)
+        self.assertEqual(3, len(self.get_segments(store)))
+        self.assert_loads(store, companies)
+        self.assert_loads(self.reopen(store, segment_size=100), companies)
+
+
+class SqliteTest(EventStoreTest, unittest.TestCase):
+    def open(self, name="store", **kwargs):
+        store = recall.event_store.Sqlite(
+            os.path.join(self.directory, name + ".db"), **kwargs)
+        self.stores.append(store)
+        return store
+
+    def test_close(self):
+        store = self.open()
+        company = domain.found("Planet Express")
+        self.get_repository(store).save(company)
+        connections = [store._get_connection()]
+        thread = threading.Thread(
+            target=lambda: connections.append(store._get_connection()))
+        thread.start()
+        thread.join()
+        store.close()
+        for connection in connections:
+            self.assertRaises(sqlite3.ProgrammingError, connection.execute,
+                              "SELECT 1")
+
+        # The store connects again when it's used again
+        self.assertEqual({company.guid: 1},
+                         store.get_versions([company.guid]))
+
+    def test_events_from_versions(self):
+        store = self.open()
+        store.MAX_VARIABLES = 3
+        companies = [domain.found("c%d" % i, ["Fry"]) for i in range(5)]
+        self.get_repository(store).save_many(companies)
+        versions = dict((company.guid, i % 3)
+                        for i, company in enumerate(companies))
+        events = store.get_events_from_versions(versions)
+        for company in companies:
+            self.assertEqual(
+                [type(event) for event in store.get_events_from_version(
+                    company.guid, versions[company.guid])],
+                [type(event) for event in events[company.guid]])
+
+        self.assertEqual([0, 1, 1, 2, 2], sorted(
+            len(events[company.guid]) for company in companies))
+
+    def test_events_after(self):
+        store = self.open(chunk_size=2)
+        companies = [domain.found("c%d" % i, ["Fry"]) for i in range(3)]
+        for company in companies:
+            self.get_repository(store).save(company)
+
+        records = list(store.get_events_after())
+        self.assertEqual(range(1, 7), [sequence for sequence, _, _ in records])
+        self.assertEqual(records[4:], list(store.get_events_after(4)))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class RedisTest(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+
+    def open(self, **kwargs):
+        return recall.event_store.Redis(
+            connection_pool=redis.ConnectionPool(
+                connection_class=fakeredis.FakeConnection,
+                server=self.server),
+            **kwargs)
+
+    def get_repository(self, store):
+        return recall.repository.Repository(
+            domain.Company, store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000)
+
+    def count_pipelines(self, store, delay=0):
+        """
+        Keep the transaction flag and number of commands of every pipeline
+        the store sends, and hold the first one for a while
+        """
+        sent = []
+        pipeline = store._client.pipeline
+
+        def counting(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def send(*args, **kwargs):
+                sent.append((pipe.transaction, len(pipe.command_stack)))
+                if len(sent) == 1:
+                    time.sleep(delay)
+
+                return execute(*args, **kwargs)
+
+            pipe.execute = send
+            return pipe
+
+        store._client.pipeline = counting
+        return sent
+
+    def save_many(self, store):
+        companies = [domain.found("c%d" % i, ["Fry", "Leela"])
+                     for i in range(3)]
+        for company in companies:
+            company.employees.values()[0].promote("Captain")
+
+        self.get_repository(store).save_many(companies)
+        return companies
+
+    def test_one_pipeline_per_save(self):
+        for check_versions, commands in ((False, 6), (True, 1)):
+            store = self.open(check_versions=check_versions)
+            store._client.script_load(store.APPEND_SCRIPT)
+            sent = self.count_pipelines(store)
+            companies = self.save_many(store)
+            self.assertEqual([(False, commands)], sent)
+            copies = self.get_repository(store).load_many(
+                [company.guid for company in companies])
+            self.assertEqual(
+                [domain.describe(company) for company in companies],
+                [domain.describe(company) for company in copies])
+
+    def test_atomic(self):
+        store = self.open(atomic=True)
+        sent = self.count_pipelines(store)
+        companies = self.save_many(store)
+        self.assertEqual([(True, 6)], sent)
+        self.assertEqual(
+            dict((company.guid, 3) for company in companies),
+            store.get_versions([company.guid for company in companies]))
+
+    def test_concurrency_error(self):
+        store = self.open(check_versions=True)
+        stale = domain.found("Planet Express")
+        self.get_repository(store).save(stale)
+        self.get_repository(store).execute(
+            stale.guid, lambda company: company.hire("Fry"))
+        stale.hire("Bender")
+        fresh = domain.found("Mom's Friendly Robots", ["Walt"])
+        self.assertRaises(recall.event_store.ConcurrencyError,
+                          self.get_repository(store).save_many,
+                          [fresh, stale])
+        self.assertEqual([stale.guid], list(store.get_stream_guids()))
+
+    def test_script_loaded_when_missing(self):
+        store = self.open(check_versions=True)
+        sent = self.count_pipelines(store)
+        companies = self.save_many(store)
+
+        # Redis doesn't have the append script until it's retried
+        self.assertEqual([(False, 1), (False, 1)], sent)
+        self.save_many(store)
+        self.assertEqual(3, len(sent))
+        self.assertEqual(
+            dict((company.guid, 3) for company in companies),
+            store.get_versions([company.guid for company in companies]))
+
+    def test_group_commit(self):
+        store = self.open(check_versions=True, group_commit=True)
+        stale = domain.found("Planet Express")
+        self.get_repository(store).save(stale)
+        self.get_repository(store).execute(
+            stale.guid, lambda company: company.hire("Fry"))
+        stale.hire("Bender")
+        sent = self.count_pipelines(store, 0.2)
+        companies = [domain.found("c%d" % i, ["Leela"]) for i in range(5)]
+        errors = {}
+
+        def save(root):
+            try:
+                self.get_repository(store).save(root)
+            except recall.event_store.ConcurrencyError as e:
+                errors[root.guid] = e
+
+        threads = [threading.Thread(target=save, args=(root,))
+                   for root in companies + [stale]]
+        threads[0].start()
+        while not sent:
+            time.sleep(0.001)
+
+        # The other saves queue while the first is in flight
+        for thread in threads[1:]:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([(False, 1), (False, 5)], sent)
+        self.assertEqual([stale.guid], list(errors))
+        self.assertEqual(
+            dict((company.guid, 2) for company in companies),
+            store.get_versions([company.guid for company in companies]))
+        self.assertEqual({stale.guid: 2}, store.get_versions([stale.guid]))
+
+    def count_pages(self, store):
+        """
+        Keep the first index of every page the store reads on its own
+        """
+        pages = []
+        lrange = store._client.lrange
+
+        def counting(key, start, end):
+            pages.append(start)
+            return lrange(key, start, end)
+
+        store._client.lrange = counting
+        return pages
+
+    def test_paged_reads(self):
+        store = self.open(chunk_size=3)
+        company = domain.found("Planet Express", [
+            "Employee %d" % i for i in range(9)])
+        self.get_repository(store).save(company)
+        pages = self.count_pages(store)
+        events = store.get_events_from_version(company.guid, 0)
+        self.assertEqual([], pages)
+        self.assertEqual(
+            ["Planet Express"] + ["Employee %d" % i for i in range(9)],
+            [event["name"] for event in events])
+        self.assertEqual([0, 3, 6, 9], pages)
+
+        # A stream ending on a page boundary is read up to an empty page
+        del pages[:]
+        self.assertEqual(9, len(list(
+            store.get_events_from_version(company.guid, 1))))
+        self.assertEqual([1, 4, 7, 10], pages)
+
+    def test_batched_paged_reads(self):
+        store = self.open(chunk_size=3)
+        long = domain.found("Planet Express", [
+            "Employee %d" % i for i in range(9)])
+        short = domain.found("Mom's Friendly Robots", ["Walt"])
+        self.get_repository(store).save_many([long, short])
+        pages = self.count_pages(store)
+        events = store.get_events_from_versions({long.guid: 1, short.guid: 0})
+
+        # The first pages were read together, and short streams are done
+        self.assertEqual([], pages)
+        self.assertIsInstance(events[short.guid], list)
+        self.assertEqual(["CompanyFounded", "EmployeeHired"],
+                         [type(e).__name__ for e in events[short.guid]])
+        self.assertFalse(isinstance(events[long.guid], list))
+        self.assertEqual(9, len(list(events[long.guid])))
+        self.assertEqual([4, 7, 10], pages)
+
+        copy = self.get_repository(store).load(long.guid)
+        self.assertEqual(domain.describe(long), domain.describe(copy))
+
+    def test_aggregate_layout(self):
+        store = self.open(layout=recall.event_store.AGGREGATE_LAYOUT)
+        company = domain.found("Planet Express", ["Fry", "Leela"])
+        fry = company.employees.values()[0]
+        fry.promote("Captain")
+        self.get_repository(store).save(company)
+        self.assertEqual([company.guid], list(store.get_stream_guids()))
+        self.assertEqual(
+            [company.guid] * 3 + [fry.guid],
+            [guid for guid, _ in store.get_aggregate_events_from_versions(
+                {company.guid: 0})[company.guid]])
+
+        copy = self.get_repository(store).load(company.guid)
+        self.assertEqual(domain.describe(company), domain.describe(copy))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+
+import recall.event_store
+import recall.identity_map
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+
+class BoundedTest(object):
+    """
+    The tests every bounded identity map passes, mixed into a
+    :class:`unittest.TestCase` which sets ``cls``
+    """
+    cls = None
+
+    def setUp(self):
+        self.roots = [domain.found("c%d" % i) for i in range(4)]
+
+    def test_max_entries(self):
+        identity_map = self.cls(max_entries=2)
+        for root in self.roots:
+            identity_map[root.guid] = root
+
+        self.assertEqual(2, len(identity_map))
+        self.assertEqual(2, identity_map.evictions)
+        self.assertNotIn(self.roots[0].guid, identity_map)
+        self.assertIs(self.roots[3], identity_map.get(self.roots[3].guid))
+
+    def test_max_bytes(self):
+        identity_map = self.cls(max_bytes=25, sizer=lambda root: 10)
+        for root in self.roots:
+            identity_map[root.guid] = root
+
+        self.assertEqual(2, len(identity_map))
+        self.assertEqual(20, identity_map.stats()["bytes"])
+        del identity_map[self.roots[3].guid]
+        self.assertEqual(10, identity_map.stats()["bytes"])
+
+    def test_replace(self):
+        identity_map = self.cls(max_entries=2)
+        identity_map[self.roots[0].guid] = self.roots[0]
+        identity_map[self.roots[0].guid] = self.roots[0]
+        self.assertEqual(1, len(identity_map))
+        self.assertEqual(0, identity_map.evictions)
+
+    def test_stats(self):
+        identity_map = self.cls(max_entries=2)
+        identity_map[self.roots[0].guid] = self.roots[0]
+        identity_map.get(self.roots[0].guid)
+        identity_map.get(self.roots[1].guid)
+        self.assertEqual(
+            {"entries": 1, "hits": 1, "misses": 1, "evictions": 0,
+             "bytes": 0}, identity_map.stats())
+
+
+class LRUTest(BoundedTest, unittest.TestCase):
+    cls = recall.identity_map.LRU
+
+    def test_evicts_least_recently_used(self):
+        first, second, third = self.roots[:3]
+        identity_map = self.cls(max_entries=2)
+        identity_map[first.guid] = first
+        identity_map[second.guid] = second
+        identity_map.get(first.guid)
+        identity_map[third.guid] = third
+        self.assertIn(first.guid, identity_map)
+        self.assertNotIn(second.guid, identity_map)
+
+
+class LFUTest(BoundedTest, unittest.TestCase):
+    cls = recall.identity_map.LFU
+
+    def test_evicts_least_frequently_used(self):
+        first, second, third, fourth = self.roots
+        identity_map = self.cls(max_entries=3)
+        identity_map[first.guid] = first
+        identity_map[second.guid] = second
+        identity_map[third.guid] = third
+        identity_map.get(first.guid)
+        identity_map.get(first.guid)
+        identity_map.get(third.guid)
+        identity_map[fourth.guid] = fourth
+        self.assertNotIn(second.guid, identity_map)
+
+        # The newcomer is the least frequently used of all
+        identity_map[second.guid] = second
+        self.assertNotIn(fourth.guid, identity_map)
+        self.assertIn(first.guid, identity_map)
+        self.assertIn(third.guid, identity_map)
+
+
+class RepositoryTest(unittest.TestCase):
+    def test_reload_after_eviction(self):
+        repository = recall.repository.Repository(
+            domain.Company, recall.event_store.Memory(),
+            recall.snapshot_store.Memory(), domain.Recorder(), 1000,
+            identity_map=recall.identity_map.LRU(max_entries=1))
+        first = domain.found("Planet Express", ["Fry"])
+        second = domain.found("Mom's Friendly Robots")
+        repository.save(first)
+        repository.save(second)
+        loaded = repository.load(first.guid)
+        self.assertIs(loaded, repository.load(first.guid))
+        repository.load(second.guid)
+        self.assertIsNot(loaded, repository.load(first.guid))
+        self.assertEqual(domain.describe(first),
+                         domain.describe(repository.load(first.guid)))
+        self.assertEqual(2, repository.identity_map.stats()["evictions"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+
+import recall.event_store
+import recall.instrumentation
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+
+class OperationTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = recall.event_store.Memory()
+        self.snapshot_store = recall.snapshot_store.Memory()
+        self.operations = []
+        self.companies = []
+        for name in ("Planet Express", "Mom's Friendly Robots"):
+            company = domain.found(name, ["Fry", "Leela"])
+            company.employees.values()[0].promote("Captain")
+            self.companies.append(company)
+
+        self.repository = self.get_repository()
+        self.repository.save_many(self.companies)
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, self.snapshot_store,
+            domain.Recorder(), 1000,
+            instrumentation=recall.instrumentation.Callback(
+                self.operations.append))
+
+    def load(self, repository):
+        del self.operations[:]
+        repository.load_many([company.guid for company in self.companies])
+        self.assertEqual(1, len(self.operations))
+        operation = self.operations[0]
+        self.assertEqual("load", operation.kind)
+        self.assertEqual(2, operation.roots)
+        self.assertTrue(operation.elapsed >= 0)
+        return operation
+
+    def test_save(self):
+        operation = self.operations[0]
+        self.assertEqual("save", operation.kind)
+        self.assertEqual(2, operation.roots)
+        self.assertEqual(8, operation.events)
+        self.assertEqual(["event_store.save_many", "event_router.route_many"],
+                         [name for name, _ in operation.calls])
+        self.assertEqual({}, dict(operation.sources))
+
+    def test_load_from_events(self):
+        operation = self.load(self.get_repository())
+        self.assertEqual({recall.instrumentation.IDENTITY_MAP: 0,
+                          recall.instrumentation.SNAPSHOT: 0,
+                          recall.instrumentation.EVENTS: 2},
+                         dict(operation.sources))
+        self.assertEqual(8, operation.events)
+        self.assertEqual(
+            ["snapshot_store.load_many",
+             "event_store.get_events_from_versions",
+             "event_store.get_events_from_versions",
+             "replay"],
+            [name for name, _ in operation.calls])
+
+    def test_load_from_snapshots(self):
+        self.snapshot_store.save(self.companies[0])
+        self.companies[0].hire("Bender")
+        self.repository.save(self.companies[0])
+        operation = self.load(self.get_repository())
+        self.assertEqual({recall.instrumentation.IDENTITY_MAP: 0,
+                          recall.instrumentation.SNAPSHOT: 1,
+                          recall.instrumentation.EVENTS: 1},
+                         dict(operation.sources))
+        self.assertEqual(5, operation.events)
+
+    def test_load_from_identity_map(self):
+        repository = self.get_repository()
+        self.load(repository)
+        operation = self.load(repository)
+        self.assertEqual({recall.instrumentation.IDENTITY_MAP: 2},
+                         dict(operation.sources))
+        self.assertEqual(0, operation.events)
+        self.assertEqual(["event_store.get_versions", "replay"],
+                         [name for name, _ in operation.calls])
+
+    def test_stats(self):
+        stats = recall.instrumentation.Stats()
+        for operation in self.operations:
+            stats.record(operation)
+
+        repository = self.get_repository()
+        for _ in range(2):
+            self.load(repository)
+            stats.record(self.operations[0])
+
+        exported = stats.export()
+        self.assertEqual({recall.instrumentation.IDENTITY_MAP: 2,
+                          recall.instrumentation.SNAPSHOT: 0,
+                          recall.instrumentation.EVENTS: 2},
+                         exported["sources"])
+        histograms = exported["histograms"]
+        self.assertEqual(2, histograms["load.elapsed"]["count"])
+        self.assertEqual(8, histograms["load.events"]["sum"])
+        self.assertEqual(1, histograms["save.event_store.save_many"]["count"])
+        self.assertEqual(
+            1, histograms["load.event_store.get_versions"]["count"])
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        histogram = recall.instrumentation.Histogram([1, 2, 4])
+        for value in (0.5, 1, 3, 3, 10):
+            histogram.add(value)
+
+        self.assertEqual([2, 0, 2, 1], histogram.counts)
+        self.assertEqual((0.5, 10), (histogram.min, histogram.max))
+        self.assertEqual(1, histogram.percentile(20))
+        self.assertEqual(4, histogram.percentile(80))
+        self.assertEqual(10, histogram.percentile(100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import pickle
+import unittest
+import uuid
+
+import recall.event_store
+import recall.models
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+
+class EventTest(unittest.TestCase):
+    def test_declarative_event(self):
+        class Hired(recall.models.DeclarativeEvent):
+            fields = ("guid", "name")
+
+        class Rehired(Hired):
+            fields = ("reason",)
+
+        event = Rehired(1, name="Fry", reason="luck")
+        self.assertEqual({"guid": 1, "name": "Fry", "reason": "luck"},
+                         dict(event.items()))
+        self.assertFalse(hasattr(Rehired, "fields"))
+
+    def test_plain_event_keeps_its_fields(self):
+        class Reported(recall.models.Event):
+            fields = ["total"]
+            field_types = {"total": int}
+
+            def __init__(self, total):
+                self._data = {"total": total}
+
+        self.assertEqual(["total"], Reported.fields)
+        self.assertEqual({"total": int}, Reported.field_types)
+        self.assertEqual(3, Reported(3)["total"])
+
+
+class AggregateRootTest(unittest.TestCase):
+    def test_get_entity(self):
+        company = domain.found("Planet Express", ["Fry"])
+        fry = company.employees.values()[0]
+        self.assertIs(company, company._get_entity(company.guid))
+        self.assertIs(fry, company._get_entity(fry.guid))
+        self.assertIsNone(company._get_entity(uuid.uuid4()))
+
+    def test_get_entity_attached_behind_the_index(self):
+        company = domain.found("Planet Express")
+        company._get_entity(uuid.uuid4())
+        guid = uuid.uuid4()
+        bender = domain.Employee(guid, "Bender")
+        company.employees.data[guid] = bender
+        self.assertIs(bender, company._get_entity(guid))
+
+    def test_index_kept_without_walks(self):
+        company = domain.found("Planet Express", ["Fry", "Leela"])
+        company._track = self.fail
+        fry, leela = sorted(company.employees.values(), key=lambda e: e.name)
+        bender = company.hire("Bender")
+        self.assertIs(bender, company._get_entity(bender.guid))
+
+        del company.employees[fry.guid]
+        company.employees.pop(leela.guid)
+        self.assertEqual([bender], company._get_indexed_entities())
+
+        # A collection built apart hands its index over as it's attached
+        employees = recall.models.EntityList()
+        employees.add(fry)
+        employees.add(leela)
+        company.employees = employees
+        self.assertEqual(
+            sorted([fry.guid, leela.guid]),
+            sorted(e.guid for e in company._get_indexed_entities()))
+
+        guid = uuid.uuid4()
+        old = fry.guid
+        fry.guid = guid
+        self.assertIs(fry, company._get_entity(guid))
+        self.assertNotIn(old, company._index)
+
+        company.employees.clear()
+        self.assertEqual([], company._get_indexed_entities())
+        self.assertIsNone(fry._parent)
+
+    def test_index_of_an_old_snapshot(self):
+        company = domain.found("Planet Express", ["Fry"])
+        fry = company.employees.values()[0]
+        del company.__dict__["_index"]
+        copy = pickle.loads(pickle.dumps(company))
+        self.assertIs(copy.employees.values()[0],
+                      copy._get_entity(fry.guid))
+        copy._track = self.fail
+        self.assertEqual([fry.guid],
+                         [e.guid for e in copy._get_indexed_entities()])
+
+    def test_get_entity_remembers_misses(self):
+        company = domain.found("Planet Express", ["Fry"])
+        walks = []
+        track = company._track
+
+        def walk():
+            walks.append(None)
+            track()
+
+        company._track = walk
+        guid = uuid.uuid4()
+        self.assertIsNone(company._get_entity(guid))
+        self.assertIsNone(company._get_entity(guid))
+        self.assertEqual(1, len(walks))
+
+        # Attaching an entity may make it findable
+        bender = company.hire("Bender")
+        self.assertIsNone(company._get_entity(guid))
+        self.assertEqual(2, len(walks))
+        bender.guid = guid
+        self.assertIs(bender, company._get_entity(guid))
+        self.assertEqual(2, len(walks))
+
+        # Snapshots don't keep the misses
+        company._get_entity(uuid.uuid4())
+        del company._track
+        self.assertNotIn(
+            "_missing", pickle.loads(pickle.dumps(company)).__dict__)
+
+    def test_staged_entities_reattached(self):
+        company = domain.found("Planet Express")
+        fry = company.hire("Fry")
+        fry.promote("Delivery boy")
+        employees = company.employees
+        company.employees = recall.models.EntityList()
+        company.employees = employees
+        self.assertEqual([company, fry], company._get_staged_entities())
+
+        del company.employees[fry.guid]
+        company.employees.add(fry)
+        self.assertEqual([company, fry], company._get_staged_entities())
+
+    def test_reattached_events_are_saved_once(self):
+        repository = recall.repository.Repository(
+            domain.Company, recall.event_store.Memory(),
+            recall.snapshot_store.Memory(), domain.Recorder(), 1000)
+        company = domain.found("Planet Express")
+        repository.save(company)
+        fry = company.hire("Fry")
+        fry.promote("Delivery boy")
+        del company.employees[fry.guid]
+        company.employees.add(fry)
+        repository.save(company)
+        self.assertEqual(1, fry._version)
+        self.assertEqual(domain.describe(company), domain.describe(
+            repository._load_detached([company.guid])[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
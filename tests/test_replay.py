@@ -0,0 +1,92 @@
+import os
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+import recall.event_store
+import recall.replay
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src")
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_on_its_own(self):
+        env = dict(os.environ, PYTHONPATH=SRC)
+        self.assertEqual(0, subprocess.call(
+            [sys.executable, "-c", "import recall.replay"], env=env))
+
+    def test_main(self):
+        config = os.path.join(self.directory, "config.yml")
+        with open(config, "w") as f:
+            yaml.safe_dump({
+                "tests.domain.Company": {
+                    "event_store": "recall.event_store.Memory"},
+                "recall.event_store.Memory": {"layout": "aggregate"}}, f)
+
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            recall.replay.main(["-p", "0", config, "tests.domain.Company"])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual("Replayed 0 events from 0 streams\n", output)
+
+    def test_replays_aggregates_in_order(self):
+        store = recall.event_store.Memory(recall.event_store.AGGREGATE_LAYOUT)
+        repository = recall.repository.Repository(
+            domain.Company, store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 10)
+        companies = [domain.found("c%d" % i, ["a", "b"]) for i in range(5)]
+        for company in companies:
+            for employee in company.employees.values():
+                employee.promote("boss")
+
+        repository.save_many(companies)
+        router = domain.Recorder()
+        checkpoint = os.path.join(self.directory, "checkpoint")
+        totals = recall.replay.Replayer(
+            store, router, batch_size=2, checkpoint=checkpoint).run()
+        self.assertEqual(5, totals["streams"])
+        self.assertEqual(25, totals["events"])
+        self.assertEqual(25, len(router.events))
+        for company in companies:
+            events = [e for e in router.events
+                      if e["guid"] == company.guid
+                      or e["guid"] in company.employees]
+            self.assertEqual(
+                [domain.CompanyFounded] + [domain.EmployeeHired] * 2
+                + [domain.EmployeePromoted] * 2,
+                [e.__class__ for e in events])
+
+        # A second run resumes after the checkpoint, with nothing left
+        router = domain.Recorder()
+        totals = recall.replay.Replayer(
+            store, router, checkpoint=checkpoint).run()
+        self.assertEqual(25, totals["events"])
+        self.assertEqual([], router.events)
+
+    def test_requires_the_aggregate_layout(self):
+        replayer = recall.replay.Replayer(
+            recall.event_store.Memory(), domain.Recorder())
+        self.assertRaises(ValueError, replayer.run)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,365 @@
+import unittest
+
+import recall.event_store
+import recall.identity_map
+import recall.repository
+import recall.snapshot_store
+
+from tests import domain
+
+
+class Evicting(recall.identity_map.Unbounded):
+    """
+    Have another thread evict a root as soon as it is looked up
+    """
+    def __contains__(self, guid):
+        found = super(Evicting, self).__contains__(guid)
+        self._roots.pop(guid, None)
+        return found
+
+
+class CountingEventStore(recall.event_store.Memory):
+    """
+    Count the reads made of the event store, by method name
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingEventStore, self).__init__(*args, **kwargs)
+        self.calls = []
+
+    def get_events_from_version(self, guid, version):
+        self.calls.append("get_events_from_version")
+        return super(CountingEventStore, self).get_events_from_version(
+            guid, version)
+
+    def get_events_from_versions(self, versions):
+        self.calls.append("get_events_from_versions")
+        return super(CountingEventStore, self).get_events_from_versions(
+            versions)
+
+    def get_aggregate_events_from_version(self, guid, version):
+        self.calls.append("get_aggregate_events_from_version")
+        return super(
+            CountingEventStore, self).get_aggregate_events_from_version(
+                guid, version)
+
+    def get_aggregate_events_from_versions(self, versions):
+        self.calls.append("get_aggregate_events_from_versions")
+        return super(
+            CountingEventStore, self).get_aggregate_events_from_versions(
+                versions)
+
+    def get_versions(self, guids):
+        self.calls.append("get_versions")
+        return super(CountingEventStore, self).get_versions(guids)
+
+
+class CountingSnapshotStore(recall.snapshot_store.Memory):
+    """
+    Count the reads made of the snapshot store, by method name
+    """
+    def __init__(self):
+        super(CountingSnapshotStore, self).__init__()
+        self.calls = []
+
+    def load(self, guid):
+        self.calls.append("load")
+        return super(CountingSnapshotStore, self).load(guid)
+
+    def load_many(self, guids):
+        self.calls.append("load_many")
+        return super(CountingSnapshotStore, self).load_many(guids)
+
+
+class RepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = recall.event_store.Memory(check_versions=True)
+
+    def get_repository(self, **kwargs):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000, **kwargs)
+
+
+class ExecuteTest(RepositoryTest):
+    def setUp(self):
+        super(ExecuteTest, self).setUp()
+        self.company = domain.found("Planet Express")
+        self.get_repository().save(self.company)
+
+    def hire_concurrently(self, name):
+        """
+        Hire an employee through another repository
+        """
+        other = self.get_repository()
+        company = other.load(self.company.guid)
+        company.hire(name)
+        other.save(company)
+
+    def test_retries_on_concurrent_saves(self):
+        calls = []
+
+        def hire(company):
+            calls.append(company)
+            if len(calls) == 1:
+                self.hire_concurrently("Bender")
+
+            company.hire("Fry")
+
+        repository = self.get_repository()
+        repository.load(self.company.guid)
+        company = repository.execute(self.company.guid, hire)
+        self.assertEqual(2, len(calls))
+        self.assertIsNot(calls[0], calls[1])
+        self.assertEqual(["Bender", "Fry"], sorted(
+            employee.name for employee in company.employees.values()))
+        self.assertEqual(3, company._version)
+
+    def test_gives_up(self):
+        def hire(company):
+            self.hire_concurrently("Bender")
+            company.hire("Fry")
+
+        repository = self.get_repository()
+        self.assertRaises(recall.event_store.ConcurrencyError,
+                          repository.execute, self.company.guid, hire, 2)
+        self.assertNotIn(self.company.guid, repository.identity_map)
+        self.assertEqual({self.company.guid: 3},
+                         self.event_store.get_versions([self.company.guid]))
+
+    def test_root_evicted_meanwhile(self):
+        def fail(company):
+            company.hire("Fry")
+            raise ValueError("The command failed")
+
+        repository = self.get_repository(identity_map=Evicting())
+        self.assertRaises(ValueError, repository.execute, self.company.guid,
+                          fail)
+
+
+class LoadManyTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = CountingEventStore()
+        self.snapshot_store = CountingSnapshotStore()
+        self.companies = []
+        for i in range(20):
+            company = domain.found("Company %d" % i, ["Fry", "Leela"])
+            for employee in company.employees.values():
+                employee.promote("Captain")
+
+            self.companies.append(company)
+
+        self.get_repository().save_many(self.companies)
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, self.snapshot_store,
+            domain.Recorder(), 1000)
+
+    def test_round_trips(self):
+        guids = [company.guid for company in reversed(self.companies)]
+        companies = self.get_repository().load_many(guids)
+        self.assertEqual(guids, [company.guid for company in companies])
+        self.assertEqual(
+            [domain.describe(company) for company in self.companies[::-1]],
+            [domain.describe(company) for company in companies])
+        self.assertEqual(["load_many"], self.snapshot_store.calls)
+
+        # One read for the roots and one for their employees
+        self.assertEqual(["get_events_from_versions"] * 2,
+                         self.event_store.calls)
+
+    def test_round_trips_from_snapshots(self):
+        repository = self.get_repository()
+        self.snapshot_store.save_many(self.companies[:10])
+        for company in self.companies[5:15]:
+            company.hire("Bender")
+
+        repository.save_many(self.companies[5:15])
+        guids = [company.guid for company in self.companies]
+        companies = repository.load_many(guids)
+        self.assertEqual(
+            [domain.describe(company) for company in self.companies],
+            [domain.describe(company) for company in companies])
+        self.assertEqual(["load_many"], self.snapshot_store.calls)
+
+        # Children from snapshots and from the roots' events are read together
+        self.assertEqual(["get_events_from_versions"] * 2,
+                         self.event_store.calls)
+
+    def test_duplicate_guids(self):
+        guid = self.companies[0].guid
+        first, second = self.get_repository().load_many([guid, guid])
+        self.assertIs(first, second)
+        self.assertEqual(domain.describe(self.companies[0]),
+                         domain.describe(first))
+
+
+class ChildCatchUpTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = CountingEventStore()
+        self.snapshot_store = recall.snapshot_store.Memory()
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, self.snapshot_store,
+            domain.Recorder(), 1000)
+
+    def found(self, employees):
+        company = domain.found("Planet Express", [
+            "Employee %d" % i for i in range(employees)])
+        for employee in company.employees.values():
+            employee.promote("Delivery boy")
+            employee.promote("Captain")
+
+        self.get_repository().save(company)
+        return company
+
+    def test_one_read_for_all_children(self):
+        for employees in (1, 50):
+            company = self.found(employees)
+            del self.event_store.calls[:]
+            loaded = self.get_repository().load(company.guid)
+            self.assertEqual(domain.describe(company),
+                             domain.describe(loaded))
+            self.assertEqual(["get_events_from_versions"] * 2,
+                             self.event_store.calls)
+
+    def test_children_of_a_snapshot(self):
+        company = self.found(10)
+        self.snapshot_store.save(company)
+        for employee in company.employees.values():
+            employee.promote("Admiral")
+
+        company.hire("Bender").promote("Chef")
+        self.get_repository().save(company)
+        del self.event_store.calls[:]
+        loaded = self.get_repository().load(company.guid)
+        self.assertEqual(domain.describe(company), domain.describe(loaded))
+        self.assertEqual(["get_events_from_versions"] * 2,
+                         self.event_store.calls)
+
+    def test_no_children(self):
+        company = self.found(0)
+        del self.event_store.calls[:]
+        loaded = self.get_repository().load(company.guid)
+        self.assertEqual(domain.describe(company), domain.describe(loaded))
+        self.assertEqual(["get_events_from_versions"],
+                         self.event_store.calls)
+
+
+class ProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = CountingEventStore()
+        self.repository = self.get_repository()
+        company = domain.found("Planet Express", ["Fry", "Leela"])
+        self.repository.save(company)
+        self.company = self.repository.load(company.guid)
+        del self.event_store.calls[:]
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000)
+
+    def test_nothing_to_catch_up(self):
+        self.assertIs(self.company, self.repository.load(self.company.guid))
+        self.assertEqual(["get_versions"], self.event_store.calls)
+
+    def test_catch_up(self):
+        def promote(company):
+            company.employees.values()[0].promote("Captain")
+            company.hire("Bender").promote("Chef")
+
+        other = self.get_repository().execute(self.company.guid, promote)
+        del self.event_store.calls[:]
+        self.assertIs(self.company, self.repository.load(self.company.guid))
+        self.assertEqual(domain.describe(other),
+                         domain.describe(self.company))
+
+        # Bender's stream is read along with those which moved on
+        self.assertEqual(["get_versions"] + ["get_events_from_versions"] * 2,
+                         self.event_store.calls)
+
+    def test_only_read_streams_which_moved_on(self):
+        reads = []
+        get_events = self.event_store.get_events_from_versions
+
+        def get_events_from_versions(versions):
+            reads.append(sorted(versions))
+            return get_events(versions)
+
+        self.event_store.get_events_from_versions = get_events_from_versions
+        guid = self.company.employees.values()[1].guid
+        self.get_repository().execute(
+            self.company.guid,
+            lambda company: company.employees[guid].promote("Captain"))
+        del reads[:]
+        self.repository.load(self.company.guid)
+        self.assertEqual([[guid]], reads)
+        self.assertEqual("Captain", self.company.employees[guid].title)
+
+
+class AggregateLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = CountingEventStore(
+            layout=recall.event_store.AGGREGATE_LAYOUT)
+        self.companies = []
+        for i in range(5):
+            company = domain.found("Company %d" % i, ["Fry", "Leela"])
+            company.employees.values()[0].promote("Captain")
+            self.companies.append(company)
+
+        self.get_repository().save_many(self.companies)
+        del self.event_store.calls[:]
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000)
+
+    def assert_one_read(self):
+        self.assertEqual(1, self.event_store.calls.count(
+            "get_aggregate_events_from_versions"))
+        self.assertNotIn("get_events_from_versions", self.event_store.calls)
+        self.assertNotIn("get_versions", self.event_store.calls)
+        del self.event_store.calls[:]
+
+    def test_one_stream_per_aggregate(self):
+        self.assertEqual(
+            sorted(company.guid for company in self.companies),
+            sorted(self.event_store.get_stream_guids()))
+        company = self.companies[0]
+        fry = company.employees.values()[0]
+        self.assertEqual(
+            [company.guid] * 3 + [fry.guid],
+            [guid for guid, _ in self.event_store.
+             get_aggregate_events_from_version(company.guid, 0)])
+
+    def test_load_many(self):
+        companies = self.get_repository().load_many(
+            [company.guid for company in self.companies])
+        self.assertEqual(
+            [domain.describe(company) for company in self.companies],
+            [domain.describe(company) for company in companies])
+        self.assert_one_read()
+
+    def test_catch_up_cached_roots(self):
+        repository = self.get_repository()
+        company = repository.load(self.companies[0].guid)
+        self.assert_one_read()
+
+        def promote(company):
+            company.employees.values()[1].promote("Pilot")
+            company.hire("Bender")
+
+        self.get_repository().execute(company.guid, promote)
+        del self.event_store.calls[:]
+        self.assertIs(company, repository.load(company.guid))
+        self.assert_one_read()
+        self.assertEqual(
+            domain.describe(self.get_repository().load(company.guid)),
+            domain.describe(company))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+import recall.event_store
+import recall.models
+import recall.repository
+import recall.serializer
+import recall.snapshot_store
+
+from tests import domain
+
+
+class Launched(recall.models.Event):
+    def __init__(self, guid, **data):
+        self._data = dict(data, guid=guid)
+
+
+class Reversed(recall.serializer.Json):
+    """
+    JSON, backwards, to tell its records apart
+    """
+    MARKER = "\x00\x7f"
+
+    def dumps(self, event, guid=None):
+        return self.MARKER + super(Reversed, self).dumps(event, guid)[::-1]
+
+    def loads(self, record):
+        return super(Reversed, self).loads(record[len(self.MARKER):][::-1])
+
+
+class SerializerTest(unittest.TestCase):
+    def setUp(self):
+        self.guid = uuid.uuid4()
+        self.event = Launched(
+            self.guid, name=u"Planet Express",
+            at=datetime.datetime(2999, 12, 31, 23, 59, 59, 1),
+            day=datetime.date(3000, 1, 1), payload="\x00\xff", count=3)
+
+    def assert_round_trip(self, serializer):
+        entity = uuid.uuid4()
+        for guid in (None, entity):
+            record = serializer.dumps(self.event, guid)
+            self.assertTrue(serializer.accepts(record))
+            loaded_guid, event = serializer.loads(record)
+            self.assertEqual(guid, loaded_guid)
+            self.assertIs(Launched, type(event))
+            self.assertEqual(self.event._data, event._data)
+
+    def test_json(self):
+        # JSON has no bytes
+        self.event._data.pop("payload")
+        serializer = recall.serializer.Json()
+        self.assert_round_trip(serializer)
+        self.assertEqual("{", serializer.dumps(self.event)[0])
+
+    def test_binary(self):
+        serializer = recall.serializer.Binary()
+        self.assert_round_trip(serializer)
+        record = serializer.dumps(self.event)
+        self.assertTrue(record.startswith(recall.serializer.Binary.MARKER))
+        self.assertFalse(recall.serializer.Json().dumps(
+            domain.CompanyFounded(self.guid, "Slurm")).startswith("\x00"))
+        _, event = serializer.loads(record)
+        self.assertIsInstance(event["name"], unicode)
+        self.assertIsInstance(event["payload"], str)
+
+    def test_get_serializer(self):
+        serializer = recall.serializer.Binary()
+        self.assertIs(serializer,
+                      recall.serializer.get_serializer(serializer))
+        self.assertIsInstance(
+            recall.serializer.get_serializer("recall.serializer.Binary"),
+            recall.serializer.Binary)
+        self.assertRaises(TypeError, recall.serializer.get_serializer,
+                          "recall.snapshot_store.Memory")
+
+
+class ReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "store.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, company, **kwargs):
+        store = recall.event_store.Sqlite(self.path, **kwargs)
+        recall.repository.Repository(
+            domain.Company, store, recall.snapshot_store.Memory(),
+            domain.Recorder(), 1000).save(company)
+        return store
+
+    def test_mixed_formats(self):
+        company = domain.found("Planet Express")
+        self.save(company)
+        company.hire("Fry")
+        self.save(company, serializer="recall.serializer.Binary")
+        company.hire("Leela")
+        store = self.save(company, serializer=Reversed())
+        records = [str(record) for record, in store._get_connection().execute(
+            "SELECT event FROM events ORDER BY sequence")]
+        self.assertEqual(["{", recall.serializer.Binary.MARKER,
+                          Reversed.MARKER],
+                         [records[0][:1], records[1][:2], records[2][:2]])
+
+        # Every store reads the built-in formats; others need a reader
+        store = recall.event_store.Sqlite(self.path, readers=[Reversed()])
+        self.assertEqual(
+            [domain.CompanyFounded, domain.EmployeeHired,
+             domain.EmployeeHired],
+            [type(event)
+             for event in store.get_all_events(company.guid)])
+        store = recall.event_store.Sqlite(self.path)
+        self.assertRaises(ValueError, store.get_all_events, company.guid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import unittest
+
+import recall.event_marshaler
+import recall.event_store
+import recall.repository
+import recall.snapshot_policy
+import recall.snapshot_store
+
+from tests import domain
+
+
+class SnapshotPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.root = domain.found("Planet Express")
+
+    def test_event_count(self):
+        policy = recall.snapshot_policy.EventCount(3)
+        policy.record_load(self.root, 1, 0.0)
+        policy.record_save(self.root, [None])
+        self.assertFalse(policy.should_snapshot(self.root))
+
+        # A save of several events can't skip past the frequency
+        policy.record_save(self.root, [None, None])
+        self.assertTrue(policy.should_snapshot(self.root))
+        policy.record_snapshot(self.root)
+        self.assertFalse(policy.should_snapshot(self.root))
+
+    def test_replay_time(self):
+        policy = recall.snapshot_policy.ReplayTime(0.05)
+        policy.record_save(self.root, [None] * 100)
+        self.assertFalse(policy.should_snapshot(self.root))
+        policy.record_load(self.root, 10, 0.02)
+        policy.record_save(self.root, [None] * 20)
+        self.assertTrue(policy.should_snapshot(self.root))
+
+    def test_replay_time_before_any_load(self):
+        policy = recall.snapshot_policy.ReplayTime(0.05, event_time=0.001)
+        policy.record_save(self.root, [None] * 49)
+        self.assertFalse(policy.should_snapshot(self.root))
+        policy.record_save(self.root, [None])
+        self.assertTrue(policy.should_snapshot(self.root))
+
+    def test_byte_size_of_encoded_events(self):
+        policy = recall.snapshot_policy.ByteSize(1000)
+        marshaler = recall.event_marshaler.DefaultEventMarshaler()
+        events = [domain.CompanyFounded(self.root.guid, "c%d" % i)
+                  for i in range(3)]
+        sizes = [len(marshaler.encode(event, json.dumps))
+                 for event in events]
+        policy.record_save(self.root, events)
+        self.assertEqual(sum(sizes), policy._get_state(self.root)[0])
+
+        # Events which weren't encoded are sampled, and estimated from the
+        # average size of those measured
+        recall.event_marshaler.clear_cache(events)
+        policy.record_save(self.root, events)
+        self.assertEqual(sum(sizes) + 3 * (sum(sizes) // 3),
+                         policy._get_state(self.root)[0])
+
+    def test_byte_size(self):
+        policy = recall.snapshot_policy.ByteSize(1000)
+        policy.record_load(self.root, 1000, 0.0)
+        self.assertFalse(policy.should_snapshot(self.root))
+        policy.record_save(self.root, ["x" * 500])
+        self.assertFalse(policy.should_snapshot(self.root))
+        policy.record_load(self.root, 1, 0.0)
+        policy.record_save(self.root, ["x" * 500])
+        self.assertTrue(policy.should_snapshot(self.root))
+
+    def test_roots_are_counted_apart(self):
+        policy = recall.snapshot_policy.EventCount(2)
+        other = domain.found("Mom's Friendly Robots")
+        policy.record_save(self.root, [None, None])
+        self.assertTrue(policy.should_snapshot(self.root))
+        self.assertFalse(policy.should_snapshot(other))
+
+
+class RepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot_store = recall.snapshot_store.Memory()
+        self.event_store = recall.event_store.Memory()
+
+    def get_repository(self):
+        return recall.repository.Repository(
+            domain.Company, self.event_store, self.snapshot_store,
+            domain.Recorder(), 3)
+
+    def test_snapshots_every_frequency_events(self):
+        repository = self.get_repository()
+        company = domain.found("Planet Express", ["Fry"])
+        repository.save(company)
+        self.assertIsNone(self.snapshot_store.load(company.guid))
+        company.hire("Leela")
+        repository.save(company)
+        self.assertEqual(2, len(
+            self.snapshot_store.load(company.guid).employees))
+        company.hire("Bender")
+        repository.save(company)
+        self.assertEqual(2, len(
+            self.snapshot_store.load(company.guid).employees))
+
+    def test_counts_replayed_events(self):
+        company = domain.found("Planet Express", ["Fry"])
+        self.get_repository().save(company)
+        repository = self.get_repository()
+        company = repository.load(company.guid)
+        self.assertFalse(repository._needs_snapshot(company))
+        company.hire("Leela")
+        repository.save(company)
+        self.assertIsNotNone(self.snapshot_store.load(company.guid))
+
+
+if __name__ == "__main__":
+    unittest.main()
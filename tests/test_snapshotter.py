@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+
+import recall.event_store
+import recall.instrumentation
+import recall.repository
+import recall.snapshot_store
+import recall.snapshotter
+
+from tests import domain
+
+
+class FailingStore(recall.snapshot_store.Memory):
+    def save(self, root):
+        raise IOError("The snapshot store is down")
+
+
+class BlockingStore(recall.snapshot_store.Memory):
+    """
+    Hold every snapshot write until released
+    """
+    def __init__(self):
+        super(BlockingStore, self).__init__()
+        self.released = threading.Event()
+
+    def save(self, root):
+        self.released.wait()
+        super(BlockingStore, self).save(root)
+
+
+class SnapshotterTest(object):
+    """
+    The tests every snapshotter passes, mixed into a
+    :class:`unittest.TestCase` which implements ``get_snapshotter``
+    """
+    def setUp(self):
+        self.snapshotter = self.get_snapshotter()
+        self.operations = []
+
+    def get_snapshotter(self):
+        raise NotImplementedError
+
+    def get_repository(self, snapshot_store):
+        return recall.repository.Repository(
+            domain.Company, recall.event_store.Memory(), snapshot_store,
+            domain.Recorder(), 1, snapshotter=self.snapshotter,
+            instrumentation=recall.instrumentation.Callback(
+                self.operations.append))
+
+    def flush(self):
+        pass
+
+    def test_records_written_snapshots(self):
+        repository = self.get_repository(recall.snapshot_store.Memory())
+        company = domain.found("Planet Express", ["Fry"])
+        repository.save(company)
+        self.flush()
+        self.assertFalse(repository._needs_snapshot(company))
+        self.assertEqual(domain.describe(company), domain.describe(
+            repository.snapshot_store.load(company.guid)))
+
+    def test_failed_snapshot_stays_due(self):
+        repository = self.get_repository(FailingStore())
+        company = domain.found("Planet Express")
+        try:
+            repository.save(company)
+        except IOError:
+            pass
+
+        self.flush()
+        self.assertTrue(repository._needs_snapshot(company))
+
+
+class InlineTest(SnapshotterTest, unittest.TestCase):
+    def get_snapshotter(self):
+        return recall.snapshotter.Inline()
+
+
+class BackgroundTest(SnapshotterTest, unittest.TestCase):
+    def get_snapshotter(self):
+        return recall.snapshotter.Background(max_queue=1)
+
+    def tearDown(self):
+        self.snapshotter.close()
+
+    def flush(self):
+        self.snapshotter.flush()
+
+    def wait_until_busy(self):
+        while not self.snapshotter.stats()["busy"]:
+            time.sleep(0.001)
+
+    def test_detached_loads_are_not_recorded(self):
+        repository = self.get_repository(recall.snapshot_store.Memory())
+        repository.save(domain.found("Planet Express"))
+        self.flush()
+        self.assertEqual(["save"], [op.kind for op in self.operations])
+
+    def test_merges_and_drops(self):
+        store = BlockingStore()
+        repository = self.get_repository(store)
+        first, second, third = [domain.found("c%d" % i) for i in range(3)]
+        repository.save(first)
+        self.wait_until_busy()
+        repository.save(second)
+        second.hire("Fry")
+        repository.save(second)
+        repository.save(third)
+        store.released.set()
+        self.flush()
+        stats = self.snapshotter.stats()
+        self.assertEqual((2, 1, 1), (
+            stats["written"], stats["merged"], stats["dropped"]))
+        self.assertEqual(0, stats["depth"])
+
+        # The merged snapshot has the latest events, and the dropped root is
+        # due again on its next save
+        self.assertEqual(1, len(store.load(second.guid).employees))
+        self.assertFalse(repository._needs_snapshot(second))
+        self.assertIsNone(store.load(third.guid))
+        self.assertTrue(repository._needs_snapshot(third))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+import recall.event_store
+import recall.repository
+import recall.snapshot_store
+import recall.unit_of_work
+
+from tests import domain
+
+
+class FailingStore(recall.event_store.Memory):
+    down = True
+
+    def save_many(self, entities):
+        if self.down:
+            raise IOError("The event store is down")
+
+        super(FailingStore, self).save_many(entities)
+
+
+class UnitOfWorkTest(unittest.TestCase):
+    def setUp(self):
+        self.event_store = recall.event_store.Memory()
+        self.router = domain.Recorder()
+
+    def get_repository(self, event_store=None):
+        return recall.repository.Repository(
+            domain.Company, event_store or self.event_store,
+            recall.snapshot_store.Memory(), self.router, 1000)
+
+    def test_commit(self):
+        first, second = self.get_repository(), self.get_repository()
+        planet_express = domain.found("Planet Express", ["Fry"])
+        robots = domain.found("Mom's Friendly Robots")
+        unchanged = domain.found("Slurm")
+        first.save(unchanged)
+        del self.router.events[:]
+        uow = recall.unit_of_work.UnitOfWork()
+        uow.register(first, planet_express)
+        uow.register(second, robots)
+        uow.register(second, robots)
+        uow.register(first, unchanged)
+        self.assertEqual(3, len(uow))
+        uow.commit()
+        self.assertEqual(0, len(uow))
+        self.assertEqual(3, len(self.router.events))
+        self.assertFalse(planet_express._has_events())
+        for root in (planet_express, robots):
+            self.assertEqual(
+                domain.describe(root),
+                domain.describe(self.get_repository().load(root.guid)))
+
+    def test_context_manager(self):
+        repository = self.get_repository()
+        company = domain.found("Planet Express")
+        with recall.unit_of_work.UnitOfWork() as uow:
+            uow.register(repository, company)
+
+        self.assertEqual(1, len(self.router.events))
+        self.assertFalse(company._has_events())
+
+    def test_rollback(self):
+        repository = self.get_repository()
+        company = domain.found("Planet Express")
+        try:
+            with recall.unit_of_work.UnitOfWork() as uow:
+                uow.register(repository, company)
+                raise ValueError("The command failed")
+        except ValueError:
+            pass
+
+        self.assertEqual(0, len(uow))
+        self.assertEqual([], self.router.events)
+        self.assertEqual(
+            {company.guid: 0}, self.event_store.get_versions([company.guid]))
+
+    def test_failed_commit(self):
+        repository = self.get_repository(FailingStore())
+        company = domain.found("Planet Express")
+        uow = recall.unit_of_work.UnitOfWork()
+        uow.register(repository, company)
+        self.assertRaises(IOError, uow.commit)
+        self.assertEqual([], self.router.events)
+        self.assertTrue(company._has_events())
+
+        # The events are still staged, so the root can be saved again
+        self.get_repository().save(company)
+        self.assertEqual(1, len(self.router.events))
+
+    def test_failure_in_a_later_store(self):
+        failing = FailingStore()
+        saved = domain.found("Planet Express", ["Fry"])
+        unsaved = domain.found("Mom's Friendly Robots")
+        uow = recall.unit_of_work.UnitOfWork()
+        uow.register(self.get_repository(), saved)
+        uow.register(self.get_repository(failing), unsaved)
+        self.assertRaises(IOError, uow.commit)
+
+        # The roots whose events were stored are routed and cleaned, and only
+        # the others stay registered
+        self.assertEqual(2, len(self.router.events))
+        self.assertFalse(saved._has_events())
+        self.assertTrue(unsaved._has_events())
+        self.assertEqual(1, len(uow))
+
+        failing.down = False
+        uow.commit()
+        self.assertEqual(3, len(self.router.events))
+        self.assertEqual(
+            {saved.guid: 2}, self.event_store.get_versions([saved.guid]))
+        self.assertEqual(
+            {unsaved.guid: 1}, failing.get_versions([unsaved.guid]))
+
+
+if __name__ == "__main__":
+    unittest.main()